@@ -0,0 +1,98 @@
+"""Import time of the app, per package and per module, against a startup budget.
+
+Run from the api directory: python -m benchmarks.imports [--module storeapi.main] [--top 15]
+[--budget-ms 1500] [--repeat 3]
+
+A worker imports the app before it can serve, so this is time every autoscaled worker waits.
+The module is imported in fresh interpreters: once with -X importtime for the breakdown, which
+inflates the times, and --repeat times without it for the total, of which the best is kept.
+With --budget-ms it exits with 1 when that total exceeds the budget.
+Set ENV_STATE (and the settings it needs) as for running the app.
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    # microseconds spent in the module itself, and with the modules it imported
+    self_us: int
+    cumulative_us: int
+
+
+def run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_timings(module: str) -> List[ImportTiming]:
+    """The modules importing module loads, as reported by python -X importtime."""
+    result = run_python(f"import {module}", "-X", "importtime")
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        timings.append(ImportTiming(name.strip(), int(self_us), int(cumulative_us)))
+    return timings
+
+
+def import_seconds(module: str, repeat: int = 3) -> float:
+    """The best wall clock time of importing module in a fresh interpreter."""
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)"
+    )
+    return min(float(run_python(code).stdout.splitlines()[-1]) for _ in range(repeat))
+
+
+def by_package(timings: List[ImportTiming]) -> Dict[str, int]:
+    packages: Dict[str, int] = defaultdict(int)
+    for timing in timings:
+        packages[timing.module.split(".")[0]] += timing.self_us
+    return packages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="storeapi.main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    timings = import_timings(args.module)
+    print(f"{'package':40} {'self ms':>10}")
+    packages = sorted(by_package(timings).items(), key=lambda item: -item[1])
+    for package, self_us in packages[: args.top]:
+        print(f"{package:40} {self_us / 1000:10.1f}")
+    print()
+    print(f"{'module':60} {'self ms':>10} {'cumul. ms':>10}")
+    for timing in sorted(timings, key=lambda timing: -timing.self_us)[: args.top]:
+        print(
+            f"{timing.module:60} {timing.self_us / 1000:10.1f} "
+            f"{timing.cumulative_us / 1000:10.1f}"
+        )
+
+    total_ms = import_seconds(args.module, args.repeat) * 1000
+    print()
+    print(f"import {args.module}: {total_ms:.0f} ms, best of {args.repeat}")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"over the budget of {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
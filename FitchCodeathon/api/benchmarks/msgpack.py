@@ -0,0 +1,90 @@
+"""Payload size and encode/decode time of JSON against MessagePack.
+
+Run from the api directory: python -m benchmarks.msgpack [--rows 10000] [--repeat 5]
+
+The payloads are lists of the Campaign and PaymentRecord response models, in the form the
+routes encode them (what TypeAdapter.dump_python(mode="json") returns).
+"""
+
+import argparse
+import gzip
+import json
+import timeit
+from datetime import datetime, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+
+from storeapi import serialization
+from storeapi.models.campaign import Campaign
+from storeapi.models.payment import PaymentRecord
+
+
+def payloads(count: int) -> dict:
+    campaigns = [
+        Campaign(
+            id=i,
+            name=f"Campaign {i}",
+            template="Together we can make a charity to support a great purpose",
+            isDraft=False,
+            isPublished=True,
+            isEnded=False,
+        )
+        for i in range(1, count + 1)
+    ]
+    start = datetime(2024, 9, 1)
+    payments = [
+        PaymentRecord(
+            id=i,
+            amount=round(5 + i % 200 * 0.75, 2),
+            status="success",
+            payment_method="paypal",
+            created_at=start + timedelta(minutes=i),
+        )
+        for i in range(1, count + 1)
+    ]
+    return {
+        "Campaign": TypeAdapter(List[Campaign]).dump_python(campaigns, mode="json"),
+        "PaymentRecord": TypeAdapter(List[PaymentRecord]).dump_python(
+            payments, mode="json"
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    orjson = serialization.import_orjson()
+    msgpack = serialization.import_msgpack()
+    if msgpack is None:
+        raise SystemExit("msgpack is not installed")
+
+    codecs = {
+        "json": (lambda c: json.dumps(c, separators=(",", ":")).encode(), json.loads)
+    }
+    if orjson is not None:
+        codecs["orjson"] = (orjson.dumps, orjson.loads)
+    codecs["msgpack"] = (msgpack.packb, msgpack.unpackb)
+
+    print(f"{args.rows} rows, best of {args.repeat}")
+    print(f"{'':24} {'bytes':>10} {'gzipped':>10} {'encode ms':>10} {'decode ms':>10}")
+    for model, content in payloads(args.rows).items():
+        for name, (dumps, loads) in codecs.items():
+            body = dumps(content)
+            encode = min(
+                timeit.repeat(lambda: dumps(content), number=1, repeat=args.repeat)
+            )
+            decode = min(
+                timeit.repeat(lambda: loads(body), number=1, repeat=args.repeat)
+            )
+            print(
+                f"{model + ' ' + name:24} {len(body):10} {len(gzip.compress(body)):10}"
+                f" {encode * 1000:10.2f} {decode * 1000:10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
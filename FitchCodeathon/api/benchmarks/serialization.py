@@ -0,0 +1,105 @@
+"""Per-row cost of encoding a campaign list response.
+
+Run from the api directory: python -m benchmarks.serialization [--rows 10000] [--repeat 5]
+
+Compares what FastAPI does for a handler with response_model=List[Campaign] (validate every row
+into a model, then dump it to JSON) with the trusted path of storeapi/serialization.py (a
+generated encoder per model, then orjson or the json module).
+"""
+
+import argparse
+import asyncio
+import timeit
+from typing import List
+
+import databases
+import sqlalchemy
+from pydantic import TypeAdapter
+
+from storeapi import serialization
+from storeapi.models.campaign import Campaign
+
+metadata = sqlalchemy.MetaData()
+campaigns = sqlalchemy.Table(
+    "campaigns",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("name", sqlalchemy.String(250)),
+    sqlalchemy.Column("template", sqlalchemy.String(250)),
+    sqlalchemy.Column("isDraft", sqlalchemy.Boolean),
+    sqlalchemy.Column("isPublished", sqlalchemy.Boolean),
+    sqlalchemy.Column("isEnded", sqlalchemy.Boolean),
+    sqlalchemy.Column("version", sqlalchemy.Integer),
+)
+
+
+async def fetch_rows(count: int) -> list:
+    # the Records handlers get from the databases package, from an in-memory SQLite
+    database = databases.Database("sqlite:///:memory:", force_rollback=True)
+    await database.connect()
+    try:
+        await database.execute(str(sqlalchemy.schema.CreateTable(campaigns)))
+        await database.execute_many(
+            campaigns.insert(),
+            [
+                {
+                    "id": i,
+                    "name": f"Campaign {i}",
+                    "template": "Together we can make a charity to support a great purpose",
+                    "isDraft": False,
+                    "isPublished": True,
+                    "isEnded": False,
+                    "version": 1,
+                }
+                for i in range(1, count + 1)
+            ],
+        )
+        return await database.fetch_all(campaigns.select())
+    finally:
+        await database.disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = asyncio.run(fetch_rows(args.rows))
+    adapter = TypeAdapter(List[Campaign])
+    orjson = serialization.import_orjson()
+
+    def validated():
+        # what FastAPI runs for response_model=List[Campaign]
+        return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+    def trusted_orjson():
+        return orjson.dumps(serialization.encode(List[Campaign], rows))
+
+    def trusted_json():
+        serialization._orjson = None
+        try:
+            return serialization.dumps(serialization.encode(List[Campaign], rows))
+        finally:
+            serialization._orjson = orjson
+
+    candidates = {
+        "response_model validation": validated,
+        "trusted + json": trusted_json,
+    }
+    if orjson is not None:
+        candidates["trusted + orjson"] = trusted_orjson
+
+    print(f"{args.rows} campaigns, best of {args.repeat}")
+    baseline = None
+    for name, function in candidates.items():
+        best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(
+            f"{name:28} {best * 1000:8.2f} ms  {best / args.rows * 1e6:6.2f} us/row"
+            f"  {baseline / best:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
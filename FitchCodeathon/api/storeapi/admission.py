@@ -0,0 +1,167 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from storeapi.metrics import ADMISSION_IN_FLIGHT, ADMISSION_SHED, ADMISSION_WAIT
+
+# Admission control, at most ADMISSION_MAX_IN_FLIGHT requests per worker, classed by route
+# Lower classes may fill less of the capacity and are shed first, see RouteClass
+
+
+@dataclass(frozen=True)
+class RouteClass:
+    name: str
+    # higher is admitted first
+    priority: int
+    # of the capacity the class may fill
+    share: float
+    # seconds a request may wait for a slot before it is shed
+    max_wait: float
+
+
+PAYMENT = RouteClass("payment", priority=3, share=1.0, max_wait=5.0)
+AUTH = RouteClass("auth", priority=2, share=0.9, max_wait=2.0)
+ADMIN = RouteClass("admin", priority=1, share=0.8, max_wait=2.0)
+PUBLIC = RouteClass("public", priority=0, share=0.6, max_wait=0.5)
+ROUTE_CLASSES = (PAYMENT, AUTH, ADMIN, PUBLIC)
+
+# the first matching path prefix gives the class, anything else is public
+ROUTE_PREFIXES: Tuple[Tuple[str, RouteClass], ...] = (
+    ("/user/payment", PAYMENT),
+    ("/donor/", PAYMENT),
+    ("/user/login", AUTH),
+    ("/user/register", AUTH),
+    ("/user/refresh", AUTH),
+    ("/user/logout", AUTH),
+    ("/admin/", ADMIN),
+)
+EXEMPT_PATHS = {"/health", "/ready", "/metrics"}
+
+
+def route_class(path: str) -> Optional[RouteClass]:
+    """The class of a request path, None for the paths never queued nor shed."""
+    if path in EXEMPT_PATHS:
+        return None
+    for prefix, cls in ROUTE_PREFIXES:
+        if path.startswith(prefix):
+            return cls
+    return PUBLIC
+
+
+class AdmissionController:
+    """Priority-aware concurrency limits with bounded queueing, for one event loop."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.in_flight = 0
+        # class name -> the requests waiting for a slot, oldest first, with when they arrived
+        self._waiting: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {
+            cls.name: deque() for cls in ROUTE_CLASSES
+        }
+
+    def limit(self, cls: RouteClass) -> int:
+        return max(math.ceil(self.capacity * cls.share), 1)
+
+    async def admit(self, cls: RouteClass) -> bool:
+        """Wait for a slot for a request of the class, False when it is shed."""
+        now = time.monotonic()
+        if self.in_flight < self.limit(cls) and not self._waiting_before(cls):
+            self._take(cls)
+            ADMISSION_WAIT.observe(0.0, cls.name)
+            return True
+
+        waiting = self._waiting[cls.name]
+        if waiting and now - waiting[0][1] > cls.max_wait / 2:
+            ADMISSION_SHED.inc(cls.name)
+            return False
+
+        slot = asyncio.get_running_loop().create_future()
+        entry = (slot, now)
+        waiting.append(entry)
+        try:
+            await asyncio.wait({slot}, timeout=cls.max_wait)
+        except asyncio.CancelledError:
+            # the client went away while waiting
+            self._abandon(cls, entry)
+            raise
+        ADMISSION_WAIT.observe(time.monotonic() - now, cls.name)
+        if slot.done():
+            # release() took the slot on the request's behalf
+            return True
+        self._abandon(cls, entry)
+        ADMISSION_SHED.inc(cls.name)
+        return False
+
+    def release(self, cls: RouteClass) -> None:
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec(cls.name)
+        # hand the freed slot to the highest priority request that may have it
+        for waiting_cls in ROUTE_CLASSES:
+            waiting = self._waiting[waiting_cls.name]
+            if waiting and self.in_flight < self.limit(waiting_cls):
+                slot, _ = waiting.popleft()
+                self._take(waiting_cls)
+                slot.set_result(True)
+                return
+
+    def _abandon(self, cls: RouteClass, entry: Tuple[asyncio.Future, float]) -> None:
+        slot, _ = entry
+        if slot.done():
+            self.release(cls)
+        else:
+            self._waiting[cls.name].remove(entry)
+            slot.cancel()
+
+    def _take(self, cls: RouteClass) -> None:
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.inc(cls.name)
+
+    def _waiting_before(self, cls: RouteClass) -> bool:
+        # requests of the class or of a higher priority already waiting go first
+        return any(
+            self._waiting[other.name]
+            for other in ROUTE_CLASSES
+            if other.priority >= cls.priority
+        )
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware queueing and shedding requests by route class, see above."""
+
+    def __init__(self, app, max_in_flight: int = 100, retry_after: int = 2) -> None:
+        self.app = app
+        self.controller = AdmissionController(max_in_flight)
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send) -> None:
+        cls = route_class(scope["path"]) if scope["type"] == "http" else None
+        if cls is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.admit(cls):
+            await self.shed(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(cls)
+
+    async def shed(self, send) -> None:
+        body = json.dumps({"detail": "The server is overloaded, retry later"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -9,8 +9,9 @@ from httpx import AsyncClient, ASGITransport, Request, Response
 # make sure that the tests use the test database
 # doing this effectively overwrites the value of ENV_STATE as read from the .env file
 os.environ["ENV_STATE"] = "test"
-from storeapi.database import database  # noqa: E402
+from storeapi.database import create_tables, database  # noqa: E402
 from storeapi.main import app  # noqa: E402
+from storeapi.security import valid_access_token  # noqa: E402
 
 
 # with scope set to session the fixture will only run once before all tests are executed
@@ -20,6 +21,22 @@ def anyio_backend():
     return "asyncio"
 
 
+# the app creates the tables in its lifespan, which the test clients do not run
+@pytest.fixture(scope="session", autouse=True)
+def tables():
+    create_tables()
+
+
+# the tests call the admin routes as a Keycloak admin, tests can override the token data further
+# and every override is removed once the test is done
+@pytest.fixture(autouse=True)
+def access_token() -> Generator:
+    token_data = {"resource_access": {"elbaapi": {"roles": ["admin"]}}}
+    app.dependency_overrides[valid_access_token] = lambda: token_data
+    yield token_data
+    app.dependency_overrides.clear()
+
+
 @pytest.fixture()
 def api_test_client() -> Generator:
     yield TestClient(app)
@@ -0,0 +1,99 @@
+from datetime import datetime
+
+import pytest
+from httpx import AsyncClient
+
+from storeapi.database import (
+    database,
+    payment_rollups,
+    record_payment_rollup,
+    store_payment,
+)
+
+
+@pytest.fixture
+async def settled_payments():
+    # campaign 1: two payments in the same hour and one the next day
+    await record_payment_rollup(1, 10.0, datetime(2024, 9, 1, 9, 15))
+    await record_payment_rollup(1, 20.0, datetime(2024, 9, 1, 9, 45))
+    await record_payment_rollup(1, 30.0, datetime(2024, 9, 2, 18, 5))
+    # campaign 2: a single payment
+    await record_payment_rollup(2, 5.0, datetime(2024, 9, 1, 23, 30))
+
+
+@pytest.mark.anyio
+async def test_analytics_daily_buckets(
+    settled_payments, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get(
+        "/admin/analytics",
+        params={"start": "2024-09-01T00:00:00", "end": "2024-09-03T00:00:00"},
+    )
+
+    assert response.status_code == 200
+    responseJson = response.json()
+    buckets = [
+        (bucket["campaign_id"], bucket["bucket_start"][:10], bucket["total_amount"])
+        for bucket in responseJson["buckets"]
+    ]
+    assert buckets == [
+        (1, "2024-09-01", 30.0),
+        (1, "2024-09-02", 30.0),
+        (2, "2024-09-01", 5.0),
+    ]
+    assert responseJson["totals"][0] == {
+        "campaign_id": 1,
+        "total_amount": 60.0,
+        "payment_count": 3,
+        "average_amount": 20.0,
+    }
+
+
+@pytest.mark.anyio
+async def test_analytics_totals_merge_hour_and_day_buckets(
+    settled_payments, async_api_test_client: AsyncClient
+):
+    # from the middle of the first day to the middle of the third: the 09:00 payments fall
+    # outside the range, the 23:30 and the whole of the 2nd fall inside it
+    response = await async_api_test_client.get(
+        "/admin/analytics",
+        params={
+            "start": "2024-09-01T12:00:00",
+            "end": "2024-09-03T06:00:00",
+            "granularity": "hour",
+        },
+    )
+
+    assert response.status_code == 200
+    totals = {
+        total["campaign_id"]: total["total_amount"]
+        for total in response.json()["totals"]
+    }
+    assert totals == {1: 30.0, 2: 5.0}
+
+
+@pytest.mark.anyio
+async def test_analytics_rejects_empty_range(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.get(
+        "/admin/analytics",
+        params={"start": "2024-09-02T00:00:00", "end": "2024-09-01T00:00:00"},
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_store_payment_rolls_up_settled_payments_only():
+    await store_payment(
+        user_id=1, amount=25.0, status="success", payment_method="paypal", campaign_id=7
+    )
+    await store_payment(
+        user_id=1, amount=99.0, status="failed", payment_method="paypal", campaign_id=7
+    )
+
+    query = payment_rollups.select().where(payment_rollups.c.campaign_id == 7)
+    rollups = await database.fetch_all(query)
+
+    assert sorted(row["granularity"] for row in rollups) == ["day", "hour"]
+    assert all(row["total_amount"] == 25.0 for row in rollups)
+    assert all(row["payment_count"] == 1 for row in rollups)
@@ -1,16 +1,5 @@
 import pytest
 from httpx import AsyncClient
-from storeapi.main import app
-from storeapi.security import valid_access_token
-
-
-@pytest.fixture(autouse=True)
-def access_token():
-    # Mock the token data
-    token_data = {"resource_access": {"elbaapi": {"roles": ["admin"]}}}
-
-    # Mock the valid_access_token dependency
-    app.dependency_overrides[valid_access_token] = lambda: token_data
 
 
 @pytest.fixture
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+
+from storeapi.main import app
+from storeapi.security import valid_access_token
+
+
+@pytest.mark.anyio
+async def test_cpu_profile_returns_collapsed_stacks(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.get(
+        "/admin/debug/profile", params={"seconds": 0.2, "interval_ms": 5}
+    )
+
+    assert response.status_code == 200
+    assert int(response.headers["x-profile-samples"]) > 0
+    stack, count = response.text.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert ";" in stack
+
+
+@pytest.mark.anyio
+async def test_tracemalloc_session(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.post(
+        "/admin/debug/tracemalloc/start", params={"frames": 5}
+    )
+    assert response.status_code == 200
+
+    try:
+        response = await async_api_test_client.post("/admin/debug/tracemalloc/start")
+        assert response.status_code == 409
+
+        retained = [bytearray(1024) for _ in range(1000)]  # noqa: F841
+        response = await async_api_test_client.get("/admin/debug/tracemalloc/snapshot")
+        assert response.status_code == 200
+        assert response.json()["traced_current_bytes"] > 1024 * 1000
+        assert response.json()["top"]
+    finally:
+        response = await async_api_test_client.post("/admin/debug/tracemalloc/stop")
+    assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_tracemalloc_stop_during_snapshot(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.post("/admin/debug/tracemalloc/start")
+    assert response.status_code == 200
+    retained = [bytearray(1024) for _ in range(1000)]  # noqa: F841
+
+    snapshot, stop = await asyncio.gather(
+        async_api_test_client.get("/admin/debug/tracemalloc/snapshot"),
+        async_api_test_client.post("/admin/debug/tracemalloc/stop"),
+    )
+
+    assert stop.status_code == 200
+    assert snapshot.status_code in (200, 400)
+    response = await async_api_test_client.get("/admin/debug/tracemalloc/snapshot")
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_debug_routes_require_admin(async_api_test_client: AsyncClient):
+    app.dependency_overrides[valid_access_token] = lambda: {"resource_access": {}}
+
+    response = await async_api_test_client.get("/admin/debug/blocked-calls")
+
+    assert response.status_code == 403
@@ -0,0 +1,148 @@
+import csv
+import gzip
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.dialects import postgresql
+
+from storeapi.database import database, payments, refund_requests, utcnow
+
+
+@pytest.fixture
+async def exported_payments() -> list:
+    created = datetime(2024, 9, 1, 12, 0, 0)
+    payment_ids = []
+    for i in range(3):
+        payment_id = await database.execute(
+            payments.insert().values(
+                user_id=1,
+                amount=10.0 + i,
+                status="success",
+                payment_method="paypal",
+                created_at=created + timedelta(days=i),
+                updated_at=created + timedelta(days=i),
+            )
+        )
+        payment_ids.append(payment_id)
+    return payment_ids
+
+
+def read_csv(response) -> list:
+    rows = csv.DictReader(io.StringIO(gzip.decompress(response.content).decode()))
+    return [int(row["id"]) for row in rows]
+
+
+@pytest.mark.anyio
+async def test_export_csv_date_range(
+    exported_payments: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get(
+        "/admin/export/payments",
+        params={"start": "2024-09-02T00:00:00", "end": "2024-09-10T00:00:00"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    assert read_csv(response) == exported_payments[1:]
+
+
+@pytest.mark.anyio
+async def test_export_since_last_advances_watermark(
+    exported_payments: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get(
+        "/admin/export/payments", params={"since_last": True}
+    )
+    assert read_csv(response) == exported_payments
+
+    await database.execute(
+        payments.insert().values(
+            user_id=1,
+            amount=50.0,
+            status="success",
+            payment_method="paypal",
+            created_at=datetime(2024, 9, 5, 12, 0, 0),
+            updated_at=datetime(2024, 9, 5, 12, 0, 0),
+        )
+    )
+
+    response = await async_api_test_client.get(
+        "/admin/export/payments", params={"since_last": True}
+    )
+    assert len(read_csv(response)) == 1
+
+
+@pytest.mark.anyio
+async def test_export_since_last_picks_up_refund_decisions(
+    async_api_test_client: AsyncClient,
+):
+    created = datetime(2024, 9, 1, 12, 0, 0)
+    refund_id = await database.execute(
+        refund_requests.insert().values(
+            user_id=1,
+            payment_id=1,
+            amount=5.0,
+            status="pending",
+            created_at=created,
+            updated_at=created,
+        )
+    )
+    response = await async_api_test_client.get(
+        "/admin/export/refund_requests", params={"since_last": True}
+    )
+    assert read_csv(response) == [refund_id]
+
+    # approved long after it was created, and after the last export
+    await database.execute(
+        refund_requests.update()
+        .where(refund_requests.c.id == refund_id)
+        .values(status="approved", updated_at=created + timedelta(days=3))
+    )
+
+    response = await async_api_test_client.get(
+        "/admin/export/refund_requests", params={"since_last": True}
+    )
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode())))
+    assert [(int(row["id"]), row["status"]) for row in rows] == [
+        (refund_id, "approved")
+    ]
+
+
+@pytest.mark.anyio
+async def test_updates_stamped_in_utc_by_the_database():
+    refund_id = await database.execute(
+        refund_requests.insert().values(
+            user_id=1, payment_id=1, amount=5.0, status="pending"
+        )
+    )
+    await database.execute(
+        refund_requests.update()
+        .where(refund_requests.c.id == refund_id)
+        .values(status="approved")
+    )
+
+    query = refund_requests.select().where(refund_requests.c.id == refund_id)
+    updated_at = (await database.fetch_one(query))["updated_at"]
+    assert abs(updated_at - datetime.utcnow()) < timedelta(minutes=1)
+    # Postgres' now() is in the session's time zone
+    assert str(utcnow().compile(dialect=postgresql.dialect())) == (
+        "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+    )
+
+
+@pytest.mark.anyio
+async def test_export_parquet(
+    exported_payments: list, async_api_test_client: AsyncClient
+):
+    parquet = pytest.importorskip("pyarrow.parquet")
+
+    response = await async_api_test_client.get(
+        "/admin/export/payments", params={"format": "parquet"}
+    )
+
+    assert response.status_code == 200
+    table = parquet.read_table(io.BytesIO(response.content))
+    assert table.column("id").to_pylist() == exported_payments
+    assert table.column("amount").to_pylist() == [10.0, 11.0, 12.0]
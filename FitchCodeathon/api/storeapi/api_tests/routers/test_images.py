@@ -0,0 +1,67 @@
+import io
+
+import pytest
+from httpx import AsyncClient
+
+from storeapi.images import DiskLRUCache
+from storeapi.routers import images
+
+PIL = pytest.importorskip("PIL.Image")
+
+IMAGE = "banner/bannerThumb1_1.jpg"
+
+
+@pytest.fixture(autouse=True)
+def image_cache(tmp_path, monkeypatch):
+    cache = DiskLRUCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+    monkeypatch.setattr(images, "image_cache", cache)
+    return cache
+
+
+@pytest.mark.anyio
+async def test_resize_negotiates_format(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.get(
+        f"/images/{IMAGE}", params={"w": 300}, headers={"Accept": "image/webp,image/*"}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "Accept" in response.headers["vary"]
+    # widths are rounded up to the nearest of WIDTHS
+    assert PIL.open(io.BytesIO(response.content)).width == 320
+
+
+@pytest.mark.anyio
+async def test_resize_is_cached(
+    async_api_test_client: AsyncClient, image_cache: DiskLRUCache
+):
+    params = {"w": 640, "format": "original"}
+    first = await async_api_test_client.get(f"/images/{IMAGE}", params=params)
+    second = await async_api_test_client.get(f"/images/{IMAGE}", params=params)
+
+    assert first.headers["content-type"] == "image/jpeg"
+    assert first.content == second.content
+    assert len(image_cache._entries) == 1
+
+
+@pytest.mark.anyio
+async def test_resize_rejects_paths_outside_images(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.get(
+        "/images/..%2F..%2Fstarter.html", params={"w": 320}
+    )
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=20)
+    cache.put("a", b"x" * 10)
+    cache.put("b", b"x" * 10)
+    cache.get("a")
+
+    cache.put("c", b"x" * 10)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert not (tmp_path / "b").exists()
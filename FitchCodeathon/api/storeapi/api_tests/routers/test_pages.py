@@ -0,0 +1,136 @@
+import os
+from datetime import datetime
+
+import pytest
+from httpx import AsyncClient
+
+from storeapi.assets import FRONTEND_DIR
+from storeapi.campaign_cache import FragmentCache, fragment_cache
+from storeapi.database import record_payment_rollup
+from storeapi.templating import precompile
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def empty_fragment_cache():
+    fragment_cache.clear()
+
+
+async def create_campaign(client: AsyncClient, name: str, publish: bool = True) -> dict:
+    campaign_data = {"name": name, "template": f"{name} <needs> help", "isDraft": True}
+    response = await client.post("/admin/campaign", json=campaign_data)
+    campaign = response.json()
+    if publish:
+        response = await client.patch(
+            f"/admin/campaign/{campaign['id']}",
+            json={**campaign_data, "isDraft": False, "isPublished": True},
+        )
+        campaign = response.json()
+    return campaign
+
+
+async def test_precompile_loads_every_template():
+    assert precompile() >= 4
+
+
+async def test_campaigns_page_renders_published_campaigns(
+    async_api_test_client: AsyncClient,
+):
+    published = await create_campaign(async_api_test_client, "Food bank")
+    await create_campaign(async_api_test_client, "Secret draft", publish=False)
+    await record_payment_rollup(published["id"], 1250.0, datetime(2024, 9, 1, 9, 15))
+
+    response = await async_api_test_client.get("/campaigns")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert "Food bank" in response.text
+    assert "Food bank &lt;needs&gt; help" in response.text
+    assert f'href="/campaigns/{published["id"]}"' in response.text
+    assert "£1,250" in response.text
+    assert "Secret draft" not in response.text
+
+
+async def test_home_page_renders_first_campaigns(async_api_test_client: AsyncClient):
+    for name in ("Food bank", "Shelter", "School books", "Clean water"):
+        await create_campaign(async_api_test_client, name)
+
+    response = await async_api_test_client.get("/home")
+
+    assert response.status_code == 200
+    assert "Food bank" in response.text
+    assert "School books" in response.text
+    assert "Clean water" not in response.text
+    assert 'href="/campaigns"' in response.text
+
+
+async def test_static_pages_link_to_rendered_pages():
+    for name in os.listdir(FRONTEND_DIR):
+        if name.endswith(".html"):
+            with open(os.path.join(FRONTEND_DIR, name), encoding="utf-8") as f:
+                page = f.read()
+            for shell in ("index.html", "campians.html", "causes-details.html"):
+                assert shell not in page, f"{name} links to {shell}"
+
+
+async def test_campaign_page_renders_donation_form(async_api_test_client: AsyncClient):
+    campaign = await create_campaign(async_api_test_client, "Food bank")
+
+    response = await async_api_test_client.get(f"/campaigns/{campaign['id']}")
+
+    assert response.status_code == 200
+    assert f'data-campaign-id="{campaign["id"]}"' in response.text
+    assert 'id="paypal-button-container"' in response.text
+
+
+async def test_campaign_page_not_found_for_drafts(async_api_test_client: AsyncClient):
+    draft = await create_campaign(async_api_test_client, "Secret draft", publish=False)
+
+    response = await async_api_test_client.get(f"/campaigns/{draft['id']}")
+
+    assert response.status_code == 404
+
+
+async def test_fragments_are_reused_until_the_campaign_changes(
+    async_api_test_client: AsyncClient,
+):
+    campaign = await create_campaign(async_api_test_client, "Food bank")
+    assert campaign["version"] == 2
+
+    await async_api_test_client.get("/campaigns")
+    assert len(fragment_cache) == 1
+    await async_api_test_client.get("/campaigns")
+    assert len(fragment_cache) == 1
+
+    # ending the campaign bumps its version and drops its fragments
+    response = await async_api_test_client.patch(
+        f"/admin/campaign/{campaign['id']}",
+        json={"name": "Food bank", "template": "x", "isDraft": False, "isEnded": True},
+    )
+    assert response.json()["version"] == 3
+    assert len(fragment_cache) == 0
+
+
+async def test_fragment_cache_evicts_and_invalidates():
+    cache = FragmentCache(max_entries=2)
+    renders = []
+
+    def render(text):
+        renders.append(text)
+        return text
+
+    assert (
+        cache.get_or_render(("card", 1, 1), lambda: render("<b>one</b>"))
+        == "<b>one</b>"
+    )
+    cache.get_or_render(("card", 1, 1), lambda: render("again"))
+    cache.get_or_render(("card", 2, 1), lambda: render("two"))
+    cache.get_or_render(("card", 3, 1), lambda: render("three"))
+
+    assert renders == ["<b>one</b>", "two", "three"]
+    assert len(cache) == 2
+    # the first card was evicted, the invalidation only finds the third
+    assert cache.invalidate(1) == 0
+    assert cache.invalidate(3) == 1
+    assert len(cache) == 1
@@ -0,0 +1,517 @@
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from jose import jwt
+
+from storeapi import refresh_tokens as refresh_tokens_module
+from storeapi.config import config
+from storeapi.database import (
+    database,
+    payment_rollups,
+    payments,
+    refresh_tokens,
+    refund_requests,
+    users,
+)
+from storeapi.rate_limit import rate_limiter
+from storeapi.refresh_tokens import hash_token, issue_refresh_token
+from storeapi.routers import user_routes
+from storeapi.security import create_access_token
+
+
+@pytest.fixture
+async def donor() -> dict:
+    user_data = {
+        "username": "donor",
+        "email": "donor@example.com",
+        "hashed_password": "not-a-real-hash",
+    }
+    user_id = await database.execute(users.insert().values(user_data))
+    return {**user_data, "id": user_id}
+
+
+@pytest.fixture
+async def refunds(donor: dict) -> list:
+    # five refunds a minute apart, the last one already processed
+    created = datetime(2024, 9, 1, 12, 0, 0)
+    refund_ids = []
+    for i in range(5):
+        payment_id = await database.execute(
+            payments.insert().values(
+                user_id=donor["id"],
+                amount=10.0 + i,
+                status="success",
+                payment_method="paypal",
+                created_at=created + timedelta(minutes=i),
+            )
+        )
+        refund_id = await database.execute(
+            refund_requests.insert().values(
+                user_id=donor["id"],
+                payment_id=payment_id,
+                amount=5.0,
+                status="approved" if i == 4 else "pending",
+                created_at=created + timedelta(minutes=i),
+            )
+        )
+        refund_ids.append(refund_id)
+    return refund_ids
+
+
+@pytest.mark.anyio
+async def test_list_refunds_pages_through_pending(
+    refunds: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get("/admin/refunds", params={"limit": 3})
+
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [item["id"] for item in first_page["items"]] == refunds[:3]
+    assert first_page["items"][0]["payment"]["amount"] == 10.0
+    assert first_page["items"][0]["user"]["email"] == "donor@example.com"
+    assert first_page["next_cursor"] is not None
+
+    response = await async_api_test_client.get(
+        "/admin/refunds", params={"limit": 3, "cursor": first_page["next_cursor"]}
+    )
+
+    second_page = response.json()
+    assert [item["id"] for item in second_page["items"]] == refunds[3:4]
+    assert second_page["next_cursor"] is None
+
+
+@pytest.mark.anyio
+async def test_list_refunds_filters_by_status(
+    refunds: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get(
+        "/admin/refunds", params={"status": "approved"}
+    )
+
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == refunds[4:]
+
+
+@pytest.mark.anyio
+async def test_list_refunds_rejects_invalid_cursor(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.get(
+        "/admin/refunds", params={"cursor": "not-a-cursor"}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.fixture
+async def donor_payments(donor: dict) -> list:
+    created = datetime(2024, 9, 1, 12, 0, 0)
+    payment_ids = []
+    for i in range(5):
+        payment_id = await database.execute(
+            payments.insert().values(
+                user_id=donor["id"],
+                amount=10.0 + i,
+                status="success",
+                payment_method="paypal",
+                created_at=created + timedelta(days=i),
+            )
+        )
+        payment_ids.append(payment_id)
+    return payment_ids
+
+
+@pytest.fixture
+def donor_token(donor: dict, async_api_test_client: AsyncClient):
+    # the history is that of the user the token was issued to
+    token = create_access_token(data={"sub": donor["email"]})
+    async_api_test_client.headers["Authorization"] = f"Bearer {token}"
+
+
+@pytest.mark.anyio
+async def test_payment_history_streams_all_payments_newest_first(
+    donor_token, donor_payments: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get("/user/payments")
+
+    assert response.status_code == 200
+    responseJson = response.json()
+    assert [item["id"] for item in responseJson["items"]] == donor_payments[::-1]
+    assert responseJson["items"][0]["amount"] == 14.0
+    assert responseJson["next_cursor"] is None
+
+
+@pytest.mark.anyio
+async def test_payment_history_pages_with_cursor(
+    donor_token, donor_payments: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get("/user/payments", params={"limit": 3})
+
+    first_page = response.json()
+    assert [item["id"] for item in first_page["items"]] == donor_payments[:1:-1]
+    assert first_page["next_cursor"] is not None
+
+    response = await async_api_test_client.get(
+        "/user/payments",
+        params={"limit": 3, "cursor": first_page["next_cursor"]},
+    )
+
+    second_page = response.json()
+    assert [item["id"] for item in second_page["items"]] == donor_payments[1::-1]
+    assert second_page["next_cursor"] is None
+
+
+@pytest.mark.anyio
+async def test_payment_history_ignores_email_parameter(
+    donor: dict, donor_payments: list, async_api_test_client: AsyncClient
+):
+    # without a token, naming the donor in the query does not help
+    response = await async_api_test_client.get(
+        "/user/payments", params={"email": donor["email"]}
+    )
+
+    assert response.status_code == 401
+
+
+@pytest.fixture
+def paypal(monkeypatch) -> list:
+    # PayPal creates the payment and later executes it as approved, calls are recorded
+    calls = []
+
+    def create_paypal_payment(token, payment):
+        calls.append("create")
+        return {
+            "id": "PAY-1",
+            "state": "created",
+            "links": [{}, {"href": "https://paypal.test/approve"}],
+        }
+
+    def execute_paypal_payment(token, paypal_payment_id, payer_id):
+        calls.append("execute")
+        return {"id": paypal_payment_id, "state": "approved"}
+
+    client = user_routes.paypal_client()
+    monkeypatch.setattr(client, "fetch_paypal_token", lambda: "token")
+    monkeypatch.setattr(client, "create_paypal_payment", create_paypal_payment)
+    monkeypatch.setattr(client, "execute_paypal_payment", execute_paypal_payment)
+    return calls
+
+
+async def campaign_rollups(campaign_id: int) -> list:
+    query = payment_rollups.select().where(payment_rollups.c.campaign_id == campaign_id)
+    return await database.fetch_all(query)
+
+
+@pytest.mark.anyio
+async def test_executed_payment_settles_and_rolls_up(
+    donor: dict, donor_token, paypal: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.post(
+        "/user/payment",
+        json={
+            "payment_method": "paypal",
+            "amount": 25.0,
+            "status": "pending",
+            "transaction_id": "",
+            "campaign_id": 8,
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "created"
+    # not settled until it is executed
+    assert await campaign_rollups(8) == []
+
+    execution = {"paypal_payment_id": "PAY-1", "payer_id": "PAYER-1"}
+    response = await async_api_test_client.post("/user/payment/execute", json=execution)
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "approved"
+    rollups = await campaign_rollups(8)
+    assert sorted(row["granularity"] for row in rollups) == ["day", "hour"]
+    assert all(row["total_amount"] == 25.0 for row in rollups)
+
+    # executing again neither calls PayPal nor counts the payment twice
+    response = await async_api_test_client.post("/user/payment/execute", json=execution)
+
+    assert response.json()["status"] == "approved"
+    assert paypal == ["create", "execute"]
+    assert all(row["payment_count"] == 1 for row in await campaign_rollups(8))
+
+
+@pytest.mark.anyio
+async def test_execute_payment_of_another_user(
+    donor_token, paypal: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.post(
+        "/user/payment/execute",
+        json={"paypal_payment_id": "PAY-1", "payer_id": "PAYER-1"},
+    )
+
+    assert response.status_code == 404
+    assert paypal == []
+
+
+@pytest.fixture
+def login_limits(monkeypatch):
+    monkeypatch.setattr(config, "RATE_LIMIT_IP_ATTEMPTS", 3)
+    monkeypatch.setattr(config, "RATE_LIMIT_EMAIL_ATTEMPTS", 2)
+    rate_limiter.clear()
+    yield
+    rate_limiter.clear()
+
+
+@pytest.fixture
+def password_checks(monkeypatch) -> list:
+    checks = []
+
+    def verify_password(plain_password: str, hashed_password: str) -> bool:
+        checks.append(plain_password)
+        return False
+
+    monkeypatch.setattr(user_routes, "verify_password", verify_password)
+    return checks
+
+
+@pytest.mark.anyio
+async def test_login_limited_by_email_before_password_check(
+    donor: dict, login_limits, password_checks: list, async_api_test_client: AsyncClient
+):
+    credentials = {"email": "donor@example.com", "password": "guess"}
+    statuses = [
+        (await async_api_test_client.post("/user/login", json=credentials)).status_code
+        for _ in range(3)
+    ]
+
+    assert statuses == [401, 401, 429]
+    assert len(password_checks) == 2
+    response = await async_api_test_client.post("/user/login", json=credentials)
+    assert response.status_code == 429
+    assert 0 < int(response.headers["retry-after"]) <= config.RATE_LIMIT_WINDOW
+
+
+@pytest.mark.anyio
+async def test_login_limited_by_client_address(
+    donor: dict, login_limits, password_checks: list, async_api_test_client: AsyncClient
+):
+    statuses = [
+        (
+            await async_api_test_client.post(
+                "/user/login",
+                json={"email": f"user{i}@example.com", "password": "guess"},
+            )
+        ).status_code
+        for i in range(4)
+    ]
+
+    assert statuses == [401, 401, 401, 429]
+
+
+@pytest.mark.anyio
+async def test_register_limited_before_hashing(
+    login_limits, monkeypatch, async_api_test_client: AsyncClient
+):
+    hashed = []
+    monkeypatch.setattr(
+        user_routes, "get_password_hash", lambda password: hashed.append(1) or "x"
+    )
+    user = {"name": "new", "email": "new@example.com", "password": "secret"}
+
+    statuses = [
+        (await async_api_test_client.post("/user/register", json=user)).status_code
+        for _ in range(3)
+    ]
+
+    assert statuses == [201, 400, 429]
+    assert len(hashed) == 1
+
+
+@pytest.fixture
+async def session(donor: dict, monkeypatch, async_api_test_client: AsyncClient) -> dict:
+    monkeypatch.setattr(
+        user_routes, "verify_password", lambda plain, hashed: plain == "secret"
+    )
+    response = await async_api_test_client.post(
+        "/user/login", json={"email": "donor@example.com", "password": "secret"}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.anyio
+async def test_refresh_rotates_without_password_check(
+    session: dict, monkeypatch, async_api_test_client: AsyncClient
+):
+    def verify_password(plain_password: str, hashed_password: str) -> bool:
+        raise AssertionError("a refresh must not verify the password")
+
+    monkeypatch.setattr(user_routes, "verify_password", verify_password)
+
+    response = await async_api_test_client.post(
+        "/user/refresh", json={"refresh_token": session["refresh_token"]}
+    )
+
+    assert response.status_code == 200
+    tokens = response.json()
+    assert tokens["access_token"]
+    assert tokens["refresh_token"] != session["refresh_token"]
+    claims = jwt.decode(tokens["access_token"], config.SECRET_KEY, algorithms=["HS256"])
+    assert claims["sub"] == "donor@example.com"
+    stored = {
+        row["token_hash"]: row
+        for row in await database.fetch_all(refresh_tokens.select())
+    }
+    assert stored[hash_token(session["refresh_token"])]["revoked"]
+    assert not stored[hash_token(tokens["refresh_token"])]["revoked"]
+    assert len({row["family"] for row in stored.values()}) == 1
+
+
+@pytest.mark.anyio
+async def test_reused_refresh_token_revokes_family(
+    session: dict, async_api_test_client: AsyncClient
+):
+    old = {"refresh_token": session["refresh_token"]}
+    response = await async_api_test_client.post("/user/refresh", json=old)
+    new = {"refresh_token": response.json()["refresh_token"]}
+
+    assert (
+        await async_api_test_client.post("/user/refresh", json=old)
+    ).status_code == 401
+    assert (
+        await async_api_test_client.post("/user/refresh", json=new)
+    ).status_code == 401
+
+
+@pytest.mark.anyio
+async def test_logout_revokes_refresh_token(
+    session: dict, async_api_test_client: AsyncClient
+):
+    body = {"refresh_token": session["refresh_token"]}
+
+    assert (
+        await async_api_test_client.post("/user/logout", json=body)
+    ).status_code == 204
+    assert (
+        await async_api_test_client.post("/user/refresh", json=body)
+    ).status_code == 401
+
+
+@pytest.mark.anyio
+async def test_expired_or_unknown_refresh_token_rejected(
+    session: dict, async_api_test_client: AsyncClient
+):
+    await database.execute(
+        refresh_tokens.update().values(
+            expires_at=datetime.utcnow() - timedelta(seconds=1)
+        )
+    )
+
+    for token in (session["refresh_token"], "not-a-token"):
+        response = await async_api_test_client.post(
+            "/user/refresh", json={"refresh_token": token}
+        )
+        assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_expired_access_token_renewed_by_refresh(
+    donor: dict, donor_payments: list, monkeypatch, async_api_test_client: AsyncClient
+):
+    monkeypatch.setattr(
+        user_routes, "verify_password", lambda plain, hashed: plain == "secret"
+    )
+    monkeypatch.setattr(config, "ACCESS_TOKEN_MINUTES", -1)
+    response = await async_api_test_client.post(
+        "/user/login", json={"email": "donor@example.com", "password": "secret"}
+    )
+    tokens = response.json()
+    monkeypatch.setattr(config, "ACCESS_TOKEN_MINUTES", 15)
+
+    response = await async_api_test_client.get(
+        "/user/payments", headers={"Authorization": f"Bearer {tokens['access_token']}"}
+    )
+    assert response.status_code == 401
+
+    response = await async_api_test_client.post(
+        "/user/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 200
+    response = await async_api_test_client.get(
+        "/user/payments",
+        headers={"Authorization": f"Bearer {response.json()['access_token']}"},
+    )
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == donor_payments[::-1]
+
+
+@pytest.mark.anyio
+async def test_expired_refresh_tokens_purged(session: dict, donor: dict, monkeypatch):
+    await database.execute(
+        refresh_tokens.update().values(
+            expires_at=datetime.utcnow() - timedelta(seconds=1)
+        )
+    )
+    monkeypatch.setattr(refresh_tokens_module, "_next_purge", 0.0)
+
+    token = await issue_refresh_token(donor["id"])
+
+    rows = await database.fetch_all(refresh_tokens.select())
+    assert [row["token_hash"] for row in rows] == [hash_token(token)]
+
+
+@pytest.mark.anyio
+async def test_logout_deletes_the_family(
+    session: dict, async_api_test_client: AsyncClient
+):
+    await async_api_test_client.post(
+        "/user/logout", json={"refresh_token": session["refresh_token"]}
+    )
+
+    assert await database.fetch_all(refresh_tokens.select()) == []
+
+
+@pytest.mark.anyio
+async def test_payment_history_with_login_token(
+    session: dict, donor_payments: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.get(
+        "/user/payments", headers={"Authorization": f"Bearer {session['access_token']}"}
+    )
+
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == donor_payments[::-1]
+
+
+@pytest.mark.anyio
+async def test_payment_history_rejects_expired_token(
+    donor: dict, async_api_test_client: AsyncClient
+):
+    token = create_access_token(
+        data={"sub": donor["email"]}, expires_delta=timedelta(minutes=-1)
+    )
+
+    response = await async_api_test_client.get(
+        "/user/payments", headers={"Authorization": f"Bearer {token}"}
+    )
+
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token has expired"
+
+
+@pytest.mark.anyio
+async def test_payment_requires_token(
+    donor: dict, paypal: list, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.post(
+        "/user/payment",
+        params={"email": donor["email"]},
+        json={
+            "payment_method": "paypal",
+            "amount": 25.0,
+            "status": "pending",
+            "transaction_id": "",
+        },
+    )
+
+    assert response.status_code == 401
+    assert paypal == []
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from storeapi.admission import (
+    ADMIN,
+    AUTH,
+    PAYMENT,
+    PUBLIC,
+    AdmissionController,
+    AdmissionMiddleware,
+    route_class,
+)
+from storeapi.metrics import ADMISSION_SHED
+
+pytestmark = pytest.mark.anyio
+
+
+def blocking_app(release: asyncio.Event) -> FastAPI:
+    # every route but /metrics answers once release is set
+    test_app = FastAPI()
+
+    @test_app.get("/metrics")
+    async def metrics():
+        return {}
+
+    @test_app.get("/{path:path}")
+    @test_app.post("/{path:path}")
+    async def blocked(path: str):
+        await release.wait()
+        return {"path": path}
+
+    test_app.add_middleware(AdmissionMiddleware, max_in_flight=10, retry_after=3)
+    return test_app
+
+
+async def fill(client: AsyncClient, path: str, count: int) -> list:
+    tasks = [asyncio.create_task(client.get(path)) for _ in range(count)]
+    # let the requests reach the handler
+    await asyncio.sleep(0.05)
+    return tasks
+
+
+async def test_route_classes():
+    assert route_class("/user/payment/create") is PAYMENT
+    assert route_class("/donor/donate") is PAYMENT
+    assert route_class("/user/login") is AUTH
+    assert route_class("/user/register") is AUTH
+    assert route_class("/admin/campaign") is ADMIN
+    assert route_class("/public/campaign") is PUBLIC
+    assert route_class("/user/me") is PUBLIC
+    assert route_class("/ready") is None
+    assert route_class("/metrics") is None
+
+
+async def test_public_shed_while_payment_admitted():
+    release = asyncio.Event()
+    shed_before = ADMISSION_SHED.value("public")
+    transport = ASGITransport(app=blocking_app(release))
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        running = await fill(client, "/public/campaign", 6)
+
+        start = time.monotonic()
+        response = await client.get("/public/campaign")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "3"
+        assert response.json() == {"detail": "The server is overloaded, retry later"}
+        assert time.monotonic() - start >= PUBLIC.max_wait
+
+        payment = asyncio.create_task(client.post("/user/payment/create"))
+        assert (await client.get("/metrics")).status_code == 200
+        release.set()
+        assert (await payment).status_code == 200
+        assert [(await task).status_code for task in running] == [200] * 6
+
+    assert ADMISSION_SHED.value("public") == shed_before + 1
+
+
+async def test_waiter_admitted_when_slot_frees():
+    controller = AdmissionController(capacity=2)
+    assert await controller.admit(PAYMENT)
+    assert await controller.admit(PAYMENT)
+
+    waiter = asyncio.create_task(controller.admit(AUTH))
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    controller.release(PAYMENT)
+    assert await waiter
+    assert controller.in_flight == 2
+
+
+async def test_freed_slot_goes_to_higher_priority():
+    controller = AdmissionController(capacity=2)
+    assert await controller.admit(PAYMENT)
+    assert await controller.admit(PAYMENT)
+
+    public = asyncio.create_task(controller.admit(PUBLIC))
+    await asyncio.sleep(0.01)
+    auth = asyncio.create_task(controller.admit(AUTH))
+    await asyncio.sleep(0.01)
+    controller.release(PAYMENT)
+    assert await auth
+    assert not public.done()
+    controller.release(PAYMENT)
+    assert await public
+
+
+async def test_standing_queue_shed_without_waiting():
+    controller = AdmissionController(capacity=1)
+    assert await controller.admit(PAYMENT)
+
+    queued = asyncio.create_task(controller.admit(PUBLIC))
+    await asyncio.sleep(PUBLIC.max_wait / 2 + 0.05)
+    start = time.monotonic()
+    assert not await controller.admit(PUBLIC)
+    assert time.monotonic() - start < 0.05
+    assert not await queued
+    assert controller.in_flight == 1
+
+
+async def test_cancelled_waiter_leaves_queue():
+    controller = AdmissionController(capacity=1)
+    assert await controller.admit(PAYMENT)
+
+    waiter = asyncio.create_task(controller.admit(AUTH))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    controller.release(PAYMENT)
+    assert controller.in_flight == 0
+    assert await controller.admit(PUBLIC)
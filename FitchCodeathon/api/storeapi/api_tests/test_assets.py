@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+from storeapi.assets import build
+
+pytestmark = pytest.mark.anyio
+
+CSS = b".icon { background: url(../webfonts/icons.woff2) } " * 50
+
+
+@pytest.fixture
+def built(tmp_path):
+    source = tmp_path / "frontend"
+    (source / "assets" / "css").mkdir(parents=True)
+    (source / "assets" / "webfonts").mkdir()
+    (source / "assets" / "css" / "main.css").write_bytes(CSS)
+    (source / "assets" / "webfonts" / "icons.woff2").write_bytes(os.urandom(64))
+    (source / "index.html").write_text(
+        '<link href="assets/css/main.css"><link href="static/assets/css/main.css">'
+    )
+    manifest = build(str(source), str(tmp_path / "build"))
+    return tmp_path / "build", manifest
+
+
+async def test_build_fingerprints_and_rewrites_references(built):
+    output, manifest = built
+    css = manifest["assets/css/main.css"]
+    font = manifest["assets/webfonts/icons.woff2"]
+
+    assert json.loads((output / "manifest.json").read_text()) == manifest
+    assert (
+        f"url(../webfonts/{os.path.basename(font)})".encode()
+        in (output / css).read_bytes()
+    )
+    assert (output / "index.html").read_text() == (
+        f'<link href="{css}"><link href="static/{css}">'
+    )
+    # fonts in woff2 are already compressed
+    assert (output / (css + ".gz")).exists()
+    assert not (output / (font + ".gz")).exists()
+
+
+async def test_build_writes_responsive_image_variants(tmp_path):
+    image_module = pytest.importorskip("PIL.Image")
+    source = tmp_path / "frontend"
+    (source / "assets" / "img").mkdir(parents=True)
+    image_module.new("RGB", (700, 350), "red").save(
+        source / "assets" / "img" / "cause.jpg"
+    )
+    (source / "donate.html").write_text('<img src="assets/img/cause.jpg" alt="cause">')
+
+    manifest = build(str(source), str(tmp_path / "build"))
+
+    images = json.loads((tmp_path / "build" / "images.json").read_text())
+    webp = images["assets/img/cause.jpg"]["webp"]
+    assert [width for width, _ in webp] == [320, 640, 700]
+    html = (tmp_path / "build" / "donate.html").read_text()
+    assert html.startswith('<picture><source type="image/avif"')
+    assert f"{webp[0][1]} 320w, {webp[1][1]} 640w" in html
+    assert (
+        f'<img src="{manifest["assets/img/cause.jpg"]}" alt="cause"></picture>' in html
+    )
@@ -0,0 +1,154 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from storeapi.compression import CompressionMiddleware
+from storeapi.metrics import COMPRESSION_BYTES, COMPRESSION_RESPONSES
+
+pytestmark = pytest.mark.anyio
+
+ROWS = [{"id": i, "name": f"Campaign {i}", "isPublished": True} for i in range(200)]
+
+
+async def rows(request):
+    return JSONResponse(ROWS, headers={"ETag": '"v1"'})
+
+
+async def small(request):
+    return JSONResponse({"ok": True})
+
+
+async def image(request):
+    return Response(b"\x89PNG" * 1000, media_type="image/png")
+
+
+async def encoded(request):
+    return Response(
+        gzip.compress(b"x" * 5000),
+        media_type="text/plain",
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
+async def export(request):
+    async def lines():
+        for row in ROWS:
+            yield (json.dumps(row) + "\n").encode()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+app = CompressionMiddleware(
+    Starlette(
+        routes=[
+            Route("/rows", rows),
+            Route("/small", small),
+            Route("/image", image),
+            Route("/encoded", encoded),
+            Route("/export", export),
+            Route("/static/rows", rows),
+        ]
+    ),
+    minimum_size=500,
+)
+
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+async def test_gzip_json_response(client: AsyncClient):
+    before = COMPRESSION_BYTES.value("gzip", "in")
+
+    response = await client.get("/rows", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"v1"'
+    # httpx decodes the body according to Content-Encoding
+    assert response.json() == ROWS
+    assert int(response.headers["content-length"]) < len(json.dumps(ROWS)) / 4
+    assert COMPRESSION_BYTES.value("gzip", "in") > before
+
+
+async def test_brotli_preferred_when_accepted(client: AsyncClient):
+    pytest.importorskip("brotli")
+
+    response = await client.get("/rows", headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.headers["content-encoding"] == "br"
+    assert response.json() == ROWS
+
+
+async def test_skipped_responses(client: AsyncClient):
+    before = COMPRESSION_RESPONSES.value("gzip", "small")
+    headers = {"Accept-Encoding": "gzip"}
+
+    assert (
+        "content-encoding" not in (await client.get("/small", headers=headers)).headers
+    )
+    assert COMPRESSION_RESPONSES.value("gzip", "small") == before + 1
+    assert (
+        "content-encoding" not in (await client.get("/image", headers=headers)).headers
+    )
+    assert (
+        "content-encoding"
+        not in (await client.get("/static/rows", headers=headers)).headers
+    )
+    # httpx asks for gzip unless told otherwise
+    identity = {"Accept-Encoding": "identity"}
+    assert (
+        "content-encoding" not in (await client.get("/rows", headers=identity)).headers
+    )
+
+    response = await client.get("/encoded", headers=headers)
+    assert response.content == b"x" * 5000
+
+
+async def test_streamed_response_is_compressed_incrementally():
+    messages = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        # the body, then the disconnect StreamingResponse listens for
+        return requests.pop() if requests else {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/export",
+        "raw_path": b"/export",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"accept-encoding", b"gzip")],
+        "scheme": "http",
+        "server": ("test", 80),
+        "client": ("test", 1234),
+        "http_version": "1.1",
+    }
+    await app(scope, receive, send)
+
+    start, *bodies = messages
+    headers = dict(start["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    # each chunk is flushed on its own, so the stream decodes as it arrives
+    assert len(bodies) > 2
+    decoder = zlib.decompressobj(31)
+    first = decoder.decompress(bodies[0]["body"])
+    assert first.startswith(b'{"id": 0')
+    rest = b"".join(decoder.decompress(body["body"]) for body in bodies[1:])
+    assert (first + rest).decode().splitlines() == [json.dumps(row) for row in ROWS]
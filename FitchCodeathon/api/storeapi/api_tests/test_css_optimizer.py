@@ -0,0 +1,111 @@
+import io
+
+import pytest
+
+from storeapi.css_optimizer import (
+    Usage,
+    collect_usage,
+    font_codepoints,
+    inline_critical_css,
+    purge_css,
+    script_tokens,
+    subset_font,
+)
+
+pytestmark = pytest.mark.anyio
+
+CSS = """/*! licence */
+/* layout */
+.btn{color:red}.btn-unused,.btn:hover{color:blue}
+#hero>h1{margin:0}table td{padding:1px}
+@media (max-width:600px){.btn{color:green}.carousel{display:none}}
+@font-face{font-family:"Icons";src:url(../webfonts/icons.woff2)}
+@font-face{font-family:"Unused";src:url(../webfonts/unused.woff2)}
+.icon{font-family:"Icons"}.icon-heart:before{content:"\\f004"}.icon-star:before{content:"\\f005"}
+@keyframes fadeIn{from{opacity:0}to{opacity:1}}@keyframes spin{to{transform:rotate(1turn)}}
+.fade{animation-name:fadeIn}
+"""
+
+PAGE = """<html><head><link rel="stylesheet" href="assets/css/main.css"></head><body>
+<section id="hero"><h1 class="btn icon icon-heart">Donate</h1></section>
+<section><p class="fade">Below the fold</p></section>
+<script>$(".x").addClass("carousel")</script></body></html>"""
+
+
+async def test_purge_keeps_only_used_rules():
+    usage, _ = collect_usage(PAGE)
+
+    purged = purge_css(CSS, usage)
+
+    assert purged.startswith("/*! licence */")
+    assert ".btn{color:red}.btn:hover{color:blue}" in purged
+    assert "#hero>h1{margin:0}" in purged
+    assert "table td" not in purged
+    # classes added by scripts count as used
+    assert (
+        "@media (max-width:600px){.btn{color:green}.carousel{display:none}}" in purged
+    )
+    assert '"Icons"' in purged and '"Unused"' not in purged
+    assert "@keyframes fadeIn" in purged and "spin" not in purged
+    assert "icon-star" not in purged
+
+
+async def test_font_codepoints_of_kept_rules():
+    usage, _ = collect_usage(PAGE)
+
+    assert font_codepoints(purge_css(CSS, usage)) == {0xF004}
+
+
+async def test_script_tokens():
+    assert script_tokens('el.classList.add("is-active sticky"); var x = 1') == {
+        "is-active",
+        "sticky",
+    }
+
+
+async def test_inline_critical_css_covers_the_top_of_the_page():
+    html = inline_critical_css(
+        PAGE, {"assets/css/main.css": CSS}, lambda css, path, prefix: css
+    )
+
+    style = html[html.index("<style>") : html.index("</style>")]
+    assert ".btn{color:red}" in style
+    assert ".fade" not in style
+    assert "licence" not in style
+    assert '<link rel="preload" href="assets/css/main.css" as="style"' in html
+    assert (
+        '<noscript><link rel="stylesheet" href="assets/css/main.css"></noscript>'
+        in html
+    )
+
+
+async def test_subset_font_keeps_only_requested_glyphs():
+    font_builder = pytest.importorskip("fontTools.fontBuilder")
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    from fontTools.ttLib import TTFont
+
+    glyphs = [".notdef", "heart", "star"]
+    builder = font_builder.FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyphs)
+    builder.setupCharacterMap({0xF004: "heart", 0xF005: "star"})
+    pen = TTGlyphPen(None)
+    pen.moveTo((0, 0))
+    pen.lineTo((0, 500))
+    pen.lineTo((500, 0))
+    pen.closePath()
+    builder.setupGlyf({name: pen.glyph() for name in glyphs})
+    builder.setupHorizontalMetrics({name: (500, 0) for name in glyphs})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": "Icons", "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    output = io.BytesIO()
+    builder.save(output)
+
+    subset = TTFont(io.BytesIO(subset_font(output.getvalue(), {0xF004}, None)))
+
+    assert set(subset.getBestCmap()) == {0xF004}
+
+
+async def test_usage_elements_include_document_roots():
+    assert {"html", "body"} <= Usage().elements
@@ -0,0 +1,59 @@
+import pytest
+import sqlalchemy
+
+from storeapi import database as database_module
+from storeapi.database import (
+    SchemaOutOfDate,
+    create_tables,
+    ensure_tables,
+    missing_column_ddl,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    # a database created before the payments gained their campaign, PayPal id and update time
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                "CREATE TABLE payments (id INTEGER PRIMARY KEY, user_id INTEGER, amount FLOAT,"
+                " status VARCHAR(50), payment_method VARCHAR(50), created_at DATETIME)"
+            )
+        )
+    yield engine
+    engine.dispose()
+
+
+async def test_missing_columns_listed(old_database):
+    statements = missing_column_ddl(old_database)
+
+    assert "ALTER TABLE payments ADD COLUMN campaign_id INTEGER" in statements
+    assert "ALTER TABLE payments ADD COLUMN paypal_payment_id VARCHAR(64)" in statements
+    assert "ALTER TABLE payments ADD COLUMN updated_at DATETIME" in statements
+
+
+async def test_startup_fails_on_missing_columns(old_database, monkeypatch):
+    monkeypatch.setattr(database_module, "engine", old_database)
+
+    with pytest.raises(SchemaOutOfDate, match="ADD COLUMN campaign_id"):
+        create_tables()
+
+    # the statements it lists bring the database up to date
+    with old_database.begin() as connection:
+        for statement in missing_column_ddl(old_database):
+            connection.execute(sqlalchemy.text(statement))
+    create_tables()
+
+
+async def test_tables_created_once_per_process(monkeypatch):
+    calls = []
+    monkeypatch.setattr(database_module, "tables_created", False)
+    monkeypatch.setattr(database_module, "create_tables", lambda: calls.append(1))
+
+    ensure_tables()
+    ensure_tables()
+
+    assert calls == [1]
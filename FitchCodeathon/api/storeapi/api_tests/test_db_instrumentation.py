@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+
+from storeapi.database import database, users
+from storeapi.db_instrumentation import slow_query_log
+from storeapi.main import app
+from storeapi.security import valid_access_token
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def every_query_is_slow(monkeypatch):
+    monkeypatch.setattr(slow_query_log, "threshold", 0)
+    monkeypatch.setattr(slow_query_log, "explain", True)
+    monkeypatch.setattr(slow_query_log, "explain_after", 2)
+    slow_query_log.recent.clear()
+    slow_query_log.explains.clear()
+    slow_query_log._counts.clear()
+
+
+async def lookup_user(email: str):
+    return await database.fetch_one(users.select().where(users.c.email == email))
+
+
+async def test_slow_query_logged_with_caller_and_parameters(every_query_is_slow):
+    await lookup_user("slow@example.com")
+
+    entry = slow_query_log.recent[-1]
+    assert entry["statement"] == "select users"
+    # emails are masked to their domain
+    assert entry["params"] == {"email_1": "***@example.com"}
+    assert entry["caller"].startswith(f"{__name__}.lookup_user")
+    assert "FROM users" in entry["sql"]
+
+
+async def test_sensitive_parameters_are_masked(every_query_is_slow):
+    await database.execute(
+        users.insert().values(
+            username="masked", email="masked@example.com", hashed_password="x"
+        )
+    )
+
+    assert slow_query_log.recent[-1]["params"]["hashed_password"] == "***"
+
+
+async def test_iterate_times_fetches_not_the_caller(monkeypatch):
+    await database.execute(
+        users.insert().values(
+            username="reader", email="reader@example.com", hashed_password="x"
+        )
+    )
+    monkeypatch.setattr(slow_query_log, "threshold", 0.05)
+    slow_query_log.recent.clear()
+
+    async for _ in database.iterate(users.select()):
+        # a slow reader of a streamed response
+        await asyncio.sleep(0.1)
+
+    assert not slow_query_log.recent
+
+
+async def test_repeated_offender_is_explained(every_query_is_slow):
+    await lookup_user("again@example.com")
+    assert not slow_query_log._pending
+
+    await lookup_user("again@example.com")
+    await slow_query_log.flush()
+
+    (explain,) = slow_query_log.explains
+    assert explain["statement"] == "select users"
+    assert "users" in explain["plan"]
+
+
+async def test_slow_queries_endpoint(
+    every_query_is_slow, async_api_test_client: AsyncClient
+):
+    app.dependency_overrides[valid_access_token] = lambda: {
+        "resource_access": {"elbaapi": {"roles": ["admin"]}}
+    }
+    await lookup_user("endpoint@example.com")
+
+    response = await async_api_test_client.get("/admin/debug/slow-queries")
+
+    assert response.status_code == 200
+    assert response.json()["recent"][0]["params"] == {"email_1": "***@example.com"}
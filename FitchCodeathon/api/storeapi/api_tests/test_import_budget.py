@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks.imports import import_seconds, import_timings
+
+pytestmark = pytest.mark.anyio
+
+API_DIR = Path(__file__).resolve().parents[2]
+
+# Well above the second the app takes to import on a laptop, so that what fails it is a
+# regression such as a heavy dependency imported with the app again, see benchmarks/imports.py
+IMPORT_BUDGET_SECONDS = 3.0
+
+# imported on first use, by the routes or the warm-up that need them
+LAZY_MODULES = {"requests", "httpx", "rich", "storeapi.paypal_integration.paypal"}
+
+
+async def test_app_imports_within_budget():
+    assert import_seconds("storeapi.main") < IMPORT_BUDGET_SECONDS
+
+
+async def test_rarely_used_dependencies_are_imported_lazily():
+    imported = {timing.module for timing in import_timings("storeapi.main")}
+
+    assert not LAZY_MODULES & imported
+
+
+async def test_import_has_no_side_effects(tmp_path: Path):
+    # the test database is relative to the working directory
+    result = subprocess.run(
+        [sys.executable, "-c", "import storeapi.main"],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(API_DIR)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout == ""
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,63 @@
+import logging
+import queue
+
+import pytest
+
+from storeapi.logging_conf import BoundedQueueHandler
+
+# the autouse db fixture in conftest.py is async
+pytestmark = pytest.mark.anyio
+
+
+def make_record(level: int = logging.INFO, msg: str = "message %s", args=("arg",)):
+    return logging.LogRecord("storeapi.test", level, __file__, 1, msg, args, None)
+
+
+async def test_queue_handler_merges_message_arguments():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=10))
+
+    handler.handle(make_record())
+
+    record = handler.queue.get_nowait()
+    assert record.msg == "message arg"
+    assert record.args is None
+
+
+async def test_queue_handler_drops_when_full_and_reports_later():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=2), policy="drop")
+
+    for _ in range(5):
+        handler.handle(make_record())
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+    # drain the queue, the next record is preceded by a report of the dropped ones
+    handler.queue.get_nowait()
+    handler.queue.get_nowait()
+    handler.handle(make_record())
+
+    report = handler.queue.get_nowait()
+    assert report.levelno == logging.WARNING
+    assert "dropped 3 log records" in report.msg
+    assert handler.queue.get_nowait().msg == "message arg"
+    assert handler.dropped == 0
+
+
+async def test_queue_handler_samples_low_levels_above_high_water_mark():
+    handler = BoundedQueueHandler(
+        queue.Queue(maxsize=1000), policy="sample", sample_rate=10
+    )
+
+    # fill to the high water mark, everything is kept up to there
+    for _ in range(500):
+        handler.handle(make_record())
+    assert handler.queue.qsize() == 500
+
+    # past it only 1 in 10 INFO records is kept but every WARNING is
+    for _ in range(100):
+        handler.handle(make_record())
+        handler.handle(make_record(level=logging.WARNING))
+
+    assert handler.queue.qsize() == 500 + 10 + 100
+    assert handler.dropped == 90
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import pytest
+
+from storeapi.loop_monitor import EVENT_LOOP_BLOCKED, LoopMonitor
+
+pytestmark = pytest.mark.anyio
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+async def test_blocking_call_is_captured_with_its_stack():
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.05, capture_stacks=True)
+    before = EVENT_LOOP_BLOCKED.value()
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+
+    assert EVENT_LOOP_BLOCKED.value() == before + 1
+    assert len(monitor.blocked_calls) == 1
+    assert "blocking_call" in monitor.blocked_calls[0]["stack"]
+
+
+async def test_lag_is_reported_without_the_watchdog():
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.05, capture_stacks=False)
+    before = EVENT_LOOP_BLOCKED.value()
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+
+    assert EVENT_LOOP_BLOCKED.value() == before + 1
+    assert len(monitor.blocked_calls) == 0
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from storeapi.database import campaign_table, users
+from storeapi.db_instrumentation import statement_name
+from storeapi.main import app
+from storeapi.metrics import HTTP_REQUEST_DURATION, REGISTRY, Counter, Gauge, Histogram
+from storeapi.security import valid_access_token
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def unregistered():
+    # metrics created by a test are removed from the global registry afterwards
+    registered = list(REGISTRY)
+    yield
+    REGISTRY[:] = registered
+
+
+async def test_histogram_renders_cumulative_buckets(unregistered):
+    histogram = Histogram(
+        "test_seconds", "Test histogram", ("route",), buckets=(0.1, 1.0)
+    )
+
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5.0, "/a")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/a"} 3' in lines
+
+
+async def test_counter_and_gauge(unregistered):
+    counter = Counter("test_total", "Test counter", ("outcome",))
+    gauge = Gauge("test_in_flight", "Test gauge")
+
+    counter.inc("hit")
+    counter.inc("hit")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    assert 'test_total{outcome="hit"} 2' in counter.render()
+    assert "test_in_flight 1" in gauge.render()
+
+
+async def test_statement_names():
+    assert statement_name(campaign_table.select()) == "select campaigns"
+    assert statement_name(users.insert()) == "insert users"
+    assert statement_name("SELECT 1") == "raw"
+
+
+async def test_requests_are_recorded_by_route_template(
+    async_api_test_client: AsyncClient,
+):
+    app.dependency_overrides[valid_access_token] = lambda: {
+        "resource_access": {"elbaapi": {"roles": ["admin"]}}
+    }
+    before = HTTP_REQUEST_DURATION.count("GET", "/admin/campaign/{campaign_id}", "4xx")
+
+    await async_api_test_client.get("/admin/campaign/123456")
+    response = await async_api_test_client.get("/metrics")
+
+    assert (
+        HTTP_REQUEST_DURATION.count("GET", "/admin/campaign/{campaign_id}", "4xx")
+        == before + 1
+    )
+    assert "storeapi_http_request_duration_seconds_bucket" in response.text
+
+
+async def test_recording_a_request_stays_within_budget(unregistered):
+    # what the middleware records per request must stay well under 20 microseconds
+    histogram = Histogram(
+        "test_budget_seconds", "Test histogram", ("method", "route", "status")
+    )
+    gauge = Gauge("test_budget_in_flight", "Test gauge", ("method",))
+    iterations = 10000
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        gauge.inc("GET")
+        histogram.observe(0.003, "GET", "/public/campaign", "2xx")
+        gauge.dec("GET")
+    per_request = (time.perf_counter() - start) / iterations
+
+    assert per_request < 20e-6
@@ -0,0 +1,48 @@
+import pytest
+
+from storeapi.rate_limit import LocalCounters, RateLimiter, window_estimate
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_previous_window_weighted_by_overlap():
+    counters = LocalCounters()
+    for _ in range(10):
+        counters.hit("key", 60, 119.0)
+
+    assert counters.hit("key", 60, 135.0) == (1, 10)
+    # 15 seconds into the window, three quarters of the previous one still count
+    assert window_estimate(1, 10, 15, 60) == 8.5
+    # a window later the attempts no longer count at all
+    assert counters.hit("key", 60, 250.0) == (1, 0)
+
+
+async def test_counters_bounded_least_recent_evicted():
+    counters = LocalCounters(max_keys=2)
+    counters.hit("a", 60, 0)
+    counters.hit("b", 60, 0)
+    counters.hit("a", 60, 1)
+    counters.hit("c", 60, 2)
+
+    assert len(counters) == 2
+    assert counters.hit("a", 60, 3) == (3, 0)
+    assert counters.hit("b", 60, 3) == (1, 0)
+
+
+async def test_limiter_rejects_over_limit():
+    limiter = RateLimiter(window=60)
+
+    assert [await limiter.hit("key", 2) for _ in range(2)] == [0, 0]
+    assert 0 < await limiter.hit("key", 2) <= 60
+    assert await limiter.hit("other", 2) == 0
+
+
+async def test_limiter_falls_back_when_shared_counters_fail():
+    class Unavailable:
+        async def hit(self, key, window, now):
+            raise ConnectionError("down")
+
+    limiter = RateLimiter(window=60, backend=Unavailable())
+
+    assert await limiter.hit("key", 1) == 0
+    assert await limiter.hit("key", 1) > 0
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+from fastapi import APIRouter, FastAPI, HTTPException
+from httpx import ASGITransport, AsyncClient
+
+from storeapi.config import config
+from storeapi.database import campaign_table, database
+from storeapi.main import app
+from storeapi.metrics import RESPONSE_CACHE
+from storeapi.response_cache import cached, response_cache
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ENABLED", True)
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+
+# a small app counting how often each handler renders, /slow renders until released
+renders = {"items": 0, "slow": 0}
+release = {}
+router = APIRouter()
+
+
+@router.get("/items")
+@cached(
+    ttl=60, vary_query=("page",), vary_headers=("Accept-Language",), tags=("items",)
+)
+async def items(page: int = 1, sort: str = "id"):
+    renders["items"] += 1
+    if page > 10:
+        raise HTTPException(status_code=404, detail="No such page")
+    return {"page": page, "renders": renders["items"]}
+
+
+@router.get("/slow")
+@cached(ttl=60, tags=("items",))
+async def slow():
+    renders["slow"] += 1
+    await release["event"].wait()
+    return {"renders": renders["slow"]}
+
+
+cached_app = FastAPI()
+cached_app.include_router(router)
+
+
+@pytest.fixture
+async def client():
+    renders.update(items=0, slow=0)
+    release["event"] = asyncio.Event()
+    async with AsyncClient(
+        transport=ASGITransport(app=cached_app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+async def test_hits_vary_by_declared_query_and_headers(client: AsyncClient):
+    first = await client.get("/items", params={"page": 1})
+    assert first.json() == {"page": 1, "renders": 1}
+    assert "Accept-Language" in first.headers["vary"]
+
+    # sort is not part of the key
+    hit = await client.get("/items", params={"page": 1, "sort": "name"})
+    assert hit.json() == {"page": 1, "renders": 1}
+    assert hit.headers["content-type"] == "application/json"
+
+    assert (await client.get("/items", params={"page": 2})).json()["renders"] == 2
+    french = await client.get(
+        "/items", params={"page": 1}, headers={"Accept-Language": "fr"}
+    )
+    assert french.json()["renders"] == 3
+
+
+async def test_authorized_requests_and_errors_are_not_cached(client: AsyncClient):
+    headers = {"Authorization": "Bearer token"}
+    await client.get("/items", headers=headers)
+    assert (await client.get("/items", headers=headers)).json()["renders"] == 2
+
+    assert (await client.get("/items", params={"page": 11})).status_code == 404
+    assert (await client.get("/items", params={"page": 11})).status_code == 404
+    assert renders["items"] == 4
+
+
+async def test_invalidation_by_tag(client: AsyncClient):
+    await client.get("/items")
+
+    assert await response_cache.invalidate("items") == 1
+    assert (await client.get("/items")).json()["renders"] == 2
+
+
+async def test_concurrent_misses_render_once(client: AsyncClient):
+    coalesced = RESPONSE_CACHE.value("coalesced")
+    requests = [asyncio.ensure_future(client.get("/slow")) for _ in range(5)]
+    while not response_cache._inflight:
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+    release["event"].set()
+
+    responses = await asyncio.gather(*requests)
+
+    assert [response.json() for response in responses] == [{"renders": 1}] * 5
+    assert renders["slow"] == 1
+    assert RESPONSE_CACHE.value("coalesced") == coalesced + 4
+
+
+async def test_render_overtaken_by_invalidation_is_not_stored(client: AsyncClient):
+    request = asyncio.ensure_future(client.get("/slow"))
+    while not response_cache._inflight:
+        await asyncio.sleep(0.001)
+    await response_cache.invalidate("items")
+    release["event"].set()
+    await request
+
+    assert len(response_cache) == 0
+
+
+async def test_public_campaigns_invalidated_by_admin_update(
+    async_api_test_client: AsyncClient,
+):
+    campaign_id = await database.execute(
+        campaign_table.insert().values(
+            name="Food bank",
+            template="t",
+            isDraft=False,
+            isPublished=True,
+            isEnded=False,
+            version=1,
+        )
+    )
+    response = await async_api_test_client.get("/public/campaign")
+    assert [campaign["id"] for campaign in response.json()] == [campaign_id]
+
+    # a write that bypasses the routes is not seen until the entry expires
+    await database.execute(
+        campaign_table.update()
+        .where(campaign_table.c.id == campaign_id)
+        .values(name="Renamed")
+    )
+    response = await async_api_test_client.get("/public/campaign")
+    assert response.json()[0]["name"] == "Food bank"
+
+    response = await async_api_test_client.patch(
+        f"/admin/campaign/{campaign_id}",
+        json={
+            "name": "Renamed",
+            "template": "t",
+            "isPublished": False,
+            "isEnded": True,
+            "isDraft": False,
+        },
+    )
+    assert response.status_code == 200
+
+    response = await async_api_test_client.get("/public/campaign")
+    assert response.json() == []
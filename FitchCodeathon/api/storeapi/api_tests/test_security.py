@@ -0,0 +1,121 @@
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwk, jwt
+
+from storeapi import security
+from storeapi.shared_document import SharedDocument
+
+pytestmark = pytest.mark.anyio
+
+
+def rsa_key(kid: str):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public = jwk.construct(pem, "RS256").public_key().to_dict()
+    return pem, {**public, "kid": kid}
+
+
+OLD_PEM, OLD_JWK = rsa_key("old")
+NEW_PEM, NEW_JWK = rsa_key("new")
+
+
+def token(pem: bytes, kid: str) -> str:
+    claims = {
+        "sub": "donor@example.com",
+        "aud": security.KC_CLIENT_ID,
+        "exp": int(time.time()) + 300,
+    }
+    return jwt.encode(claims, pem, algorithm="RS256", headers={"kid": kid})
+
+
+class FakeResponse:
+    def __init__(self, jwks: dict) -> None:
+        self._jwks = jwks
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> dict:
+        return self._jwks
+
+
+@pytest.fixture
+def keycloak(monkeypatch) -> dict:
+    # Keycloak serves the keys in keycloak["keys"], fetches are counted
+    keycloak = {"keys": [OLD_JWK], "fetches": 0}
+
+    def get(url, headers=None):
+        keycloak["fetches"] += 1
+        return FakeResponse({"keys": list(keycloak["keys"])})
+
+    monkeypatch.setattr(security.import_requests(), "get", get)
+    monkeypatch.setitem(security._jwks_cache, "jwks", None)
+    monkeypatch.setitem(security._jwks_cache, "fetched_at", 0.0)
+    return keycloak
+
+
+async def test_key_selected_by_kid(keycloak: dict):
+    keycloak["keys"] = [OLD_JWK, NEW_JWK]
+
+    data = await security.valid_access_token(token(NEW_PEM, "new"))
+
+    assert data["sub"] == "donor@example.com"
+    assert keycloak["fetches"] == 1
+
+
+async def test_rotated_key_refreshes_the_cache(keycloak: dict, monkeypatch):
+    await security.valid_access_token(token(OLD_PEM, "old"))
+    # keys fetched a while ago, but well within JWKS_CACHE_SECONDS
+    monkeypatch.setitem(security._jwks_cache, "fetched_at", time.monotonic() - 60)
+    keycloak["keys"] = [NEW_JWK]
+
+    data = await security.valid_access_token(token(NEW_PEM, "new"))
+
+    assert data["sub"] == "donor@example.com"
+    assert keycloak["fetches"] == 2
+
+
+async def test_unknown_key_refreshes_at_most_once(keycloak: dict):
+    await security.valid_access_token(token(OLD_PEM, "old"))
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as ex:
+            await security.valid_access_token(token(NEW_PEM, "forged"))
+        assert ex.value.status_code == 401
+
+    # the keys were fetched moments ago, a refresh reuses them
+    assert keycloak["fetches"] == 1
+
+
+async def test_workers_share_fetched_keys(keycloak: dict, monkeypatch):
+    monkeypatch.setattr(security, "jwks_store", SharedDocument())
+    await security.valid_access_token(token(OLD_PEM, "old"))
+    # another worker, which has not cached any keys yet
+    monkeypatch.setitem(security._jwks_cache, "jwks", None)
+
+    data = await security.valid_access_token(token(OLD_PEM, "old"))
+
+    assert data["sub"] == "donor@example.com"
+    assert keycloak["fetches"] == 1
+
+
+async def test_expired_keys_fetched_by_one_worker(keycloak: dict, monkeypatch):
+    store = SharedDocument()
+    store.write({"keys": [OLD_JWK]})
+    monkeypatch.setattr(security, "jwks_store", store)
+    monkeypatch.setattr(security.config, "JWKS_CACHE_SECONDS", 0)
+    # another worker is fetching the expired keys
+    assert store.claim(security.JWKS_FETCH_CLAIM_SECONDS)
+
+    data = await security.valid_access_token(token(OLD_PEM, "old"))
+
+    assert data["sub"] == "donor@example.com"
+    assert keycloak["fetches"] == 0
@@ -0,0 +1,203 @@
+import json
+from datetime import datetime
+from typing import List
+
+import msgpack
+import pytest
+import sqlalchemy
+from httpx import AsyncClient
+from pydantic import TypeAdapter
+
+from storeapi import serialization
+from storeapi.config import config
+from storeapi.database import campaign_table, database, users
+from storeapi.models.campaign import Campaign
+from storeapi.models.payment import RefundSummary
+from storeapi.security import create_access_token
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def trusted_responses(monkeypatch):
+    monkeypatch.setattr(config, "TRUSTED_RESPONSES", True)
+
+
+async def insert_campaigns(count: int) -> None:
+    for i in range(count):
+        await database.execute(
+            campaign_table.insert().values(
+                name=f"Campaign {i}",
+                template="t",
+                isDraft=True,
+                isPublished=False,
+                isEnded=False,
+                version=1,
+            )
+        )
+
+
+async def test_records_encode_like_the_validated_model():
+    await insert_campaigns(3)
+    rows = await database.fetch_all(campaign_table.select())
+
+    adapter = TypeAdapter(List[Campaign])
+    validated = json.loads(
+        adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+    )
+
+    assert serialization.encode(List[Campaign], rows) == validated
+    assert (
+        json.loads(serialization.dumps(serialization.encode(List[Campaign], rows)))
+        == validated
+    )
+
+
+async def test_dicts_use_field_defaults_and_nested_models():
+    created = {
+        "id": 1,
+        "name": "n",
+        "template": "t",
+        "isDraft": True,
+        "isPublished": False,
+        "isEnded": False,
+    }
+    assert serialization.encode(Campaign, created)["version"] == 1
+
+    refund = {
+        "id": 1,
+        "amount": 5.0,
+        "status": "pending",
+        "created_at": datetime(2024, 9, 1, 9, 15),
+        "payment": {
+            "id": 2,
+            "amount": 5.0,
+            "status": "success",
+            "payment_method": "paypal",
+            "created_at": None,
+        },
+        "user": {"id": 3, "name": "Jo", "email": "jo@example.com"},
+    }
+    encoded = json.loads(
+        serialization.dumps(serialization.encode(RefundSummary, refund))
+    )
+    assert encoded == json.loads(RefundSummary(**refund).model_dump_json())
+
+
+async def test_missing_required_column_is_an_error():
+    await insert_campaigns(1)
+    query = sqlalchemy.select(campaign_table.c.id, campaign_table.c.template)
+    row = await database.fetch_one(query)
+    with pytest.raises(KeyError):
+        serialization.encode(Campaign, row)
+
+
+async def test_json_fallback_without_orjson(monkeypatch):
+    monkeypatch.setattr(serialization, "_orjson", None)
+    body = serialization.dumps({"when": datetime(2024, 9, 1, 9, 15), "name": "é"})
+    assert body == '{"when":"2024-09-01T09:15:00","name":"é"}'.encode()
+
+
+async def test_trusted_routes_return_the_same_json(
+    trusted_responses, async_api_test_client: AsyncClient
+):
+    response = await async_api_test_client.post(
+        "/admin/campaign", json={"name": "Food bank", "template": "t"}
+    )
+    assert response.status_code == 201
+    created = response.json()
+    assert created == {
+        "name": "Food bank",
+        "template": "t",
+        "isDraft": True,
+        "isPublished": False,
+        "isEnded": False,
+        "id": created["id"],
+        "version": 1,
+    }
+
+    response = await async_api_test_client.get("/admin/campaign")
+    assert response.status_code == 200
+    assert response.json() == [created]
+
+    response = await async_api_test_client.get(f"/admin/campaign/{created['id']}")
+    assert response.json() == created
+
+
+async def test_wants_msgpack():
+    assert serialization.wants_msgpack("application/msgpack")
+    assert serialization.wants_msgpack("application/x-msgpack, application/json;q=0.5")
+    assert not serialization.wants_msgpack(
+        "application/json, application/msgpack;q=0.5"
+    )
+    assert not serialization.wants_msgpack("application/msgpack;q=0")
+    assert not serialization.wants_msgpack("*/*")
+
+
+async def test_msgpack_request_and_response(async_api_test_client: AsyncClient):
+    body = msgpack.packb({"name": "Food bank", "template": "t"})
+    response = await async_api_test_client.post(
+        "/admin/campaign",
+        content=body,
+        headers={
+            "Content-Type": "application/msgpack",
+            "Accept": "application/msgpack",
+        },
+    )
+    assert response.status_code == 201
+    assert response.headers["content-type"] == "application/msgpack"
+    assert "Accept" in response.headers["vary"]
+    created = msgpack.unpackb(response.content)
+    assert created["name"] == "Food bank"
+
+    json_response = await async_api_test_client.get("/admin/campaign")
+    msgpack_response = await async_api_test_client.get(
+        "/admin/campaign", headers={"Accept": "application/msgpack"}
+    )
+    assert json_response.headers["content-type"] == "application/json"
+    assert msgpack.unpackb(msgpack_response.content) == json_response.json()
+
+
+async def test_trusted_response_follows_the_negotiated_format(
+    trusted_responses, async_api_test_client: AsyncClient
+):
+    await insert_campaigns(2)
+    response = await async_api_test_client.get(
+        "/admin/campaign", headers={"Accept": "application/msgpack"}
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    assert [c["name"] for c in msgpack.unpackb(response.content)] == [
+        "Campaign 0",
+        "Campaign 1",
+    ]
+
+
+async def test_errors_and_streams_stay_json(async_api_test_client: AsyncClient):
+    headers = {"Accept": "application/msgpack"}
+
+    response = await async_api_test_client.get(
+        "/admin/campaign/999999", headers=headers
+    )
+    assert response.status_code == 404
+    assert response.headers["content-type"] == "application/json"
+
+    await database.execute(
+        users.insert().values(
+            username="donor", email="donor@example.com", hashed_password="x"
+        )
+    )
+    token = create_access_token(data={"sub": "donor@example.com"})
+    headers["Authorization"] = f"Bearer {token}"
+    response = await async_api_test_client.get("/user/payments", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {"items": [], "next_cursor": None}
+
+
+async def test_invalid_msgpack_body(async_api_test_client: AsyncClient):
+    response = await async_api_test_client.post(
+        "/admin/campaign",
+        content=b"\xc1",
+        headers={"Content-Type": "application/msgpack"},
+    )
+    assert response.status_code == 400
@@ -0,0 +1,115 @@
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+API_DIR = Path(__file__).resolve().parents[2]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError("Timed out")
+
+
+class Server:
+    def __init__(self, tmp_path: Path, *args: str) -> None:
+        self.port = free_port()
+        self.log = tmp_path / "serve.log"
+        env = {
+            **os.environ,
+            "ENV_STATE": "test",
+            "TEST_SERVER_MAX_REQUESTS_JITTER": "0",
+        }
+        with open(self.log, "w") as output:
+            self.process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "storeapi.serve",
+                    "--port",
+                    str(self.port),
+                    "--workers",
+                    "2",
+                    *args,
+                ],
+                cwd=API_DIR,
+                env=env,
+                stdout=output,
+                stderr=subprocess.STDOUT,
+            )
+
+    def get(self) -> int:
+        try:
+            return httpx.get(
+                f"http://127.0.0.1:{self.port}/metrics", timeout=5
+            ).status_code
+        except httpx.TransportError:
+            return 0
+
+    def booted(self) -> list:
+        return re.findall(r"Booted worker (\d+)", self.log.read_text(errors="replace"))
+
+    def exited(self) -> list:
+        return re.findall(r"Worker (\d+) exited", self.log.read_text(errors="replace"))
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    servers = []
+
+    def start_server(*args: str) -> Server:
+        server = Server(tmp_path, *args)
+        servers.append(server)
+        wait_for(lambda: server.get() == 200)
+        return server
+
+    yield start_server
+    for server in servers:
+        if server.process.poll() is None:
+            server.process.terminate()
+            server.process.wait(timeout=30)
+
+
+async def test_workers_recycled_after_max_requests(start_server):
+    server = start_server("--max-requests", "5")
+    assert len(server.booted()) == 2
+
+    assert [server.get() for _ in range(12)] == [200] * 12
+
+    wait_for(lambda: len(server.exited()) >= 2 and len(server.booted()) >= 4)
+    server.process.terminate()
+    assert server.process.wait(timeout=30) == 0
+
+
+async def test_rolling_restart_keeps_serving(start_server):
+    server = start_server()
+    old_workers = set(server.booted())
+
+    server.process.send_signal(signal.SIGHUP)
+    statuses = []
+    wait_for(
+        lambda: statuses.append(server.get()) or old_workers <= set(server.exited())
+    )
+
+    assert set(statuses) == {200}
+    assert len(set(server.booted()) - old_workers) == 2
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from storeapi.shared_document import SharedDocument
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_document_written_by_a_forked_worker():
+    document = SharedDocument()
+    assert document.read() == (None, float("inf"))
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if document.write({"keys": ["new"]}) else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    keys, age = document.read()
+    assert keys == {"keys": ["new"]}
+    assert age < 5
+
+
+async def test_one_claim_until_written_or_lapsed():
+    document = SharedDocument()
+
+    assert document.claim(timeout=10)
+    assert not document.claim(timeout=10)
+    assert document.claim(timeout=0)
+
+    document.write({"keys": []})
+    assert document.claim(timeout=10)
+    document.release()
+    assert document.claim(timeout=10)
+
+
+async def test_oversized_document_is_not_written():
+    document = SharedDocument(max_bytes=16)
+
+    assert not document.write({"keys": ["x" * 16]})
+    assert document.read() == (None, float("inf"))
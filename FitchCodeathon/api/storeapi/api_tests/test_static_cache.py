@@ -0,0 +1,209 @@
+import asyncio
+import os
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from storeapi.assets import build
+from storeapi.metrics import STATIC_CACHE
+from storeapi.static_cache import CachedStaticFiles, parse_range
+
+pytestmark = pytest.mark.anyio
+
+CSS = b".icon { background: url(../webfonts/icons.woff2) } " * 50
+
+
+@pytest.fixture
+def built(tmp_path):
+    source = tmp_path / "frontend"
+    (source / "assets" / "css").mkdir(parents=True)
+    (source / "assets" / "webfonts").mkdir()
+    (source / "assets" / "css" / "main.css").write_bytes(CSS)
+    (source / "assets" / "webfonts" / "icons.woff2").write_bytes(os.urandom(4096))
+    manifest = build(str(source), str(tmp_path / "build"))
+    return tmp_path / "build", manifest
+
+
+@pytest.fixture
+def static_files(built):
+    output, _ = built
+    return CachedStaticFiles(str(output))
+
+
+@pytest.fixture
+async def client(static_files):
+    app = Starlette(routes=[Mount("/static", static_files)])
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+async def test_serves_precompressed_variant(built, client: AsyncClient):
+    output, manifest = built
+    path = "/static/" + manifest["assets/css/main.css"]
+
+    response = await client.get(path, headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("text/css")
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert response.headers["etag"].endswith('-gzip"')
+    # httpx decodes the body according to Content-Encoding
+    assert response.content == (output / manifest["assets/css/main.css"]).read_bytes()
+
+
+async def test_brotli_preferred_when_accepted(built, client: AsyncClient):
+    pytest.importorskip("brotli")
+    _, manifest = built
+
+    response = await client.get(
+        "/static/" + manifest["assets/css/main.css"],
+        headers={"Accept-Encoding": "gzip, br"},
+    )
+
+    assert response.headers["content-encoding"] == "br"
+
+
+async def test_unhashed_files_are_revalidated(client: AsyncClient):
+    response = await client.get(
+        "/static/assets/css/main.css", headers={"Accept-Encoding": "identity"}
+    )
+
+    assert "content-encoding" not in response.headers
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.content.startswith(b".icon")
+
+    revalidated = await client.get(
+        "/static/assets/css/main.css",
+        headers={"If-None-Match": response.headers["etag"]},
+    )
+    assert revalidated.status_code == 304
+
+
+async def test_hits_are_served_from_memory(built, static_files, client: AsyncClient):
+    output, _ = built
+    await client.get("/static/assets/css/main.css")
+    hits = STATIC_CACHE.value("hit")
+    os.remove(output / "assets" / "css" / "main.css")
+
+    response = await client.get("/static/assets/css/main.css")
+
+    assert response.status_code == 200
+    assert STATIC_CACHE.value("hit") == hits + 1
+
+
+async def test_byte_ranges(built, client: AsyncClient):
+    output, _ = built
+    font = (output / "assets" / "webfonts" / "icons.woff2").read_bytes()
+
+    response = await client.get(
+        "/static/assets/webfonts/icons.woff2", headers={"Range": "bytes=10-19"}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 10-19/{len(font)}"
+    assert response.content == font[10:20]
+
+    response = await client.get(
+        "/static/assets/webfonts/icons.woff2", headers={"Range": f"bytes={len(font)}-"}
+    )
+    assert response.status_code == 416
+
+
+async def test_large_files_are_streamed_from_disk(built):
+    output, _ = built
+    static_files = CachedStaticFiles(str(output), max_file_bytes=1024)
+    app = Starlette(routes=[Mount("/static", static_files)])
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        response = await client.get(
+            "/static/assets/webfonts/icons.woff2", headers={"Range": "bytes=0-99"}
+        )
+
+    assert response.status_code == 206
+    assert len(response.content) == 100
+    assert static_files._entries["assets/webfonts/icons.woff2"].bodies is None
+
+
+async def test_missing_and_escaping_paths(client: AsyncClient):
+    assert (await client.get("/static/assets/css/missing.css")).status_code == 404
+    assert (await client.get("/static/../manifest.json")).status_code == 404
+
+
+async def test_path_spellings_share_one_entry(built, static_files, client: AsyncClient):
+    output, _ = built
+    css = (output / "assets" / "css" / "main.css").read_bytes()
+    os.symlink(output / "assets" / "css", output / "styles")
+
+    for path in (
+        "assets/css/main.css",
+        "assets//css/main.css",
+        "./assets/css/./main.css",
+        "assets/webfonts/../css/main.css",
+        "styles/main.css",
+    ):
+        response = await client.get(
+            f"/static/{path}", headers={"Accept-Encoding": "identity"}
+        )
+        assert response.content == css
+
+    assert list(static_files._entries) == ["assets/css/main.css"]
+
+
+async def test_large_files_count_towards_the_bound(built):
+    output, _ = built
+    static_files = CachedStaticFiles(str(output), max_bytes=1024, max_file_bytes=0)
+    app = Starlette(routes=[Mount("/static", static_files)])
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        await client.get("/static/assets/css/main.css")
+        await client.get("/static/assets/webfonts/icons.woff2")
+
+    # only metadata is cached, and only as much as the bound allows
+    assert list(static_files._entries) == ["assets/webfonts/icons.woff2"]
+    assert static_files._size == 1024
+
+
+async def test_preload_and_lru_bound(built):
+    output, _ = built
+    static_files = CachedStaticFiles(str(output), max_bytes=len(CSS) * 3)
+
+    loaded = await static_files.preload()
+
+    assert loaded > 0
+    assert static_files._size <= len(CSS) * 3
+
+
+async def test_watcher_drops_changed_files(built, static_files, client: AsyncClient):
+    output, _ = built
+    await client.get("/static/assets/css/main.css")
+    static_files.start_watching(0.01)
+    try:
+        (output / "assets" / "css" / "main.css").write_bytes(b"body{}")
+        for _ in range(100):
+            if "assets/css/main.css" not in static_files._entries:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await static_files.stop_watching()
+
+    response = await client.get(
+        "/static/assets/css/main.css", headers={"Accept-Encoding": ""}
+    )
+    assert response.content == b"body{}"
+
+
+async def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=90-200", 100) == (90, 99)
+    assert parse_range("bytes=100-", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=0-1,5-6", 100)
@@ -0,0 +1,77 @@
+import pytest
+from httpx import AsyncClient
+
+from storeapi import tracing
+from storeapi.main import app
+from storeapi.security import valid_access_token
+from storeapi.tracing import Trace, span, to_otlp
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def exported(monkeypatch) -> list:
+    # capture the traces that would be written to the OTLP file
+    traces = []
+    monkeypatch.setattr(tracing.config, "TRACING_ENABLED", True)
+    monkeypatch.setattr(tracing.exporter, "export", traces.append)
+    return traces
+
+
+async def test_spans_nest_under_the_active_span():
+    trace = Trace("0123456789abcdef0123456789abcdef")
+    trace_token = tracing._current_trace.set(trace)
+    try:
+        with span("outer") as outer:
+            with span("inner", step=1):
+                pass
+    finally:
+        tracing._current_trace.reset(trace_token)
+
+    inner = trace.spans[0]
+    assert inner.name == "inner"
+    assert inner.parent_id == outer.span_id
+
+    otlp_spans = to_otlp(trace)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert otlp_spans[0]["traceId"] == "0123456789abcdef0123456789abcdef"
+    assert otlp_spans[0]["attributes"] == [{"key": "step", "value": {"intValue": "1"}}]
+
+
+async def test_span_is_a_no_op_outside_a_request():
+    with span("untraced") as recorded:
+        assert recorded is None
+
+
+async def test_sampled_request_is_exported_with_its_stages(
+    monkeypatch, exported: list, async_api_test_client: AsyncClient
+):
+    monkeypatch.setattr(tracing.config, "TRACE_SAMPLE_RATE", 1.0)
+    app.dependency_overrides[valid_access_token] = lambda: {
+        "resource_access": {"elbaapi": {"roles": ["admin"]}}
+    }
+
+    response = await async_api_test_client.get("/admin/campaign/123456")
+
+    assert len(exported) == 1
+    trace = exported[0]
+    names = [recorded.name for recorded in trace.spans]
+    assert "db select campaigns" in names
+    assert names[-1] == "GET /admin/campaign/{campaign_id}"
+    # the trace id is the request's correlation id
+    assert trace.trace_id == response.headers["x-request-id"].replace("-", "")
+
+
+async def test_slow_request_is_kept_by_tail_sampling(
+    monkeypatch, exported: list, async_api_test_client: AsyncClient
+):
+    monkeypatch.setattr(tracing.config, "TRACE_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(tracing.config, "TRACE_SLOW_MS", 0.0)
+
+    await async_api_test_client.get("/public/campaign")
+
+    assert len(exported) == 1
+
+    monkeypatch.setattr(tracing.config, "TRACE_SLOW_MS", 60000.0)
+    await async_api_test_client.get("/public/campaign")
+
+    assert len(exported) == 1
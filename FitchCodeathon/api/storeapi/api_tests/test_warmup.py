@@ -0,0 +1,77 @@
+import pytest
+from httpx import AsyncClient
+
+from storeapi import warmup
+from storeapi.campaign_cache import fragment_cache
+from storeapi.config import config
+from storeapi.database import campaign_table, database
+from storeapi.main import app
+from storeapi.response_cache import response_cache
+from storeapi.warmup import readiness
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def cold_start(monkeypatch):
+    monkeypatch.setattr(readiness, "ready", False)
+    monkeypatch.setattr(readiness, "steps", {})
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ENABLED", True)
+    response_cache.clear()
+    fragment_cache.clear()
+    yield
+    response_cache.clear()
+    fragment_cache.clear()
+
+
+@pytest.fixture
+def jwks_fetches(monkeypatch) -> list:
+    fetches = []
+    monkeypatch.setattr(warmup, "get_jwks", lambda: fetches.append(1) or {"keys": []})
+    return fetches
+
+
+async def test_ready_only_after_warm_up(
+    async_api_test_client: AsyncClient, jwks_fetches: list
+):
+    assert (await async_api_test_client.get("/health")).status_code == 200
+    assert (await async_api_test_client.get("/ready")).status_code == 503
+
+    await readiness.warm_up(app)
+
+    response = await async_api_test_client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+    assert set(response.json()["warmup"]) == {"database", "jwks", "requests"}
+    assert jwks_fetches == [1]
+
+
+async def test_warm_up_fills_the_caches(jwks_fetches: list):
+    await database.execute(
+        campaign_table.insert().values(
+            name="Food bank",
+            template="t",
+            isDraft=False,
+            isPublished=True,
+            isEnded=False,
+            version=1,
+        )
+    )
+
+    await readiness.warm_up(app)
+
+    # the public listing and the campaigns page, with the card of the campaign
+    assert len(response_cache) == 2
+    assert len(fragment_cache) == 1
+
+
+async def test_failed_step_does_not_hold_readiness(monkeypatch):
+    def keycloak_down():
+        raise ConnectionError("Keycloak is down")
+
+    monkeypatch.setattr(warmup, "get_jwks", keycloak_down)
+
+    await readiness.warm_up(app)
+
+    assert readiness.ready
+    assert len(response_cache) == 2
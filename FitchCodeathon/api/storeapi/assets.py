@@ -0,0 +1,363 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from storeapi.css_optimizer import (
+    CssOptimizerUnavailable,
+    Usage,
+    collect_usage,
+    font_codepoints,
+    inline_critical_css,
+    purge_css,
+    script_tokens,
+    subset_font,
+)
+from storeapi.images import (
+    RASTER_EXTENSIONS,
+    VARIANT_FORMATS,
+    ImagesUnavailable,
+    build_variants,
+)
+
+logger = logging.getLogger(__name__)
+
+# Frontend asset pipeline, `python -m storeapi.assets build` writes frontend_build/ with hashed
+# and precompressed copies of the assets and manifest.json, served by static_cache.py
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
+BUILD_DIR = os.path.join(BASE_DIR, "frontend_build")
+MANIFEST_NAME = "manifest.json"
+IMAGES_MANIFEST_NAME = "images.json"
+
+HASH_LENGTH = 12
+HASHED_NAME = re.compile(r"\.[0-9a-f]{%d}\.[^./]+$" % HASH_LENGTH)
+
+# woff2, images and archives are already compressed, compressing them again only costs CPU
+COMPRESSIBLE_EXTENSIONS = {
+    ".css",
+    ".js",
+    ".json",
+    ".svg",
+    ".html",
+    ".txt",
+    ".xml",
+    ".map",
+    ".ttf",
+    ".eot",
+    ".otf",
+}
+# a variant is only kept when it saves at least this share of the original size
+MIN_COMPRESSION_SAVING = 0.1
+
+# content codings in order of preference, with the suffix of their precompressed variant
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# unhashed files and pages may change at any deploy, so they are revalidated on every use
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+CSS_URL = re.compile(r"""url\(\s*(["']?)([^"')]+)\1\s*\)""")
+HTML_REFERENCE = re.compile(
+    r"""(\b(?:href|src)=["'])((?:/?static/)?)(assets/[^"'?#]+)"""
+)
+# fontTools output flavor of the webfont formats that are subset, .eot and .svg fonts are only
+# used by very old browsers and left as they are
+FONT_FLAVORS = {".woff2": "woff2", ".woff": "woff", ".ttf": None, ".otf": None}
+
+HTML_IMG = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+IMG_SRC = re.compile(r"""\bsrc=["']((?:/?static/)?)(assets/[^"'?#]+)["']""")
+IMG_WIDTH = re.compile(r"""\bwidth=["']?(\d+)""")
+
+
+def import_brotli():
+    # brotli is optional, without it the build only writes gzip variants
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def hashed_name(path: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    root, extension = posixpath.splitext(path)
+    return f"{root}.{digest}{extension}"
+
+
+def map_css_urls(
+    css: str, css_path: str, mapper: Callable[[str], Optional[str]]
+) -> str:
+    """Replace the relative url() references of a stylesheet."""
+    base = posixpath.dirname(css_path)
+
+    def replace(match: re.Match) -> str:
+        quote, reference = match.groups()
+        if reference.startswith(("data:", "http:", "https:", "//", "/")):
+            return match.group(0)
+        # keep the ?#iefix style suffixes used by the older font formats
+        target, suffix = re.match(r"([^?#]*)(.*)", reference).groups()
+        replacement = mapper(posixpath.normpath(posixpath.join(base, target)))
+        if replacement is None:
+            return match.group(0)
+        return f"url({quote}{replacement}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def rewrite_css_urls(css: str, css_path: str, manifest: Dict[str, str]) -> str:
+    """Point the url() references of a stylesheet at the hashed files, keeping them relative."""
+    base = posixpath.dirname(css_path)
+
+    def hashed(path: str) -> Optional[str]:
+        return posixpath.relpath(manifest[path], base) if path in manifest else None
+
+    return map_css_urls(css, css_path, hashed)
+
+
+def rebase_css_urls(css: str, css_path: str, prefix: str) -> str:
+    """Make the url() references of a stylesheet relative to a page, for inlining it there."""
+    return map_css_urls(css, css_path, lambda path: f"{prefix}{path}")
+
+
+def picture_sources(img: str, images: Dict[str, Dict[str, list]]) -> str:
+    """Wrap an <img> with a variant of each format at every width, the browser picks the best."""
+    match = IMG_SRC.search(img)
+    variants = images.get(match.group(2)) if match else None
+    if not variants:
+        return img
+    prefix = match.group(1)
+    # a fixed width attribute tells the browser the displayed size, otherwise assume full width
+    width = IMG_WIDTH.search(img)
+    sizes = f"{width.group(1)}px" if width else "100vw"
+    sources = "".join(
+        f'<source type="{VARIANT_FORMATS[image_format][1]}" sizes="{sizes}" srcset="'
+        + ", ".join(
+            f"{prefix}{path} {variant_width}w" for variant_width, path in widths
+        )
+        + '">'
+        for image_format, widths in variants.items()
+    )
+    return f"<picture>{sources}{img}</picture>"
+
+
+def rewrite_html(
+    html: str,
+    manifest: Dict[str, str],
+    images: Optional[Dict[str, Dict[str, list]]] = None,
+) -> str:
+    if images:
+        html = HTML_IMG.sub(lambda match: picture_sources(match.group(0), images), html)
+
+    def replace(match: re.Match) -> str:
+        attribute, prefix, path = match.groups()
+        return f"{attribute}{prefix}{manifest.get(path, path)}"
+
+    return HTML_REFERENCE.sub(replace, html)
+
+
+def write_image_variants(
+    output_dir: str, relative_path: str, content: bytes
+) -> Dict[str, List[Tuple[int, str]]]:
+    """Write the resized variants of an image, returning their hashed paths per format."""
+    variants: Dict[str, List[Tuple[int, str]]] = {}
+    root = posixpath.splitext(relative_path)[0]
+    for image_format, resized in build_variants(content).items():
+        for width, data in resized:
+            path = hashed_name(f"{root}.{width}w.{image_format}", data)
+            write_file(output_dir, [path], data)
+            variants.setdefault(image_format, []).append((width, path))
+    return variants
+
+
+def compressed_variants(
+    path: str, content: bytes, brotli=None
+) -> List[Tuple[str, bytes]]:
+    """The gzip and brotli variants of a file that are worth serving, with their suffix."""
+    if posixpath.splitext(path)[1] not in COMPRESSIBLE_EXTENSIONS:
+        return []
+    variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(content, quality=11)))
+    return [
+        (suffix, compressed)
+        for suffix, compressed in variants
+        if len(compressed) <= len(content) * (1 - MIN_COMPRESSION_SAVING)
+    ]
+
+
+def write_file(
+    output_dir: str, relative_paths: List[str], content: bytes, brotli=None
+) -> None:
+    """Write a file and its compressed variants under each of the given names."""
+    variants = compressed_variants(relative_paths[0], content, brotli)
+    for relative_path in relative_paths:
+        path = os.path.join(output_dir, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for suffix, data in [("", content)] + variants:
+            with open(path + suffix, "wb") as file:
+                file.write(data)
+
+
+def purge_stylesheets(
+    source_dir: str, assets: List[str], pages: List[str]
+) -> Dict[str, str]:
+    """Every stylesheet without the rules that nothing in the pages or scripts can match."""
+    usage = Usage()
+    for relative_path in pages:
+        with open(os.path.join(source_dir, relative_path), encoding="utf-8") as file:
+            usage.update(collect_usage(file.read())[0])
+    for relative_path in assets:
+        if relative_path.endswith(".js"):
+            with open(
+                os.path.join(source_dir, relative_path), encoding="utf-8"
+            ) as file:
+                usage.add_tokens(script_tokens(file.read()))
+
+    purged = {}
+    for relative_path in assets:
+        if relative_path.endswith(".css"):
+            with open(
+                os.path.join(source_dir, relative_path), encoding="utf-8"
+            ) as file:
+                css = file.read()
+            purged[relative_path] = purge_css(css, usage)
+            logger.info(
+                f"Purged {relative_path} from {len(css)} to {len(purged[relative_path])} bytes"
+            )
+    return purged
+
+
+def subset_webfont(relative_path: str, content: bytes, codepoints: Set[int]) -> bytes:
+    flavor = FONT_FLAVORS[posixpath.splitext(relative_path)[1]]
+    try:
+        subset = subset_font(content, codepoints, flavor)
+    except CssOptimizerUnavailable:
+        raise
+    except Exception as ex:
+        logger.warning(f"Unable to subset {relative_path}, keeping it whole: {ex!r}")
+        return content
+    logger.info(f"Subset {relative_path} from {len(content)} to {len(subset)} bytes")
+    return subset
+
+
+def build(
+    source_dir: str = FRONTEND_DIR, output_dir: str = BUILD_DIR, optimize: bool = False
+) -> Dict[str, str]:
+    """Build the frontend into output_dir and return the manifest."""
+    brotli = import_brotli()
+    if brotli is None:
+        logger.warning("brotli is not installed, only gzip variants will be written")
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+
+    assets, pages = [], []
+    for directory, _, filenames in os.walk(source_dir):
+        for filename in sorted(filenames):
+            relative_path = os.path.relpath(
+                os.path.join(directory, filename), source_dir
+            )
+            relative_path = relative_path.replace(os.sep, "/")
+            if relative_path.startswith("assets/"):
+                assets.append(relative_path)
+            elif filename.endswith(".html"):
+                pages.append(relative_path)
+
+    manifest: Dict[str, str] = {}
+    images: Dict[str, Dict[str, List[Tuple[int, str]]]] = {}
+    resize_images = True
+    # the final content of each stylesheet, for the critical CSS of the pages
+    stylesheets: Dict[str, str] = {}
+    purged: Dict[str, str] = {}
+    codepoints: Optional[Set[int]] = None
+    if optimize:
+        purged = purge_stylesheets(source_dir, assets, pages)
+        # the icon glyphs the remaining rules can put on screen
+        codepoints = set().union(*(font_codepoints(css) for css in purged.values()))
+
+    # stylesheets go last as their content, and so their hash, depends on the hashed names of
+    # the fonts and images they reference
+    for relative_path in sorted(assets, key=lambda path: path.endswith(".css")):
+        with open(os.path.join(source_dir, relative_path), "rb") as file:
+            content = file.read()
+        extension = posixpath.splitext(relative_path)[1].lower()
+        if relative_path.endswith(".css"):
+            css = purged.get(relative_path) or content.decode("utf-8")
+            stylesheets[relative_path] = rewrite_css_urls(css, relative_path, manifest)
+            content = stylesheets[relative_path].encode("utf-8")
+        elif codepoints is not None and extension in FONT_FLAVORS:
+            try:
+                content = subset_webfont(relative_path, content, codepoints)
+            except CssOptimizerUnavailable:
+                logger.warning(
+                    "fonttools is not installed, webfonts will not be subset"
+                )
+                codepoints = None
+        manifest[relative_path] = hashed_name(relative_path, content)
+        # the unhashed copy keeps references the build does not rewrite (e.g. in scripts) working
+        write_file(
+            output_dir, [relative_path, manifest[relative_path]], content, brotli
+        )
+
+        if resize_images and extension in RASTER_EXTENSIONS:
+            try:
+                images[relative_path] = write_image_variants(
+                    output_dir, relative_path, content
+                )
+            except ImagesUnavailable:
+                logger.warning("Pillow is not installed, images will not be resized")
+                resize_images = False
+
+    for relative_path in pages:
+        with open(os.path.join(source_dir, relative_path), encoding="utf-8") as file:
+            html = file.read()
+        if optimize:
+            html = inline_critical_css(html, stylesheets, rebase_css_urls)
+        html = rewrite_html(html, manifest, images)
+        write_file(output_dir, [relative_path], html.encode("utf-8"), brotli)
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    with open(os.path.join(output_dir, IMAGES_MANIFEST_NAME), "w") as file:
+        json.dump(images, file, indent=2, sort_keys=True)
+    logger.info(
+        f"Built {len(assets)} assets, {len(images)} resized images and {len(pages)} pages "
+        f"into {output_dir}"
+    )
+    return manifest
+
+
+def load_manifest(output_dir: str = BUILD_DIR) -> Optional[Dict[str, str]]:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the frontend assets")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--source", default=FRONTEND_DIR)
+    parser.add_argument("--output", default=BUILD_DIR)
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="purge unused CSS, subset the webfonts and inline the critical CSS of each page",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    build(args.source, args.output, optimize=args.optimize)
+
+
+if __name__ == "__main__":
+    main()
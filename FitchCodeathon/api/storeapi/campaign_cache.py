@@ -0,0 +1,67 @@
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Set, Tuple
+
+from markupsafe import Markup
+
+from storeapi.metrics import FRAGMENT_CACHE
+
+logger = logging.getLogger(__name__)
+
+# Cached fragments of the server-rendered campaign pages, keyed by campaign id, version and the
+# totals shown, so a stale fragment is never served
+
+FragmentKey = Tuple[Hashable, ...]
+
+
+class FragmentCache:
+    """An LRU of rendered fragments, keyed by (kind, campaign_id, ...)."""
+
+    def __init__(self, max_entries: int = 1000) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[FragmentKey, Markup]" = OrderedDict()
+        # campaign id -> keys of its fragments, for invalidation
+        self._by_campaign: Dict[int, Set[FragmentKey]] = {}
+
+    def get_or_render(self, key: FragmentKey, render: Callable[[], str]) -> Markup:
+        fragment = self._entries.get(key)
+        if fragment is not None:
+            self._entries.move_to_end(key)
+            FRAGMENT_CACHE.inc("hit")
+            return fragment
+
+        FRAGMENT_CACHE.inc("miss")
+        fragment = Markup(render())
+        self._entries[key] = fragment
+        self._by_campaign.setdefault(key[1], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._forget(evicted)
+        return fragment
+
+    def invalidate(self, campaign_id: int) -> int:
+        keys = self._by_campaign.pop(campaign_id, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        if keys:
+            logger.debug(
+                f"Dropped {len(keys)} cached fragments of campaign {campaign_id}"
+            )
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_campaign.clear()
+
+    def _forget(self, key: FragmentKey) -> None:
+        keys = self._by_campaign.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_campaign[key[1]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+fragment_cache = FragmentCache()
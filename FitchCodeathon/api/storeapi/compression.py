@@ -0,0 +1,215 @@
+import time
+import zlib
+from typing import Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from storeapi.assets import import_brotli
+from storeapi.metrics import (
+    COMPRESSION_BYTES,
+    COMPRESSION_RATIO,
+    COMPRESSION_RESPONSES,
+    COMPRESSION_SECONDS,
+)
+from storeapi.static_cache import accepted_encodings
+
+# Compression of dynamic responses with brotli or gzip, streamed bodies chunk by chunk
+# Brotli runs at a low quality, about as fast as gzip at 6 and still smaller
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/msgpack",
+    "application/x-ndjson",
+    "image/svg+xml",
+)
+# never compressed here, whatever the content type
+SKIPPED_STATUSES = {204, 206, 304}
+
+
+class GzipEncoder:
+    def __init__(self, level: int) -> None:
+        # wbits 31 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        flush_mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(flush_mode)
+
+
+class BrotliEncoder:
+    def __init__(self, brotli, quality: int) -> None:
+        self._compressor = brotli.Compressor(quality=quality, mode=brotli.MODE_TEXT)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        output = self._compressor.process(data)
+        return output + (
+            self._compressor.finish() if final else self._compressor.flush()
+        )
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        exclude_paths: Tuple[str, ...] = ("/static", "/images"),
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.exclude_paths = exclude_paths
+        self.brotli = import_brotli()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+        encoding = self.choose_encoding(Headers(scope=scope))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressingResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    def choose_encoding(self, request_headers: Headers) -> Optional[str]:
+        accepted = accepted_encodings(request_headers)
+        if "br" in accepted and self.brotli is not None:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def encoder(self, encoding: str):
+        if encoding == "br":
+            return BrotliEncoder(self.brotli, self.brotli_quality)
+        return GzipEncoder(self.gzip_level)
+
+
+class CompressingResponder:
+    """Wraps send for one response, deciding from its headers and first bytes to compress it."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send) -> None:
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream = send
+        self.start_message: Optional[dict] = None
+        self.headers: Optional[MutableHeaders] = None
+        self.buffer = b""
+        # None until decided, then True when compressing and False when passing through
+        self.compressing: Optional[bool] = None
+        self.encoder = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            reason = self.skip_reason(
+                Headers(raw=message["headers"]), message["status"]
+            )
+            if reason is not None:
+                self.pass_through(reason)
+                await self.downstream(message)
+            return
+        if message["type"] != "http.response.body" or self.compressing is False:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressing is None:
+            self.buffer += body
+            if len(self.buffer) < self.middleware.minimum_size:
+                if more_body:
+                    # wait for enough of the stream to be worth compressing
+                    return
+                self.pass_through("small")
+                await self.downstream(self.start_message)
+                await self.downstream({**message, "body": self.buffer})
+                return
+            body, self.buffer = self.buffer, b""
+            self.start_compressing()
+            if more_body:
+                # streamed: the length is unknown, the headers go out now
+                if "content-length" in self.headers:
+                    del self.headers["content-length"]
+                await self.downstream(self.start_message)
+                self.start_message = None
+
+        compressed = self.compress(body, final=not more_body)
+        if not more_body:
+            if self.start_message is not None:
+                # a body sent in one message: its start was held for the compressed length
+                self.headers["content-length"] = str(len(compressed))
+                await self.downstream(self.start_message)
+            self.finish()
+        if compressed or not more_body:
+            await self.downstream(
+                {
+                    "type": "http.response.body",
+                    "body": compressed,
+                    "more_body": more_body,
+                }
+            )
+
+    def skip_reason(self, headers: Headers, status: int) -> Optional[str]:
+        if status < 200 or status in SKIPPED_STATUSES:
+            return "status"
+        if "content-encoding" in headers:
+            return "encoded"
+        if "no-transform" in headers.get("cache-control", ""):
+            return "no-transform"
+        if not is_compressible(headers.get("content-type", "")):
+            return "type"
+        content_length = headers.get("content-length")
+        if (
+            content_length is not None
+            and int(content_length) < self.middleware.minimum_size
+        ):
+            return "small"
+        return None
+
+    def pass_through(self, reason: str) -> None:
+        self.compressing = False
+        COMPRESSION_RESPONSES.inc(self.encoding, reason)
+
+    def start_compressing(self) -> None:
+        self.compressing = True
+        self.encoder = self.middleware.encoder(self.encoding)
+        self.headers = MutableHeaders(raw=self.start_message["headers"])
+        self.headers["content-encoding"] = self.encoding
+        self.headers.add_vary_header("Accept-Encoding")
+        etag = self.headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            # the compressed bytes are not the ones the strong tag was computed over
+            self.headers["etag"] = f"W/{etag}"
+        if "accept-ranges" in self.headers:
+            del self.headers["accept-ranges"]
+
+    def compress(self, body: bytes, final: bool) -> bytes:
+        start = time.thread_time()
+        compressed = self.encoder.compress(body, final)
+        self.cpu_seconds += time.thread_time() - start
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        return compressed
+
+    def finish(self) -> None:
+        COMPRESSION_RESPONSES.inc(self.encoding, "compressed")
+        COMPRESSION_BYTES.inc(self.encoding, "in", amount=self.bytes_in)
+        COMPRESSION_BYTES.inc(self.encoding, "out", amount=self.bytes_out)
+        COMPRESSION_SECONDS.inc(self.encoding, amount=self.cpu_seconds)
+        if self.bytes_in:
+            COMPRESSION_RATIO.observe(self.bytes_out / self.bytes_in, self.encoding)
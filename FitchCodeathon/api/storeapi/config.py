@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
 import os
 
@@ -29,15 +29,117 @@ class GlobalConfig(BaseConfig):
     KC_AUTH_URL: Optional[str] = None
     KC_REFRESH_URL: Optional[str] = None
     KC_CERTS_URL: Optional[str] = None
+    # How long the Keycloak JWKS is reused before it is fetched again
+    # a token signed by a key that is not in it triggers an early fetch, at most once per
+    # JWKS_MIN_REFRESH_SECONDS so that forged tokens cannot hammer Keycloak
+    JWKS_CACHE_SECONDS: int = 300
+    JWKS_MIN_REFRESH_SECONDS: int = 30
+    # Request tracing, see tracing.py, off unless enabled with a TRACE_EXPORT_PATH to write to
+    # a TRACE_SAMPLE_RATE share of requests and every request slower than TRACE_SLOW_MS is
+    # written as OTLP/JSON lines to TRACE_EXPORT_PATH
+    TRACING_ENABLED: bool = False
+    TRACE_SAMPLE_RATE: float = 0.01
+    TRACE_SLOW_MS: float = 500
+    TRACE_EXPORT_PATH: str = "traces.jsonl"
+    # Statements slower than SLOW_QUERY_MS are logged with their parameters and caller, see
+    # db_instrumentation.py, and with SLOW_QUERY_EXPLAIN the plan of a SELECT that was slow
+    # SLOW_QUERY_EXPLAIN_AFTER times is captured with EXPLAIN (ANALYZE, BUFFERS)
+    SLOW_QUERY_MS: float = 200
+    SLOW_QUERY_EXPLAIN: bool = False
+    SLOW_QUERY_EXPLAIN_AFTER: int = 3
+    # Static files are served from memory, see static_cache.py, with STATIC_WATCH the cache
+    # drops the files that change on disk
+    STATIC_CACHE_MAX_MB: int = 64
+    STATIC_CACHE_MAX_FILE_KB: int = 512
+    STATIC_WATCH: bool = False
+    STATIC_WATCH_INTERVAL: float = 1.0
+    # On-demand image resizing, see images.py, results are cached on disk up to IMAGE_CACHE_MAX_MB
+    IMAGE_CACHE_DIR: str = "image_cache"
+    IMAGE_CACHE_MAX_MB: int = 256
+    # Dynamic responses of at least COMPRESSION_MIN_BYTES are compressed, see compression.py
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_BYTES: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    # Handlers using trusted_response encode their rows without validating them against the
+    # response model, see serialization.py
+    TRUSTED_RESPONSES: bool = False
+    # Anonymous GET routes declared with @cached are served from an in-process LRU, see
+    # response_cache.py, shared between workers through Redis when RESPONSE_CACHE_REDIS_URL is set
+    # in which case local entries live at most RESPONSE_CACHE_LOCAL_TTL seconds
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_REDIS_URL: Optional[str] = None
+    RESPONSE_CACHE_LOCAL_TTL: float = 1.0
+    # Event loop lag monitor, see loop_monitor.py
+    # with LOOP_BLOCK_DEBUG the stack of any call blocking the loop for longer than
+    # LOOP_BLOCK_THRESHOLD_MS is captured and logged
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL: float = 0.05
+    LOOP_BLOCK_THRESHOLD_MS: float = 100
+    LOOP_BLOCK_DEBUG: bool = False
+    # Logging handlers run on a background thread fed by a bounded queue, see logging_conf.py
+    # when the queue is full records are dropped, with the "sample" policy only 1 in
+    # LOG_QUEUE_SAMPLE_RATE records below WARNING is kept once the queue is half full
+    LOG_QUEUE_ENABLED: bool = True
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_QUEUE_POLICY: str = "sample"
+    LOG_QUEUE_SAMPLE_RATE: int = 10
+    # Pre-fork server, see serve.py
+    # SERVER_WORKERS 0 runs a worker per available core, a worker is recycled after
+    # SERVER_MAX_REQUESTS requests (0 never) or once its RSS exceeds SERVER_MAX_RSS_MB (0 never)
+    SERVER_HOST: str = "127.0.0.1"
+    SERVER_PORT: int = 8081
+    SERVER_WORKERS: int = 0
+    SERVER_MAX_REQUESTS: int = 0
+    SERVER_MAX_REQUESTS_JITTER: int = 1000
+    SERVER_MAX_RSS_MB: int = 0
+    SERVER_GRACEFUL_TIMEOUT: int = 30
+    SERVER_STARTUP_TIMEOUT: int = 60
+    # Warm-up before serving, see warmup.py
+    # WARMUP_DB_CONNECTIONS connections run the hot statements, the Keycloak JWKS is fetched and
+    # WARMUP_PATHS are requested through the app, each step giving up after WARMUP_STEP_TIMEOUT
+    WARMUP_ENABLED: bool = True
+    WARMUP_DB_CONNECTIONS: int = 4
+    WARMUP_PATHS: List[str] = ["/public/campaign", "/campaigns"]
+    WARMUP_STEP_TIMEOUT: float = 10
+    # Admission control by route class, see admission.py
+    # each worker runs at most ADMISSION_MAX_IN_FLIGHT requests at once, the requests shed are
+    # answered 503 with Retry-After ADMISSION_RETRY_AFTER seconds
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_IN_FLIGHT: int = 100
+    ADMISSION_RETRY_AFTER: int = 2
+    # Login and registration rate limits, see rate_limit.py
+    # attempts per RATE_LIMIT_WINDOW seconds from one client address and for one email address,
+    # counted per worker, or across workers when RATE_LIMIT_REDIS_URL is set
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_WINDOW: float = 60
+    RATE_LIMIT_IP_ATTEMPTS: int = 20
+    RATE_LIMIT_EMAIL_ATTEMPTS: int = 10
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    RATE_LIMIT_REDIS_URL: Optional[str] = None
+    # Refresh tokens, see refresh_tokens.py
+    # a login starts a session of rotating refresh tokens, each valid for REFRESH_TOKEN_DAYS, and
+    # the access tokens they renew last ACCESS_TOKEN_MINUTES
+    REFRESH_TOKEN_DAYS: int = 30
+    ACCESS_TOKEN_MINUTES: int = 15
 
 # Configuration settings for the development environment
 class DevConfig(GlobalConfig):
+    # catch blocking calls in async handlers while developing
+    LOOP_BLOCK_DEBUG: bool = True
+    SLOW_QUERY_EXPLAIN: bool = True
+    # pick up frontend edits without a restart
+    STATIC_WATCH: bool = True
+
     model_config = SettingsConfigDict(env_prefix="DEV_")
 
 # Configuration settings for the test environment
 class TestConfig(GlobalConfig):
     DATABASE_URL: str = "sqlite:///test.db"
     DB_FORCE_ROLL_BACK: bool = True
+    # cached responses would outlive the rolled back data of the test that rendered them
+    RESPONSE_CACHE_ENABLED: bool = False
 
     model_config = SettingsConfigDict(
         env_prefix="TEST_",
@@ -53,12 +155,5 @@ def get_config(env_state: Optional[str] = "dev"):
     }
     return configs.get(env_state, DevConfig)()
 
-# Load the .env file from the storeapi directory
-print("Loading environment variables from .env...")
-
 # Get the configuration for the current environment (default is "dev")
 config = get_config(BaseConfig().ENV_STATE)
-
-# Check that the PAYPAL_CLIENT_ID and PAYPAL_SECRET are loaded correctly
-print(f"PAYPAL_CLIENT_ID: {config.PAYPAL_CLIENT_ID}")
-print(f"PAYPAL_SECRET: {config.PAYPAL_SECRET}")
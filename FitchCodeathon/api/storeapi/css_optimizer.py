@@ -0,0 +1,403 @@
+import io
+import re
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+# CSS purging, webfont subsetting and critical CSS for `python -m storeapi.assets build --optimize`
+# A selector is only dropped when one of its classes, ids or elements appears nowhere
+
+# a CSS rule is (prelude, body), the body being the declarations or, for @media and the like,
+# the list of nested rules; statements without a block such as @import have a None body
+Rule = Tuple[str, Union[str, List["Rule"], None]]
+
+# at-rules holding nested rules rather than declarations
+GROUPING_AT_RULES = (
+    "@media",
+    "@supports",
+    "@layer",
+    "@document",
+    "@-moz-document",
+    "@container",
+)
+
+CLASS_SELECTOR = re.compile(r"\.((?:[\w-]|\\.)+)")
+ID_SELECTOR = re.compile(r"#((?:[\w-]|\\.)+)")
+ELEMENT_SELECTOR = re.compile(r"(?<![\w.#:\\-])([a-zA-Z][a-zA-Z0-9-]*)")
+# pseudo-classes and elements (with their arguments) and attribute selectors never make a
+# selector unused, :not(.x) in particular matches more when .x is unused
+PSEUDO_AND_ATTRIBUTE = re.compile(
+    r"::?[\w-]+(?:\([^()]*(?:\([^()]*\)[^()]*)*\))?|\[[^\]]*\]"
+)
+SCRIPT_STRING = re.compile(r"""(["'`])((?:\\.|(?!\1).){1,200}?)\1""")
+TOKEN = re.compile(r"[A-Za-z_][\w-]*")
+
+FONT_FAMILY = re.compile(r"""font-family\s*:\s*["']?([^;"'}]+)""", re.IGNORECASE)
+KEYFRAMES_NAME = re.compile(r"@(?:-[\w]+-)?keyframes\s+([\w-]+)", re.IGNORECASE)
+LICENCE_COMMENT = re.compile(r"/\*!.*?\*/", re.DOTALL)
+ESCAPED_STRING = re.compile(r"""["']((?:\\[0-9a-fA-F]{1,6}\s?)+)["']""")
+
+# at-rules only kept when a style rule refers to them, their own bodies do not count
+UNREFERENCED_AT_RULES = (
+    "@font-face",
+    "@keyframes",
+    "@-webkit-keyframes",
+    "@-moz-keyframes",
+)
+
+CRITICAL_ELEMENTS = ("html", "body", "head", "main", "*")
+
+
+class CssOptimizerUnavailable(RuntimeError):
+    """Raised when fonts must be subset but fontTools is not installed."""
+
+
+def import_fonttools():
+    # fontTools is only needed by the optimising build, so it is imported on first use
+    try:
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+    except ImportError as ex:
+        raise CssOptimizerUnavailable(
+            "Font subsetting requires the fonttools package"
+        ) from ex
+    return subset, TTFont
+
+
+class Usage:
+    """The classes, ids and element names a set of pages can produce."""
+
+    def __init__(self) -> None:
+        self.classes: Set[str] = set()
+        self.ids: Set[str] = set()
+        self.elements: Set[str] = set(CRITICAL_ELEMENTS)
+
+    def update(self, other: "Usage") -> None:
+        self.classes |= other.classes
+        self.ids |= other.ids
+        self.elements |= other.elements
+
+    def add_tokens(self, tokens: Iterable[str]) -> None:
+        # a token from a script may be any of the three
+        for token in tokens:
+            self.classes.add(token)
+            self.ids.add(token)
+            self.elements.add(token.lower())
+
+
+class UsageParser(HTMLParser):
+    """Collects the usage of a page, and separately of its top up to the first <section>."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.usage = Usage()
+        self.above_fold = Usage()
+        self._in_fold = True
+        self._section_depth = 0
+        self._in_script = False
+
+    def handle_starttag(self, tag, attrs) -> None:
+        targets = [self.usage, self.above_fold] if self._in_fold else [self.usage]
+        for usage in targets:
+            usage.elements.add(tag)
+            for name, value in attrs:
+                if name == "class" and value:
+                    usage.classes.update(value.split())
+                elif name == "id" and value:
+                    usage.ids.add(value)
+        if tag == "section":
+            self._section_depth += 1
+        self._in_script = tag == "script"
+
+    def handle_endtag(self, tag) -> None:
+        if tag == "section" and self._section_depth:
+            self._section_depth -= 1
+            if self._section_depth == 0:
+                self._in_fold = False
+        if tag == "script":
+            self._in_script = False
+
+    def handle_data(self, data) -> None:
+        if self._in_script:
+            self.usage.add_tokens(script_tokens(data))
+
+
+def collect_usage(html: str) -> Tuple[Usage, Usage]:
+    """The usage of a whole page and of its top."""
+    parser = UsageParser()
+    parser.feed(html)
+    parser.close()
+    return parser.usage, parser.above_fold
+
+
+def script_tokens(script: str) -> Set[str]:
+    tokens = set()
+    for match in SCRIPT_STRING.finditer(script):
+        tokens.update(TOKEN.findall(match.group(2)))
+    return tokens
+
+
+def parse_stylesheet(css: str) -> List[Rule]:
+    rules, _ = _parse_rules(css, 0)
+    return rules
+
+
+def _parse_rules(css: str, position: int) -> Tuple[List[Rule], int]:
+    rules: List[Rule] = []
+    start = position
+    length = len(css)
+    while position < length:
+        char = css[position]
+        if css.startswith("/*", position):
+            # comments are skipped here and stripped from the preludes below
+            end = css.find("*/", position + 2)
+            position = length if end == -1 else end + 2
+            continue
+        if char in "\"'":
+            position = _skip_string(css, position)
+            continue
+        if char == ";":
+            statement = _strip_comments(css[start:position]).strip()
+            if statement:
+                rules.append((statement, None))
+            position += 1
+            start = position
+        elif char == "{":
+            prelude = _strip_comments(css[start:position]).strip()
+            if prelude.lower().startswith(GROUPING_AT_RULES):
+                nested, position = _parse_rules(css, position + 1)
+                rules.append((prelude, nested))
+            else:
+                end = _block_end(css, position + 1)
+                rules.append((prelude, css[position + 1 : end].strip()))
+                position = end + 1
+            start = position
+        elif char == "}":
+            return rules, position + 1
+        else:
+            position += 1
+    return rules, position
+
+
+def _skip_string(css: str, position: int) -> int:
+    quote = css[position]
+    position += 1
+    while position < len(css) and css[position] != quote:
+        position += 2 if css[position] == "\\" else 1
+    return position + 1
+
+
+def _block_end(css: str, position: int) -> int:
+    depth = 1
+    while position < len(css):
+        char = css[position]
+        if css.startswith("/*", position):
+            end = css.find("*/", position + 2)
+            position = len(css) if end == -1 else end + 2
+            continue
+        if char in "\"'":
+            position = _skip_string(css, position)
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return position
+        position += 1
+    return position
+
+
+def _strip_comments(text: str) -> str:
+    return re.sub(r"/\*.*?\*/", "", text, flags=re.DOTALL)
+
+
+def serialize(rules: List[Rule]) -> str:
+    parts = []
+    for prelude, body in rules:
+        if body is None:
+            parts.append(f"{prelude};")
+        elif isinstance(body, list):
+            parts.append(f"{prelude}{{{serialize(body)}}}")
+        else:
+            parts.append(f"{prelude}{{{body}}}")
+    return "".join(parts)
+
+
+def split_selectors(prelude: str) -> List[str]:
+    # split on the commas that are not inside :is(), :not() and friends
+    selectors, depth, start = [], 0, 0
+    for index, char in enumerate(prelude):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            selectors.append(prelude[start:index].strip())
+            start = index + 1
+    selectors.append(prelude[start:].strip())
+    return [selector for selector in selectors if selector]
+
+
+def unescape(name: str) -> str:
+    return re.sub(r"\\(.)", r"\1", name)
+
+
+def selector_used(selector: str, usage: Usage) -> bool:
+    simple = PSEUDO_AND_ATTRIBUTE.sub("", selector)
+    if any(
+        unescape(name) not in usage.classes for name in CLASS_SELECTOR.findall(simple)
+    ):
+        return False
+    if any(unescape(name) not in usage.ids for name in ID_SELECTOR.findall(simple)):
+        return False
+    without_names = ID_SELECTOR.sub("", CLASS_SELECTOR.sub("", simple))
+    return all(
+        element.lower() in usage.elements
+        for element in ELEMENT_SELECTOR.findall(without_names)
+    )
+
+
+def _purge_rules(rules: List[Rule], usage: Usage) -> List[Rule]:
+    kept: List[Rule] = []
+    for prelude, body in rules:
+        lowered = prelude.lower()
+        if isinstance(body, list):
+            nested = _purge_rules(body, usage)
+            if nested:
+                kept.append((prelude, nested))
+        elif body is None or lowered.startswith("@"):
+            # @font-face and @keyframes are filtered once the used rules are known
+            kept.append((prelude, body))
+        else:
+            selectors = [
+                selector
+                for selector in split_selectors(prelude)
+                if selector_used(selector, usage)
+            ]
+            if selectors:
+                kept.append((",".join(selectors), body))
+    return kept
+
+
+def _declarations(rules: List[Rule]) -> str:
+    text = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            text.append(_declarations(body))
+        elif body is not None and not prelude.lower().startswith(UNREFERENCED_AT_RULES):
+            text.append(body)
+    return "\n".join(text)
+
+
+def _drop_unreferenced(rules: List[Rule], declarations: str) -> List[Rule]:
+    lowered = declarations.lower()
+    kept: List[Rule] = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            nested = _drop_unreferenced(body, declarations)
+            if nested:
+                kept.append((prelude, nested))
+            continue
+        if prelude.lower().startswith("@font-face"):
+            family = FONT_FAMILY.search(body or "")
+            if family and family.group(1).strip().lower() not in lowered:
+                continue
+        keyframes = KEYFRAMES_NAME.match(prelude)
+        if keyframes and not re.search(
+            rf"\b{re.escape(keyframes.group(1))}\b", declarations
+        ):
+            continue
+        kept.append((prelude, body))
+    return kept
+
+
+def _purged_rules(css: str, usage: Usage) -> List[Rule]:
+    rules = _purge_rules(parse_stylesheet(css), usage)
+    return _drop_unreferenced(rules, _declarations(rules))
+
+
+def purge_css(css: str, usage: Usage) -> str:
+    """Remove the rules matching nothing in usage and the @font-face and @keyframes left unused."""
+    # licence comments (/*! ... */) are kept
+    licences = "".join(LICENCE_COMMENT.findall(css))
+    return licences + serialize(_purged_rules(css, usage))
+
+
+def critical_css(css: str, usage: Usage) -> str:
+    # @import and @charset are only valid at the top of a stylesheet, the imports are left to
+    # the full stylesheet loaded after the first paint
+    rules = [
+        (prelude, body)
+        for prelude, body in _purged_rules(css, usage)
+        if body is not None
+    ]
+    return serialize(rules)
+
+
+def font_codepoints(css: str) -> Set[int]:
+    """The characters put on screen by the content of the rules, i.e. the icon glyphs."""
+    codepoints = set()
+    for match in ESCAPED_STRING.finditer(css):
+        for escape in re.findall(r"\\([0-9a-fA-F]{1,6})", match.group(1)):
+            codepoints.add(int(escape, 16))
+    return codepoints
+
+
+# the printable ASCII range is always kept, some icon fonts map ligatures and spaces onto it
+BASIC_CODEPOINTS = set(range(0x20, 0x7F))
+
+
+def subset_font(content: bytes, codepoints: Set[int], flavor: Optional[str]) -> bytes:
+    """Keep only the glyphs of the given characters, flavor being "woff2", "woff" or None."""
+    subset, TTFont = import_fonttools()
+    font = TTFont(io.BytesIO(content))
+    options = subset.Options()
+    options.flavor = flavor
+    options.layout_features = ["*"]
+    options.notdef_outline = True
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints | BASIC_CODEPOINTS)
+    subsetter.subset(font)
+    font.flavor = flavor
+    output = io.BytesIO()
+    font.save(output)
+    return output.getvalue()
+
+
+def stylesheet_links(html: str) -> List[Tuple[str, str, str]]:
+    """The (whole tag, path prefix, asset path) of every local stylesheet a page links."""
+    links = []
+    for match in re.finditer(r"<link\b[^>]*>", html, re.IGNORECASE):
+        tag = match.group(0)
+        if not re.search(r"""rel=["']?stylesheet""", tag, re.IGNORECASE):
+            continue
+        href = re.search(r"""href=["']((?:/?static/)?)(assets/[^"'?#]+\.css)""", tag)
+        if href:
+            links.append((tag, href.group(1), href.group(2)))
+    return links
+
+
+def inline_critical_css(html: str, stylesheets: Dict[str, str], rebase) -> str:
+    """Inline the rules the top of the page needs, the full stylesheets load without blocking."""
+    links = stylesheet_links(html)
+    if not links or "</head>" not in html:
+        return html
+    _, above_fold = collect_usage(html)
+
+    critical = []
+    for tag, prefix, path in links:
+        css = stylesheets.get(path)
+        if css is None:
+            continue
+        critical.append(rebase(critical_css(css, above_fold), path, prefix))
+        # preloaded and applied once loaded, with a plain link for browsers without scripts
+        href = f"{prefix}{path}"
+        html = html.replace(
+            tag,
+            f'<link rel="preload" href="{href}" as="style" '
+            f"onload=\"this.onload=null;this.rel='stylesheet'\">"
+            f'<noscript><link rel="stylesheet" href="{href}"></noscript>',
+            1,
+        )
+    style = "<style>" + "".join(critical) + "</style>"
+    return html.replace("</head>", f"{style}\n</head>", 1)
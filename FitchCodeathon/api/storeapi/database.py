@@ -1,11 +1,33 @@
+from datetime import datetime
 from passlib.context import CryptContext
-import databases
 import sqlalchemy as SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn
 from storeapi.config import config
+from storeapi.db_instrumentation import InstrumentedDatabase
 
 # Initialize CryptContext with bcrypt hashing scheme
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# The current UTC time on the database's clock, Postgres' now() is in the session's time zone
+class utcnow(SQLAlchemy.sql.expression.FunctionElement):
+    type = SQLAlchemy.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "postgresql")
+def postgresql_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+# SQLite's CURRENT_TIMESTAMP is in UTC
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
 # metadata variable stores information about the database table and columns etc.
 metadata = SQLAlchemy.MetaData()
 
@@ -18,6 +40,8 @@ campaign_table = SQLAlchemy.Table(
     SQLAlchemy.Column("isDraft", SQLAlchemy.Boolean, default=True),
     SQLAlchemy.Column("isPublished", SQLAlchemy.Boolean, default=False),
     SQLAlchemy.Column("isEnded", SQLAlchemy.Boolean, default=False),
+    # bumped on every update, keys the cached fragments of the server-rendered pages
+    SQLAlchemy.Column("version", SQLAlchemy.Integer, nullable=False, default=1, server_default="1"),
 )
 
 users = SQLAlchemy.Table(
@@ -35,12 +59,32 @@ payments = SQLAlchemy.Table(
     metadata,
     SQLAlchemy.Column("id", SQLAlchemy.Integer, primary_key=True),
     SQLAlchemy.Column("user_id", SQLAlchemy.Integer, SQLAlchemy.ForeignKey("users.id")),  # Link to the user
+    SQLAlchemy.Column("campaign_id", SQLAlchemy.Integer, SQLAlchemy.ForeignKey("campaigns.id"), nullable=True),  # Campaign donated to
     SQLAlchemy.Column("amount", SQLAlchemy.Float),
     SQLAlchemy.Column("status", SQLAlchemy.String(50)),  # "success" or "failed"
     SQLAlchemy.Column("payment_method", SQLAlchemy.String(50)),
-    SQLAlchemy.Column("created_at", SQLAlchemy.DateTime, default=SQLAlchemy.func.now())
+    SQLAlchemy.Column("created_at", SQLAlchemy.DateTime, default=SQLAlchemy.func.now()),
+    # last change of the row, the incremental finance export picks up changed rows by it
+    # stamped by the database's UTC clock, which the export's cutoff is also read from
+    SQLAlchemy.Column("updated_at", SQLAlchemy.DateTime, nullable=False, default=utcnow(), onupdate=utcnow()),
+    # id of the payment at PayPal, looked up when the donor comes back to execute it
+    SQLAlchemy.Column("paypal_payment_id", SQLAlchemy.String(64), nullable=True, unique=True),
+)
+
+# Backs the donor payment history (GET /user/payments), which is keyset-paginated per user
+SQLAlchemy.Index(
+    "ix_payments_user_id_created_at_id",
+    payments.c.user_id,
+    payments.c.created_at,
+    payments.c.id,
 )
 
+# Backs the date-range scans of the finance export
+SQLAlchemy.Index("ix_payments_created_at_id", payments.c.created_at, payments.c.id)
+
+# Backs the incremental (since_last) finance export
+SQLAlchemy.Index("ix_payments_updated_at_id", payments.c.updated_at, payments.c.id)
+
 refund_requests = SQLAlchemy.Table(
     "refund_requests",
     metadata,
@@ -51,8 +95,84 @@ refund_requests = SQLAlchemy.Table(
     SQLAlchemy.Column("status", SQLAlchemy.String(50), default="pending"),  # "pending", "approved", "rejected"
     SQLAlchemy.Column("admin_approved", SQLAlchemy.Boolean, default=False),
     SQLAlchemy.Column("created_at", SQLAlchemy.DateTime, default=SQLAlchemy.func.now()),
+    # last change of the row, set again when the refund is approved or rejected
+    SQLAlchemy.Column("updated_at", SQLAlchemy.DateTime, nullable=False, default=utcnow(), onupdate=utcnow()),
+)
+
+# Backs the date-range scans of the finance export
+SQLAlchemy.Index(
+    "ix_refund_requests_created_at_id", refund_requests.c.created_at, refund_requests.c.id
+)
+
+# Backs the incremental (since_last) finance export
+SQLAlchemy.Index(
+    "ix_refund_requests_updated_at_id", refund_requests.c.updated_at, refund_requests.c.id
+)
+
+# Partial index backing the admin refund queue (GET /admin/refunds)
+# only pending rows are indexed, so paging through the queue costs the same whether the table
+# holds a thousand refunds or a million processed ones
+SQLAlchemy.Index(
+    "ix_refund_requests_pending_created_at_id",
+    refund_requests.c.created_at,
+    refund_requests.c.id,
+    postgresql_where=refund_requests.c.status == "pending",
+    sqlite_where=refund_requests.c.status == "pending",
+)
+
+# Pre-aggregated donation totals per campaign per hour and per day
+# maintained incrementally by store_payment and settle_payment as payments settle, so the admin analytics only ever
+# read buckets instead of aggregating the payments table
+# campaign_id 0 collects payments that are not linked to a campaign (a NULL would never conflict
+# in the unique constraint below and so could not be upserted)
+payment_rollups = SQLAlchemy.Table(
+    "payment_rollups",
+    metadata,
+    SQLAlchemy.Column("id", SQLAlchemy.Integer, primary_key=True),
+    SQLAlchemy.Column("campaign_id", SQLAlchemy.Integer, nullable=False, default=0),
+    SQLAlchemy.Column("granularity", SQLAlchemy.String(4), nullable=False),  # "hour" or "day"
+    SQLAlchemy.Column("bucket_start", SQLAlchemy.DateTime, nullable=False),
+    SQLAlchemy.Column("total_amount", SQLAlchemy.Float, nullable=False, default=0),
+    SQLAlchemy.Column("payment_count", SQLAlchemy.Integer, nullable=False, default=0),
+    SQLAlchemy.UniqueConstraint(
+        "campaign_id", "granularity", "bucket_start", name="uq_payment_rollups_bucket"
+    ),
+)
+
+# High-water mark of the last finance export per table, so that an incremental export
+# can resume straight after the last (updated_at, id) it emitted
+export_watermarks = SQLAlchemy.Table(
+    "export_watermarks",
+    metadata,
+    SQLAlchemy.Column("name", SQLAlchemy.String(50), primary_key=True),
+    SQLAlchemy.Column("last_updated_at", SQLAlchemy.DateTime, nullable=False),
+    SQLAlchemy.Column("last_id", SQLAlchemy.Integer, nullable=False),
+    SQLAlchemy.Column("exported_at", SQLAlchemy.DateTime, nullable=False),
+)
+
+# Refresh tokens exchanged at POST /user/refresh for a new access token, see refresh_tokens.py
+# only the SHA-256 of a token is stored, the tokens rotated from one login share a family which
+# is revoked as a whole when a rotated token is used again
+refresh_tokens = SQLAlchemy.Table(
+    "refresh_tokens",
+    metadata,
+    SQLAlchemy.Column("id", SQLAlchemy.Integer, primary_key=True),
+    SQLAlchemy.Column("user_id", SQLAlchemy.Integer, SQLAlchemy.ForeignKey("users.id"), nullable=False),
+    SQLAlchemy.Column("token_hash", SQLAlchemy.String(64), nullable=False, unique=True, index=True),
+    SQLAlchemy.Column("family", SQLAlchemy.String(32), nullable=False, index=True),
+    SQLAlchemy.Column("expires_at", SQLAlchemy.DateTime, nullable=False),
+    SQLAlchemy.Column("revoked", SQLAlchemy.Boolean, nullable=False, default=False),
+    SQLAlchemy.Column("created_at", SQLAlchemy.DateTime, default=SQLAlchemy.func.now()),
 )
 
+# Only payments in one of these states count towards the rollups
+SETTLED_PAYMENT_STATUSES = {"success", "approved", "completed"}
+
+ROLLUP_GRANULARITIES = {
+    "hour": lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    "day": lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
 # Function to create a new user and hash the password using pwd_context
 async def create_user(user):
     # Hash the password
@@ -74,15 +194,71 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# Function returning an INSERT that supports ON CONFLICT DO UPDATE for the connected database
+# upserts are dialect specific, both Postgres and SQLite support them
+def upsert(table):
+    if database.url.dialect == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
+# Function to add a settled payment to its hourly and daily rollup buckets
+async def record_payment_rollup(campaign_id, amount: float, settled_at: datetime):
+    for granularity, truncate in ROLLUP_GRANULARITIES.items():
+        query = (
+            upsert(payment_rollups)
+            .values(
+                campaign_id=campaign_id or 0,
+                granularity=granularity,
+                bucket_start=truncate(settled_at),
+                total_amount=amount,
+                payment_count=1,
+            )
+            .on_conflict_do_update(
+                index_elements=["campaign_id", "granularity", "bucket_start"],
+                set_={
+                    "total_amount": payment_rollups.c.total_amount + amount,
+                    "payment_count": payment_rollups.c.payment_count + 1,
+                },
+            )
+        )
+        await database.execute(query)
+
+
 # Function to store a payment record
-async def store_payment(user_id: int, amount: float, status: str, payment_method: str):
+async def store_payment(user_id: int, amount: float, status: str, payment_method: str, campaign_id: int = None, paypal_payment_id: str = None):
+    created_at = datetime.utcnow()
     query = payments.insert().values(
         user_id=user_id,
+        campaign_id=campaign_id,
         amount=amount,
         status=status,
-        payment_method=payment_method
+        payment_method=payment_method,
+        created_at=created_at,
+        paypal_payment_id=paypal_payment_id,
     )
-    return await database.execute(query)
+    # the payment and its rollup buckets are written together so the totals never drift
+    async with database.transaction():
+        payment_id = await database.execute(query)
+        if status in SETTLED_PAYMENT_STATUSES:
+            await record_payment_rollup(campaign_id, amount, created_at)
+    return payment_id
+
+
+# Function to record the outcome of a stored payment once PayPal has executed it
+# the rollup is only added on the first change to a settled status, in the same transaction as
+# the status, so executing a payment twice cannot count it twice
+async def settle_payment(payment_id: int, status: str):
+    settled_at = datetime.utcnow()
+    async with database.transaction():
+        query = payments.select().where(payments.c.id == payment_id).with_for_update()
+        payment = await database.fetch_one(query)
+        if payment is None or payment["status"] in SETTLED_PAYMENT_STATUSES:
+            return
+        query = payments.update().where(payments.c.id == payment_id).values(status=status)
+        await database.execute(query)
+        if status in SETTLED_PAYMENT_STATUSES:
+            await record_payment_rollup(payment["campaign_id"], payment["amount"], settled_at)
 
 
 # engine is used to connect to a particular type of database like SQLite or Postgres
@@ -90,11 +266,63 @@ engine = SQLAlchemy.create_engine(
     config.DATABASE_URL,
     # connect_args={"check_same_thread": False},  # Only necessary for SQLite
 )
-metadata.create_all(engine)
+
+
+# Raised at startup when existing tables lack columns the app needs, create_all only creates the
+# tables that do not exist
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+# Function listing the statements adding the columns missing from existing tables
+# a NOT NULL column without a server default is added nullable, the existing rows have no value
+def missing_column_ddl(bind) -> list:
+    inspector = SQLAlchemy.inspect(bind)
+    statements = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                if not column.nullable and column.server_default is None:
+                    column = column._copy()
+                    column.nullable = True
+                ddl = CreateColumn(column).compile(dialect=bind.dialect)
+                statements.append(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+    return statements
+
+
+# Create the tables that do not exist yet, called at startup rather than on import so that
+# importing the app does not connect to the database
+def create_tables():
+    try:
+        metadata.create_all(engine)
+        statements = missing_column_ddl(engine)
+    finally:
+        # the connection is not kept, the app's statements go through database
+        engine.dispose()
+    if statements:
+        raise SchemaOutOfDate(
+            "The database lacks columns added since it was created, add them with:\n"
+            + ";\n".join(statements)
+            + ";"
+        )
+
+
+tables_created = False
+
+
+# Create the tables once per process, the serve.py master does it before forking its workers
+def ensure_tables():
+    global tables_created
+    if not tables_created:
+        create_tables()
+        tables_created = True
+
 
 # database variable is set to the Database object returned by using the databases module
-print(config.DATABASE_URL)
-print(config.DB_FORCE_ROLL_BACK)
-database = databases.Database(
+# every statement is timed per statement name, see db_instrumentation.py
+database = InstrumentedDatabase(
     url=config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK
 )
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import re
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Set
+
+import databases
+from asgi_correlation_id.context import correlation_id
+from sqlalchemy.sql import ClauseElement, Join, TableClause
+
+from storeapi.config import config
+from storeapi.metrics import DB_QUERY_DURATION, DB_QUERY_ERRORS
+from storeapi.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def statement_name(query) -> str:
+    """Name a statement by its verb and main table, e.g. "select campaigns" or "insert users"."""
+    if not isinstance(query, ClauseElement):
+        return "raw"
+
+    verb = getattr(query, "__visit_name__", "statement")
+    table = getattr(query, "table", None)
+    if table is None and hasattr(query, "get_final_froms"):
+        froms = query.get_final_froms()
+        table = froms[0] if froms else None
+    while isinstance(table, Join):
+        table = table.left
+    if isinstance(table, TableClause):
+        return f"{verb} {table.name}"
+    return verb
+
+
+def render_statement(query, values=None):
+    """The SQL text with named :placeholders and its parameters, as run by databases."""
+    if isinstance(query, ClauseElement):
+        compiled = query.compile()
+        return str(compiled), {**compiled.params, **(values or {})}
+    return str(query), dict(values or {})
+
+
+# parameters that must never end up in the logs
+SENSITIVE_PARAMETERS = ("password", "token", "secret")
+# donor email addresses are logged by their domain only, whatever the parameter is called
+EMAIL_ADDRESS = re.compile(r"[^\s@]+@([^\s@]+)")
+
+
+def loggable_value(key: str, value):
+    if any(word in key.lower() for word in SENSITIVE_PARAMETERS):
+        return "***"
+    if isinstance(value, str):
+        return EMAIL_ADDRESS.sub(r"***@\1", value)
+    return value
+
+
+def loggable_parameters(params: dict) -> dict:
+    return {key: loggable_value(key, value) for key, value in params.items()}
+
+
+def calling_function() -> str:
+    # the first frame outside of this module and the database libraries is the route or helper
+    # that ran the statement, the awaiting coroutines are chained through f_back
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("storeapi.") and module != __name__:
+            return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "unknown"
+
+
+# How the query plan of a statement is captured per dialect
+# ANALYZE executes the statement, which is why only SELECT statements are ever explained
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+class SlowQueryLog:
+    """Logs statements slower than a threshold and keeps the latest ones for GET /admin/debug."""
+
+    def __init__(
+        self,
+        threshold_ms: float,
+        explain: bool = False,
+        explain_after: int = 3,
+        max_entries: int = 50,
+    ) -> None:
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.explain_after = explain_after
+        self.recent: deque = deque(maxlen=max_entries)
+        self.explains: deque = deque(maxlen=max_entries)
+        # slow occurrences per SQL text, bounded by clearing it when it grows too large
+        self._counts: dict = {}
+        self._pending: Set[asyncio.Task] = set()
+
+    def record(self, database, query, values, name: str, elapsed: float) -> None:
+        try:
+            sql, params = render_statement(query, values)
+        except Exception:
+            sql, params = repr(query), dict(values or {})
+        entry = {
+            "statement": name,
+            "duration_ms": round(elapsed * 1000, 1),
+            "sql": sql,
+            "params": {
+                key: str(value) for key, value in loggable_parameters(params).items()
+            },
+            "caller": calling_function(),
+            "correlation_id": correlation_id.get(),
+            "at": time.time(),
+        }
+        self.recent.append(entry)
+        logger.warning(
+            f"Slow query {name} took {entry['duration_ms']} ms in {entry['caller']}: "
+            f"{sql} {entry['params']}"
+        )
+
+        if len(self._counts) >= 1000:
+            self._counts.clear()
+        count = self._counts[sql] = self._counts.get(sql, 0) + 1
+        if self.explain and count == self.explain_after and name.startswith("select"):
+            task = asyncio.get_running_loop().create_task(
+                self._capture_plan(database, sql, params, entry)
+            )
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _capture_plan(
+        self, database, sql: str, params: dict, entry: dict
+    ) -> None:
+        prefix = EXPLAIN_PREFIXES.get(database.url.dialect)
+        if prefix is None:
+            return
+        try:
+            # bypass the instrumentation, the plan of a slow query is itself slow
+            rows = await databases.Database.fetch_all(database, prefix + sql, params)
+        except Exception as ex:
+            logger.warning(f"Unable to explain slow query {entry['statement']}: {ex!r}")
+            return
+        # the plan text is the last column, "QUERY PLAN" on PostgreSQL and "detail" on SQLite
+        plan = "\n".join(str(list(row._mapping.values())[-1]) for row in rows)
+        self.explains.append({**entry, "plan": plan})
+        logger.warning(f"Plan of slow query {entry['statement']}:\n{plan}")
+
+    async def flush(self) -> None:
+        """Wait for the plans being captured, called before the database disconnects."""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=config.SLOW_QUERY_MS,
+    explain=config.SLOW_QUERY_EXPLAIN,
+    explain_after=config.SLOW_QUERY_EXPLAIN_AFTER,
+)
+
+
+class StatementTimer:
+    """Adds up the time spent running a statement and reports it once the statement is done."""
+
+    def __init__(
+        self, query, values=None, database: Optional[databases.Database] = None
+    ) -> None:
+        self.query = query
+        self.values = values
+        self.database = database
+        self.name = statement_name(query)
+        self.elapsed = 0.0
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            DB_QUERY_ERRORS.inc(self.name)
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def finish(self) -> None:
+        DB_QUERY_DURATION.observe(self.elapsed, self.name)
+        if self.elapsed >= slow_query_log.threshold:
+            slow_query_log.record(
+                self.database, self.query, self.values, self.name, self.elapsed
+            )
+
+
+@contextmanager
+def timed_statement(query, values=None, database: Optional[databases.Database] = None):
+    timer = StatementTimer(query, values, database)
+    # statements are leaves of the trace, and iterate() holds its span open across yields
+    with span(f"db {timer.name}", activate=False):
+        try:
+            with timer.measure():
+                yield
+        finally:
+            timer.finish()
+
+
+class InstrumentedDatabase(databases.Database):
+    """databases.Database that times every statement it runs and logs the slow ones."""
+
+    async def execute(self, query, values=None):
+        with timed_statement(query, values, self):
+            return await super().execute(query, values)
+
+    async def execute_many(self, query, values):
+        with timed_statement(query, None, self):
+            return await super().execute_many(query, values)
+
+    async def fetch_all(self, query, values=None):
+        with timed_statement(query, values, self):
+            return await super().fetch_all(query, values)
+
+    async def fetch_one(self, query, values=None):
+        with timed_statement(query, values, self):
+            return await super().fetch_one(query, values)
+
+    async def fetch_val(self, query, values=None, column=0):
+        with timed_statement(query, values, self):
+            return await super().fetch_val(query, values, column=column)
+
+    async def iterate(self, query, values=None):
+        # only the fetches are timed, the span covers the cursor from the first row requested
+        # until it is exhausted or closed
+        timer = StatementTimer(query, values, self)
+        cursor = super().iterate(query, values)
+        with span(f"db {timer.name}", activate=False):
+            try:
+                while True:
+                    with timer.measure():
+                        try:
+                            record = await cursor.__anext__()
+                        except StopAsyncIteration:
+                            break
+                    yield record
+            finally:
+                await cursor.aclose()
+                timer.finish()
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import csv
+import io
+import logging
+import zlib
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import AsyncIterator, Optional
+
+import sqlalchemy
+
+from storeapi.database import (
+    database,
+    export_watermarks,
+    payments,
+    refund_requests,
+    upsert,
+    utcnow,
+)
+from storeapi.pagination import encode_cursor, iterate_keyset
+
+logger = logging.getLogger(__name__)
+
+# Finance reconciliation exports of the payments and refund_requests tables, streamed in keyset
+# batches. Incremental exports follow updated_at, the watermark is the last (updated_at, id) sent
+
+
+class ExportTable(str, Enum):
+    payments = "payments"
+    refund_requests = "refund_requests"
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    parquet = "parquet"
+
+
+EXPORT_TABLES = {
+    ExportTable.payments: payments,
+    ExportTable.refund_requests: refund_requests,
+}
+
+# media type and file extension of each format, CSV is always gzipped on the fly
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.csv: ("application/gzip", "csv.gz"),
+    ExportFormat.parquet: ("application/vnd.apache.parquet", "parquet"),
+}
+
+# rows read per database batch and rows encoded per output chunk
+BATCH_SIZE = 1000
+CSV_CHUNK_ROWS = 1000
+PARQUET_ROW_GROUP_ROWS = 10000
+
+# incremental exports stop this far behind the current time, so that rows changed by transactions
+# still in flight when the export runs are not skipped over by the watermark
+WATERMARK_SAFETY_LAG = timedelta(minutes=5)
+
+
+class ExportUnavailable(RuntimeError):
+    """Raised when the requested export format needs an optional dependency that is missing."""
+
+
+def import_pyarrow():
+    # pyarrow is heavy and only needed for Parquet exports, so it is imported on first use
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as ex:
+        raise ExportUnavailable("Parquet export requires the pyarrow package") from ex
+    return pyarrow, pyarrow.parquet
+
+
+async def load_watermark(table_name: str) -> Optional[str]:
+    """Return a keyset cursor positioned after the last row of the previous incremental export."""
+    query = export_watermarks.select().where(export_watermarks.c.name == table_name)
+    watermark = await database.fetch_one(query)
+    if not watermark:
+        return None
+    return encode_cursor(watermark["last_updated_at"], watermark["last_id"])
+
+
+async def save_watermark(
+    table_name: str, last_updated_at: datetime, last_id: int
+) -> None:
+    values = {
+        "last_updated_at": last_updated_at,
+        "last_id": last_id,
+        "exported_at": datetime.utcnow(),
+    }
+    query = (
+        upsert(export_watermarks)
+        .values(name=table_name, **values)
+        .on_conflict_do_update(index_elements=["name"], set_=values)
+    )
+    await database.execute(query)
+
+
+class ExportRun:
+    """A single export of one table, remembering the last row emitted for the watermark."""
+
+    def __init__(
+        self,
+        table_name: ExportTable,
+        export_format: ExportFormat,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        since_last: bool = False,
+    ) -> None:
+        self.table_name = ExportTable(table_name)
+        self.export_format = ExportFormat(export_format)
+        self.table = EXPORT_TABLES[self.table_name]
+        self.columns = [column.name for column in self.table.columns]
+        self.start = start
+        self.end = end
+        self.since_last = since_last
+        self.row_count = 0
+        self.last_key = None
+
+        if self.export_format == ExportFormat.parquet:
+            # fail before any bytes are streamed if Parquet cannot be written
+            import_pyarrow()
+
+    @property
+    def media_type(self) -> str:
+        return EXPORT_MEDIA_TYPES[self.export_format][0]
+
+    @property
+    def filename(self) -> str:
+        extension = EXPORT_MEDIA_TYPES[self.export_format][1]
+        return f"{self.table_name.value}-{datetime.utcnow():%Y%m%dT%H%M%S}.{extension}"
+
+    async def rows(self) -> AsyncIterator:
+        table = self.table
+        query = table.select()
+        if self.start:
+            query = query.where(table.c.created_at >= self.start)
+        if self.end:
+            query = query.where(table.c.created_at < self.end)
+
+        key = table.c.created_at
+        cursor = None
+        if self.since_last:
+            key = table.c.updated_at
+            # on the clock the rows were stamped by
+            now = await database.fetch_val(sqlalchemy.select(utcnow()))
+            query = query.where(key < now - WATERMARK_SAFETY_LAG)
+            cursor = await load_watermark(self.table_name.value)
+
+        async for row in iterate_keyset(
+            query, key, table.c.id, cursor=cursor, batch_size=BATCH_SIZE
+        ):
+            self.row_count += 1
+            self.last_key = (row[key.name], row["id"])
+            yield row
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the encoded export, then advance the watermark if this run was incremental."""
+        if self.export_format == ExportFormat.parquet:
+            encoded = self.parquet_chunks()
+        else:
+            encoded = self.csv_gzip_chunks()
+        async for chunk in encoded:
+            yield chunk
+
+        # only reached once every row has been written out, an aborted export leaves the
+        # watermark where it was so the next run picks the rows up again
+        if self.since_last and self.last_key:
+            await save_watermark(self.table_name.value, *self.last_key)
+        logger.info(f"Exported {self.row_count} rows from {self.table_name.value}")
+
+    async def csv_gzip_chunks(self) -> AsyncIterator[bytes]:
+        # wbits 31 selects the gzip container so the output can be read with gunzip
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns)
+
+        pending = 0
+        async for row in self.rows():
+            writer.writerow([row[column] for column in self.columns])
+            pending += 1
+            if pending == CSV_CHUNK_ROWS:
+                compressed = compressor.compress(buffer.getvalue().encode())
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+                if compressed:
+                    yield compressed
+
+        yield compressor.compress(buffer.getvalue().encode()) + compressor.flush()
+
+    async def parquet_chunks(self) -> AsyncIterator[bytes]:
+        pyarrow, parquet = import_pyarrow()
+        schema = pyarrow.schema(
+            [
+                (column.name, arrow_type(pyarrow, column.type))
+                for column in self.table.columns
+            ]
+        )
+        sink = ChunkSink()
+        writer = parquet.ParquetWriter(pyarrow.PythonFile(sink, mode="w"), schema)
+
+        batch = {column: [] for column in self.columns}
+        pending = 0
+        try:
+            async for row in self.rows():
+                for column in self.columns:
+                    batch[column].append(row[column])
+                pending += 1
+                if pending == PARQUET_ROW_GROUP_ROWS:
+                    # each full batch becomes one row group, written out and released
+                    writer.write_table(pyarrow.Table.from_pydict(batch, schema=schema))
+                    batch = {column: [] for column in self.columns}
+                    pending = 0
+                    yield sink.drain()
+            if pending:
+                writer.write_table(pyarrow.Table.from_pydict(batch, schema=schema))
+        finally:
+            writer.close()
+        yield sink.drain()
+
+
+def arrow_type(pyarrow, column_type):
+    # map the SQLAlchemy column types used by the exported tables onto Arrow types
+    if isinstance(column_type, sqlalchemy.Boolean):
+        return pyarrow.bool_()
+    if isinstance(column_type, sqlalchemy.Integer):
+        return pyarrow.int64()
+    if isinstance(column_type, sqlalchemy.Float):
+        return pyarrow.float64()
+    if isinstance(column_type, sqlalchemy.DateTime):
+        return pyarrow.timestamp("us")
+    return pyarrow.string()
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last drain."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Command line entry point for scheduled dumps, e.g.
+#   python -m storeapi.export payments --format csv --since-last
+async def run_export(args) -> None:
+    export = ExportRun(
+        args.table,
+        args.format,
+        start=args.start,
+        end=args.end,
+        since_last=args.since_last,
+    )
+    output = args.output or export.filename
+    await database.connect()
+    try:
+        with open(output, "wb") as file:
+            async for chunk in export.chunks():
+                file.write(chunk)
+    finally:
+        await database.disconnect()
+    print(f"Wrote {export.row_count} rows to {output}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export payments or refunds for reconciliation"
+    )
+    parser.add_argument("table", choices=[table.value for table in ExportTable])
+    parser.add_argument(
+        "--format", choices=[fmt.value for fmt in ExportFormat], default="csv"
+    )
+    parser.add_argument(
+        "--start", type=datetime.fromisoformat, help="inclusive, ISO 8601"
+    )
+    parser.add_argument(
+        "--end", type=datetime.fromisoformat, help="exclusive, ISO 8601"
+    )
+    parser.add_argument(
+        "--since-last",
+        action="store_true",
+        help="export only rows after the previous --since-last export and advance the watermark",
+    )
+    parser.add_argument("--output", help="defaults to <table>-<timestamp>.<extension>")
+    asyncio.run(run_export(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+// Access and refresh tokens from /user/login, kept in localStorage
+// A request answered 401 exchanges the refresh token at /user/refresh once and is sent again
+
+function storeTokens(tokens) {
+    localStorage.setItem('access_token', tokens.access_token);
+    localStorage.setItem('refresh_token', tokens.refresh_token);
+}
+
+function clearTokens() {
+    localStorage.removeItem('access_token');
+    localStorage.removeItem('refresh_token');
+}
+
+let refreshing = null;
+
+function refreshTokens() {
+    if (!refreshing) {
+        refreshing = (async () => {
+            const refreshToken = localStorage.getItem('refresh_token');
+            if (!refreshToken) {
+                return false;
+            }
+            const response = await fetch('/user/refresh', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh_token: refreshToken })
+            });
+            if (!response.ok) {
+                clearTokens();
+                return false;
+            }
+            storeTokens(await response.json());
+            return true;
+        })().finally(() => { refreshing = null; });
+    }
+    return refreshing;
+}
+
+// fetch() with the access token, renewed once when it has expired
+async function authFetch(url, options = {}) {
+    const send = () => fetch(url, {
+        ...options,
+        headers: {
+            ...(options.headers || {}),
+            'Authorization': `Bearer ${localStorage.getItem('access_token')}`
+        }
+    });
+    const response = await send();
+    if (response.status !== 401 || !(await refreshTokens())) {
+        return response;
+    }
+    return send();
+}
+
+async function logout() {
+    const refreshToken = localStorage.getItem('refresh_token');
+    clearTokens();
+    if (refreshToken) {
+        await fetch('/user/logout', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: refreshToken })
+        });
+    }
+}
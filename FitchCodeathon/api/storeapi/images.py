@@ -0,0 +1,162 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Responsive images, the build writes AVIF and WebP variants at WIDTHS for the pages' srcsets
+# and GET /images/... resizes on demand what it did not cover, cached on disk
+
+WIDTHS = (320, 640, 960, 1280, 1920)
+RASTER_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+# Pillow format name, media type and encoder options of each variant format, best first
+VARIANT_FORMATS = {
+    "avif": ("AVIF", "image/avif", {"quality": 50}),
+    "webp": ("WEBP", "image/webp", {"quality": 75, "method": 6}),
+}
+ORIGINAL_MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+
+class ImagesUnavailable(RuntimeError):
+    """Raised when image variants are needed but Pillow is not installed."""
+
+
+def import_pillow():
+    # Pillow is only needed to build variants and resize, so it is imported on first use
+    try:
+        from PIL import Image, features
+    except ImportError as ex:
+        raise ImagesUnavailable("Image resizing requires the Pillow package") from ex
+    return Image, features
+
+
+def supported_formats() -> List[str]:
+    """The variant formats the installed Pillow can encode, best first."""
+    _, features = import_pillow()
+    return [name for name in VARIANT_FORMATS if features.check(name)]
+
+
+def variant_widths(original_width: int) -> List[int]:
+    # never upscale, the original width itself is kept when it is not one of WIDTHS
+    widths = [width for width in WIDTHS if width < original_width]
+    if original_width <= WIDTHS[-1]:
+        widths.append(original_width)
+    return widths
+
+
+def image_width(content: bytes) -> int:
+    Image, _ = import_pillow()
+    with Image.open(io.BytesIO(content)) as image:
+        return image.width
+
+
+def resize(content: bytes, width: int, image_format: Optional[str]) -> bytes:
+    """Downscale an image to the given width, keeping its aspect ratio, and encode it."""
+    Image, _ = import_pillow()
+    with Image.open(io.BytesIO(content)) as image:
+        original_format = image.format
+        if width < image.width:
+            height = max(round(image.height * width / image.width), 1)
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        if image_format is None:
+            pillow_format, options = original_format, {"optimize": True}
+        else:
+            pillow_format, _, options = VARIANT_FORMATS[image_format]
+        if pillow_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=pillow_format, **options)
+    return output.getvalue()
+
+
+def build_variants(content: bytes) -> Dict[str, List[Tuple[int, bytes]]]:
+    """Every (width, bytes) variant of an image per format, for the asset build."""
+    widths = variant_widths(image_width(content))
+    return {
+        image_format: [
+            (width, resize(content, width, image_format)) for width in widths
+        ]
+        for image_format in supported_formats()
+    }
+
+
+def snap_width(width: int) -> int:
+    # requested widths are rounded up to one of WIDTHS, which bounds the number of cached variants
+    for candidate in WIDTHS:
+        if width <= candidate:
+            return candidate
+    return WIDTHS[-1]
+
+
+def negotiate_format(accept: str, available: List[str]) -> Optional[str]:
+    for image_format in available:
+        if VARIANT_FORMATS[image_format][1] in accept:
+            return image_format
+    return None
+
+
+class DiskLRUCache:
+    """A directory of files bounded in total size, evicting the least recently used first."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: Optional[OrderedDict] = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(
+            "|".join(str(part) for part in parts).encode()
+        ).hexdigest()
+
+    def _load(self) -> OrderedDict:
+        if self._entries is None:
+            os.makedirs(self.directory, exist_ok=True)
+            found = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat_result = entry.stat()
+                    found.append(
+                        (stat_result.st_atime, entry.name, stat_result.st_size)
+                    )
+            self._entries = OrderedDict((name, size) for _, name, size in sorted(found))
+            self._size = sum(self._entries.values())
+        return self._entries
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entries = self._load()
+            if key not in entries:
+                return None
+            entries.move_to_end(key)
+        return os.path.join(self.directory, key)
+
+    def put(self, key: str, content: bytes) -> str:
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            entries = self._load()
+            # written aside and renamed so a reader never sees a partial file
+            with open(path + ".tmp", "wb") as file:
+                file.write(content)
+            os.replace(path + ".tmp", path)
+            self._size += len(content) - entries.pop(key, 0)
+            entries[key] = len(content)
+            while self._size > self.max_bytes and len(entries) > 1:
+                evicted, size = entries.popitem(last=False)
+                self._size -= size
+                try:
+                    os.remove(os.path.join(self.directory, evicted))
+                except FileNotFoundError:
+                    pass
+        return path
@@ -1,5 +1,8 @@
+import itertools
 import logging
+import queue
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 
 from storeapi.config import DevConfig, config
 
@@ -33,10 +36,116 @@ class EmailObfuscationFilter(logging.Filter):
         return True
 
 
+# Handler that hands records to a background thread instead of formatting and writing them on
+# the calling thread (for the route handlers that is the event loop)
+# it never blocks: when the queue is full the record is dropped and counted, and with the
+# "sample" policy only 1 in sample_rate records below WARNING is kept once the queue is half full
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue, policy: str = "drop", sample_rate: int = 10) -> None:
+        super().__init__(log_queue)
+        self.policy = policy
+        self.sample_rate = max(sample_rate, 1)
+        self.high_water_mark = max(log_queue.maxsize // 2, 1)
+        self.dropped = 0
+        self._sampled = itertools.count()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the listener runs in this process, so unlike the base class there is no need to render
+        # the message or strip the traceback to make the record picklable
+        # only the message arguments are merged, in case they are mutated after the call returns
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if (
+            self.policy == "sample"
+            and record.levelno < logging.WARNING
+            and self.queue.qsize() >= self.high_water_mark
+            and next(self._sampled) % self.sample_rate
+        ):
+            self.dropped += 1
+            return
+
+        # once there is room again, report how many records were lost
+        if self.dropped and self.queue.qsize() < self.high_water_mark:
+            dropped, self.dropped = self.dropped, 0
+            report = logging.makeLogRecord(record.__dict__)
+            report.levelno, report.levelname = logging.WARNING, "WARNING"
+            report.msg = f"Logging queue overflowed, dropped {dropped} log records"
+            try:
+                self.queue.put_nowait(report)
+            except queue.Full:
+                self.dropped += dropped
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# the listeners currently running, stopped (and flushed) by stop_queue_logging
+_queue_listeners: list = []
+
+
+def start_queue_logging(
+    logger_names=("uvicorn", "storeapi", "databases", "aiosqlite"),
+) -> None:
+    """Move the handlers of the given loggers onto background listener threads.
+
+    Loggers that share the same set of handlers share one queue and one listener thread.
+    The filters that read request state (the correlation id is held in a context variable)
+    must run on the calling thread, so they move from the handlers to the queue handler.
+    """
+    stop_queue_logging()
+    queue_handlers = {}
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        handlers = tuple(logger.handlers)
+        if not handlers:
+            continue
+
+        if handlers not in queue_handlers:
+            queue_handler = BoundedQueueHandler(
+                queue.Queue(maxsize=config.LOG_QUEUE_SIZE),
+                policy=config.LOG_QUEUE_POLICY,
+                sample_rate=config.LOG_QUEUE_SAMPLE_RATE,
+            )
+            for handler in handlers:
+                for log_filter in handler.filters:
+                    if log_filter not in queue_handler.filters:
+                        queue_handler.addFilter(log_filter)
+            listener = QueueListener(
+                queue_handler.queue, *handlers, respect_handler_level=True
+            )
+            listener.start()
+            _queue_listeners.append(listener)
+            queue_handlers[handlers] = queue_handler
+
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handlers[handlers])
+
+    # the filters have already run on the calling thread, running them again on the listener
+    # thread would overwrite the correlation id
+    for handlers in queue_handlers:
+        for handler in handlers:
+            handler.filters = []
+
+
+def stop_queue_logging() -> None:
+    """Stop the listener threads, writing out any records still queued."""
+    while _queue_listeners:
+        _queue_listeners.pop().stop()
+
+
 def configure_logging() -> None:
     """
     Logging configuration for application
     """
+    # flush the queues of any previous configuration before its handlers are replaced
+    stop_queue_logging()
     dictConfig(
         {
             "version": 1,
@@ -114,3 +223,5 @@ def configure_logging() -> None:
             },
         }
     )
+    if config.LOG_QUEUE_ENABLED:
+        start_queue_logging()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from storeapi.config import config
+from storeapi.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Event loop lag monitor, and in debug mode a watchdog capturing the stack of a call blocking
+# the loop while it still blocks
+
+EVENT_LOOP_LAG = Histogram(
+    "storeapi_event_loop_lag_seconds",
+    "Delay between when the loop monitor asked to wake up and when it did",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+EVENT_LOOP_BLOCKED = Counter(
+    "storeapi_event_loop_blocked_total",
+    "Times the event loop was blocked for longer than the configured threshold",
+)
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.05,
+        block_threshold: float = 0.1,
+        capture_stacks: bool = False,
+    ) -> None:
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.capture_stacks = capture_stacks
+        # the most recent blocking events with the stack that caused them, newest last
+        self.blocked_calls: deque = deque(maxlen=20)
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+
+    def start(self) -> None:
+        """Start monitoring the running event loop."""
+        self._stopped.clear()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        if self.capture_stacks:
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self._heartbeat = time.monotonic()
+            EVENT_LOOP_LAG.observe(lag)
+            if lag >= self.block_threshold and not self.capture_stacks:
+                # without the watchdog only the duration is known
+                EVENT_LOOP_BLOCKED.inc()
+                logger.warning(f"Event loop was blocked for {lag * 1000:.0f} ms")
+
+    def _watch(self) -> None:
+        reported = False
+        check_every = min(self.interval, self.block_threshold) / 2
+        while not self._stopped.wait(check_every):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.block_threshold:
+                reported = False
+                continue
+            if reported:
+                # one report per stall
+                continue
+            reported = True
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+            EVENT_LOOP_BLOCKED.inc()
+            self.blocked_calls.append(
+                {"blocked_ms": round(stalled * 1000), "at": time.time(), "stack": stack}
+            )
+            logger.warning(
+                f"Event loop blocked for more than {stalled * 1000:.0f} ms, "
+                f"stack of the blocking call:\n{stack}"
+            )
+
+
+loop_monitor = LoopMonitor(
+    interval=config.LOOP_MONITOR_INTERVAL,
+    block_threshold=config.LOOP_BLOCK_THRESHOLD_MS / 1000,
+    capture_stacks=config.LOOP_BLOCK_DEBUG,
+)
@@ -1,20 +1,33 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.exception_handlers import http_exception_handler
 from storeapi.routers.user_routes import router as user_router
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 # from typing import List
 from storeapi.routers.campaign import router as campaign_router
-from storeapi.database import database
+from storeapi.routers.analytics import router as analytics_router
+from storeapi.routers.export import router as export_router
+from storeapi.routers.debug import router as debug_router
+from storeapi.routers.images import router as images_router
+from storeapi.routers.pages import router as pages_router
+from storeapi.admission import AdmissionMiddleware
+from storeapi.compression import CompressionMiddleware
+from storeapi.config import config
+from storeapi.database import database, ensure_tables
+from storeapi.db_instrumentation import slow_query_log
 from asgi_correlation_id import CorrelationIdMiddleware
 
-from storeapi.logging_conf import configure_logging
+from storeapi.logging_conf import configure_logging, stop_queue_logging
+from storeapi.loop_monitor import loop_monitor
+from storeapi.metrics import MetricsMiddleware, render_latest
+from storeapi.static_cache import frontend_static_files
+from storeapi import templating
+from storeapi.tracing import TracingMiddleware, exporter as trace_exporter
+from storeapi.warmup import readiness
 
 import logging
-import os
 
 logger = logging.getLogger(__name__)
 
@@ -28,28 +41,44 @@ async def lifespan(app: FastAPI):
     # configure logging before any other activity
     configure_logging()
     logger.info("Logging setup completed")
-    # db startup goes here
+    # db startup goes here, unless the serve.py master already did it
+    ensure_tables()
     await database.connect()
     # print("Starting up database connection...")
+    # measure event loop lag, and in debug mode report calls that block it
+    if config.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    # serve the stylesheets, scripts and fonts from memory from the first request
+    await static_files.preload()
+    if config.STATIC_WATCH:
+        static_files.start_watching(config.STATIC_WATCH_INTERVAL)
+    # compile the page templates before the first render
+    templating.precompile()
+    # open connections, fetch the JWKS and fill the caches before accepting any request
+    await readiness.warm_up(app)
     yield
+    readiness.ready = False
+    await static_files.stop_watching()
+    await loop_monitor.stop()
+    await slow_query_log.flush()
     await database.disconnect()
+    # write out any traces and log records still queued
+    trace_exporter.stop()
+    stop_queue_logging()
 
 
 # call the startup (setup) function before serving any requests, i.e. lifespan
 app = FastAPI(lifespan=lifespan)
-# add the correlation id middleware to the app
-# this middleware helps to group logs by request and is useful to track parallel requests
 
-# Define the base directory where the frontend files are located
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-
-# Mount the 'frontend' directory to serve static files (CSS, JS, etc.)
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "frontend")), name="static")
+# Mount the frontend to serve static files (CSS, JS, etc.) from memory, precompressed and
+# fingerprinted when it was built with `python -m storeapi.assets build`
+static_files = frontend_static_files()
+app.mount("/static", static_files, name="static")
 
 # Serve the main index.html when visiting the root URL
 @app.get("/")
-async def serve_frontend():
-    return FileResponse(os.path.join(BASE_DIR, "frontend", "starter.html"))
+async def serve_frontend(request: Request):
+    return await static_files.get_response("starter.html", request.scope)
 
 origins = [
     "http://127.0.0.1:3000", 
@@ -63,9 +92,63 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers (Content-Type, Authorization, etc.)
 )
 
+# compress the JSON, HTML and export responses, the static files are precompressed
+if config.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.COMPRESSION_MIN_BYTES,
+        gzip_level=config.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=config.COMPRESSION_BROTLI_QUALITY,
+    )
+
+# open a trace per request, inside the correlation id middleware so the trace takes its id
+app.add_middleware(TracingMiddleware)
+
+# add the correlation id middleware to the app
+# this middleware helps to group logs by request and is useful to track parallel requests
+app.add_middleware(CorrelationIdMiddleware)
+
+# queue and shed requests by route class under overload, before any other work is done for them
+if config.ADMISSION_ENABLED:
+    app.add_middleware(
+        AdmissionMiddleware,
+        max_in_flight=config.ADMISSION_MAX_IN_FLIGHT,
+        retry_after=config.ADMISSION_RETRY_AFTER,
+    )
+
+# record per-route latency and in-flight requests, added last so that it wraps every other
+# middleware and times the whole request
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(campaign_router)
 app.include_router(user_router)
+app.include_router(analytics_router)
+app.include_router(export_router)
+app.include_router(debug_router)
+app.include_router(images_router)
+app.include_router(pages_router)
+
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
+
+
+# Liveness and readiness probes, see warmup.py
+@app.get("/health", include_in_schema=False)
+async def health():
+    return {"status": "ok"}
+
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    steps = {name: round(seconds, 3) for name, seconds in readiness.steps.items()}
+    return JSONResponse(
+        {"ready": readiness.ready, "warmup": steps},
+        status_code=200 if readiness.ready else 503,
+    )
 
 
 # add a global HTTPException handler for the API
@@ -0,0 +1,330 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from starlette.routing import Match
+
+# Minimal Prometheus-style metrics, rendered in the text exposition format by GET /metrics
+
+# latency buckets in seconds, from 1 ms to 10 s
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _labels(self, labelvalues: Tuple[str, ...]) -> str:
+        if not self.labelnames:
+            return ""
+        pairs = ",".join(
+            f'{name}="{escape(str(value))}"'
+            for name, value in zip(self.labelnames, labelvalues)
+        )
+        return "{" + pairs + "}"
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{self._labels(labelvalues)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues: str, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (+Inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                    0,
+                ]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labelvalues: str) -> int:
+        state = self._values.get(labelvalues)
+        return state[2] if state else 0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = [
+                (labelvalues, list(state[0]), state[1], state[2])
+                for labelvalues, state in self._values.items()
+            ]
+        for labelvalues, bucket_counts, total, count in values:
+            labels = self._labels(labelvalues)
+            # buckets are stored individually and made cumulative here, off the hot path
+            cumulative = 0
+            for bound, bucket_count in zip(
+                self.buckets + (float("inf"),), bucket_counts
+            ):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = (
+                    labels[:-1] + f',le="{le}"}}' if labels else f'{{le="{le}"}}'
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_latest() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP
+HTTP_REQUEST_DURATION = Histogram(
+    "storeapi_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "storeapi_http_requests_in_flight",
+    "HTTP requests currently being served",
+    ("method",),
+)
+
+# Database
+DB_QUERY_DURATION = Histogram(
+    "storeapi_db_query_duration_seconds",
+    "Database statement latency by statement name",
+    ("statement",),
+)
+DB_QUERY_ERRORS = Counter(
+    "storeapi_db_query_errors_total", "Database statements that raised", ("statement",)
+)
+
+# Keycloak JWKS used to validate access tokens
+JWKS_FETCHES = Counter(
+    "storeapi_jwks_fetch_total", "JWKS fetches from Keycloak by outcome", ("outcome",)
+)
+JWKS_FETCH_DURATION = Histogram(
+    "storeapi_jwks_fetch_duration_seconds", "JWKS fetch latency from Keycloak"
+)
+JWKS_CACHE = Counter(
+    "storeapi_jwks_cache_total", "JWKS cache lookups by result", ("result",)
+)
+
+# Static files served from memory, see static_cache.py
+STATIC_CACHE = Counter(
+    "storeapi_static_cache_total", "Static file cache lookups by result", ("result",)
+)
+
+# Compression of dynamic responses, see compression.py
+# the compression ratio is bytes out / bytes in, tune the levels against the CPU seconds
+COMPRESSION_RESPONSES = Counter(
+    "storeapi_compression_responses_total",
+    "Responses seen by the compression middleware, compressed or the reason they were not",
+    ("encoding", "result"),
+)
+COMPRESSION_BYTES = Counter(
+    "storeapi_compression_bytes_total",
+    "Bytes into and out of the compressors",
+    ("encoding", "direction"),
+)
+COMPRESSION_SECONDS = Counter(
+    "storeapi_compression_cpu_seconds_total",
+    "CPU time spent compressing",
+    ("encoding",),
+)
+COMPRESSION_RATIO = Histogram(
+    "storeapi_compression_ratio",
+    "Compressed size over original size per response",
+    ("encoding",),
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.7, 0.9, 1.0),
+)
+
+# Rendered campaign page fragments, see campaign_cache.py
+FRAGMENT_CACHE = Counter(
+    "storeapi_fragment_cache_total",
+    "Campaign fragment cache lookups by result",
+    ("result",),
+)
+
+# Responses of the @cached routes, see response_cache.py
+# coalesced requests waited for a render started by another request with the same key
+RESPONSE_CACHE = Counter(
+    "storeapi_response_cache_total", "Response cache lookups by result", ("result",)
+)
+
+# Admission control by route class, see admission.py
+ADMISSION_IN_FLIGHT = Gauge(
+    "storeapi_admission_in_flight",
+    "Requests admitted and running by route class",
+    ("class",),
+)
+ADMISSION_WAIT = Histogram(
+    "storeapi_admission_wait_seconds",
+    "Time requests waited for a slot by route class, shed ones included",
+    ("class",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+ADMISSION_SHED = Counter(
+    "storeapi_admission_shed_total",
+    "Requests answered 503 under overload by route class",
+    ("class",),
+)
+
+# Login and registration attempts over the limits, see rate_limit.py
+RATE_LIMITED = Counter(
+    "storeapi_rate_limited_total",
+    "Attempts answered 429 by action and the key that was over its limit",
+    ("action", "key"),
+)
+
+# Refresh token exchanges and revocations, see refresh_tokens.py
+# reused tokens had already been rotated, their whole family is revoked
+REFRESH_TOKENS = Counter(
+    "storeapi_refresh_tokens_total",
+    "Refresh token exchanges and revocations by outcome",
+    ("outcome",),
+)
+
+# PayPal
+PAYPAL_REQUEST_DURATION = Histogram(
+    "storeapi_paypal_request_duration_seconds",
+    "PayPal API call latency",
+    ("operation",),
+)
+PAYPAL_ERRORS = Counter(
+    "storeapi_paypal_errors_total", "PayPal API calls that failed", ("operation",)
+)
+
+
+def status_class(status_code: int) -> str:
+    # status codes are grouped to keep the number of label combinations small
+    return f"{status_code // 100}xx"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency and in-flight requests."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_REQUESTS_IN_FLIGHT.dec(method)
+            template = route_template(scope)
+            HTTP_REQUEST_DURATION.observe(
+                elapsed, method, template, status_class(status_code)
+            )
+
+
+def route_template(scope) -> str:
+    # Starlette records the matched route in the scope, older releases that do not are
+    # matched against the app's routes instead
+    route = scope.get("route")
+    if route is None and "app" in scope:
+        for candidate in scope["app"].router.routes:
+            if candidate.matches(scope)[0] == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", None) or "unmatched"
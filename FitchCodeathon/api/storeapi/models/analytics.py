@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+# Donation totals for one campaign in one hour or day bucket
+class DonationBucket(BaseModel):
+    campaign_id: int
+    bucket_start: datetime
+    total_amount: float
+    payment_count: int
+    average_amount: float
+
+
+# Donation totals for one campaign over the whole requested range
+class DonationTotal(BaseModel):
+    campaign_id: int
+    total_amount: float
+    payment_count: int
+    average_amount: float
+
+
+class DonationAnalytics(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    buckets: List[DonationBucket]
+    totals: List[DonationTotal]
+    campaign_id: Optional[int] = None
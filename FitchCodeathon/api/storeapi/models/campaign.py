@@ -14,3 +14,4 @@ class Campaign(CampaignIn):
     # model_config instructs pydantic how to deal with SQLAlchemy objects returned from DB queries
     model_config = ConfigDict(from_attributes=True)
     id: int
+    version: int = 1
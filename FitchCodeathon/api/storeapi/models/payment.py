@@ -1,11 +1,62 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict
 
 class Payment(BaseModel):
     payment_method: str
     amount: float
     status: str
     transaction_id: str 
+    campaign_id: Optional[int] = None
+
+# Sent back by the donor once PayPal has redirected them with paymentId and PayerID
+class PaymentExecution(BaseModel):
+    paypal_payment_id: str
+    payer_id: str
 
 class RefundRequest(BaseModel):
     payment_id: int
-    amount: float
\ No newline at end of file
+    amount: float
+
+# A row of the payments table as returned by the donor payment history
+class PaymentRecord(BaseModel):
+    # model_config instructs pydantic how to deal with records returned from DB queries
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    amount: float
+    status: Optional[str] = None
+    payment_method: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+# Summary of the payment a refund was raised against, joined into the admin refund queue
+class RefundPaymentSummary(BaseModel):
+    id: int
+    amount: float
+    status: Optional[str] = None
+    payment_method: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+# Summary of the donor who raised the refund
+class RefundUserSummary(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: str
+
+
+# A single row of the admin refund queue
+class RefundSummary(BaseModel):
+    id: int
+    amount: float
+    status: str
+    admin_approved: bool = False
+    created_at: Optional[datetime] = None
+    payment: RefundPaymentSummary
+    user: RefundUserSummary
+
+
+# A page of the admin refund queue, next_cursor is None on the last page
+class RefundPage(BaseModel):
+    items: List[RefundSummary]
+    next_cursor: Optional[str] = None
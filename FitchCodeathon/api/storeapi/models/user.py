@@ -16,3 +16,7 @@ class User(BaseModel):  # This is the same as UserOut, but using the existing 'U
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
+
+# Input model for exchanging or revoking a refresh token
+class RefreshTokenIn(BaseModel):
+    refresh_token: str
@@ -0,0 +1,92 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+
+import sqlalchemy
+from fastapi import HTTPException
+
+from storeapi.database import database
+
+# Keyset pagination helpers shared by the list endpoints, the client hands back an opaque cursor
+# of the (created_at, id) of the last row it saw and the next page seeks straight after it
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode the sort key of the last row on a page into an opaque cursor."""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor, raising a 400 if it has been tampered with."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, binascii.Error) as ex:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from ex
+
+
+def keyset_condition(
+    created_at_column, id_column, cursor: str, descending: bool = False
+):
+    """Build the WHERE clause selecting rows that sort after the cursor."""
+    created_at, row_id = decode_cursor(cursor)
+    return _after_key(created_at_column, id_column, created_at, row_id, descending)
+
+
+def _after_key(created_at_column, id_column, created_at, row_id, descending):
+    # spelled out as (a > x) OR (a = x AND b > y) rather than a row value comparison
+    # so that it compiles on both SQLite and Postgres
+    if descending:
+        return sqlalchemy.or_(
+            created_at_column < created_at,
+            sqlalchemy.and_(created_at_column == created_at, id_column < row_id),
+        )
+    return sqlalchemy.or_(
+        created_at_column > created_at,
+        sqlalchemy.and_(created_at_column == created_at, id_column > row_id),
+    )
+
+
+def keyset_order(created_at_column, id_column, descending: bool = False):
+    """Return the ORDER BY clauses matching keyset_condition."""
+    if descending:
+        return [created_at_column.desc(), id_column.desc()]
+    return [created_at_column.asc(), id_column.asc()]
+
+
+async def iterate_keyset(
+    query,
+    created_at_column,
+    id_column,
+    cursor: Optional[str] = None,
+    max_rows: Optional[int] = None,
+    batch_size: int = 500,
+    descending: bool = False,
+) -> AsyncIterator:
+    """Stream the rows of a query in keyset order, batch by batch."""
+    last_key = decode_cursor(cursor) if cursor else None
+    remaining = max_rows
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        batch_query = query
+        if last_key:
+            batch_query = batch_query.where(
+                _after_key(created_at_column, id_column, *last_key, descending)
+            )
+        batch_query = batch_query.order_by(
+            *keyset_order(created_at_column, id_column, descending)
+        ).limit(size)
+
+        fetched = 0
+        async for row in database.iterate(batch_query):
+            fetched += 1
+            last_key = (row[created_at_column.name], row[id_column.name])
+            yield row
+
+        if remaining is not None:
+            remaining -= fetched
+        if fetched < size:
+            break
@@ -1,6 +1,25 @@
+import time
 import requests
 from fastapi import HTTPException
 from storeapi.config import config
+from storeapi.metrics import PAYPAL_ERRORS, PAYPAL_REQUEST_DURATION
+from storeapi.tracing import span
+
+
+# POST to the PayPal API, recording latency and failures per operation
+def paypal_post(operation, url, expected_status, **kwargs):
+    start = time.perf_counter()
+    try:
+        with span(f"paypal.{operation}", url=url):
+            response = requests.post(url, **kwargs)
+    except requests.RequestException:
+        PAYPAL_ERRORS.inc(operation)
+        raise
+    finally:
+        PAYPAL_REQUEST_DURATION.observe(time.perf_counter() - start, operation)
+    if response.status_code != expected_status:
+        PAYPAL_ERRORS.inc(operation)
+    return response
 
 # Fetch PayPal token
 def fetch_paypal_token():
@@ -15,7 +34,7 @@ def fetch_paypal_token():
         "grant_type": "client_credentials"
     }
 
-    response = requests.post(url, headers=headers, data=data, auth=auth)
+    response = paypal_post("fetch_token", url, 200, headers=headers, data=data, auth=auth)
     if response.status_code != 200:
         raise HTTPException(status_code=500, detail="Unable to fetch PayPal token")
 
@@ -47,13 +66,31 @@ def create_paypal_payment(token, payment):
         }
     }
 
-    response = requests.post(url, json=data, headers=headers)
+    response = paypal_post("create_payment", url, 201, json=data, headers=headers)
 
     if response.status_code != 201:
         raise HTTPException(status_code=500, detail="Unable to create PayPal payment")
 
     return response.json()
 
+# Execute a PayPal payment the payer has approved, this is where the money actually moves
+def execute_paypal_payment(token, paypal_payment_id, payer_id):
+    url = f"https://api-m.sandbox.paypal.com/v1/payments/payment/{paypal_payment_id}/execute"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {token}",
+    }
+    data = {
+        "payer_id": payer_id
+    }
+
+    response = paypal_post("execute_payment", url, 200, json=data, headers=headers)
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Unable to execute PayPal payment")
+
+    return response.json()
+
 def process_paypal_refund(payment_id, amount):
     # Get PayPal access token
     token = fetch_paypal_token()
@@ -70,7 +107,7 @@ def process_paypal_refund(payment_id, amount):
         }
     }
 
-    response = requests.post(url, json=data, headers=headers)
+    response = paypal_post("refund", url, 201, json=data, headers=headers)
 
     if response.status_code != 201:
         raise HTTPException(status_code=500, detail=f"PayPal refund failed: {response.text}")
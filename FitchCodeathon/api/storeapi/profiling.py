@@ -0,0 +1,166 @@
+import asyncio
+import linecache
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+# On-demand profiling of a live worker, StackSampler samples the other threads' stacks from a
+# background thread and reports them in the collapsed-stack format of flamegraph.pl
+
+MAX_PROFILE_SECONDS = 60
+MIN_INTERVAL_SECONDS = 0.001
+MAX_STACK_DEPTH = 128
+
+# only one stack profile may run at a time per worker, MemoryTracer has its own lock
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is requested while another one is running."""
+
+
+class TracerNotRunning(RuntimeError):
+    """Raised when a tracemalloc snapshot is requested while tracemalloc is not running."""
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+
+
+class StackSampler:
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = max(interval, MIN_INTERVAL_SECONDS)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def sample(self) -> None:
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def run(self, seconds: float) -> None:
+        """Sample every thread for the given number of seconds, blocking the calling thread."""
+        deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+        next_sample = time.monotonic()
+        while next_sample < deadline:
+            self.sample()
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+async def sample_stacks(seconds: float, interval: float) -> StackSampler:
+    """Run a sampler on its own thread so the event loop keeps serving while it is profiled."""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        sampler = StackSampler(interval)
+        await asyncio.to_thread(sampler.run, seconds)
+        return sampler
+    finally:
+        _profile_lock.release()
+
+
+# tracemalloc records a traceback for every allocation, which roughly doubles the cost of
+# allocating, so a session is always stopped automatically after MAX_TRACEMALLOC_SECONDS
+MAX_TRACEMALLOC_SECONDS = 600
+MAX_TRACEMALLOC_FRAMES = 25
+
+
+# start, stop and snapshot_diff hold the tracer's lock, a stop waits for a snapshot in progress
+class MemoryTracer:
+    def __init__(self) -> None:
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int, max_seconds: float) -> None:
+        # called on the event loop, a snapshot or stop in progress makes the tracer busy
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("tracemalloc is busy")
+        try:
+            if self.running:
+                raise ProfilerBusy("tracemalloc is already running")
+            tracemalloc.start(min(max(frames, 1), MAX_TRACEMALLOC_FRAMES))
+            self.started_at = time.time()
+            self._baseline = self._take_snapshot()
+            loop = asyncio.get_running_loop()
+            self._stop_handle = loop.call_later(
+                min(max_seconds, MAX_TRACEMALLOC_SECONDS),
+                lambda: loop.run_in_executor(None, self.stop),
+            )
+        finally:
+            self._lock.release()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._stop_handle is not None:
+                self._stop_handle.cancel()
+                self._stop_handle = None
+            self._baseline = None
+            self.started_at = None
+            tracemalloc.stop()
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        # leave out the allocations made by tracemalloc itself
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    def snapshot_diff(self, limit: int) -> dict:
+        """Compare the current allocations with the previous snapshot, which this one replaces."""
+        with self._lock:
+            if not self.running:
+                raise TracerNotRunning("tracemalloc is not running")
+            snapshot = self._take_snapshot()
+            baseline, self._baseline = self._baseline, snapshot
+            current, peak = tracemalloc.get_traced_memory()
+        differences = snapshot.compare_to(baseline, "traceback") if baseline else []
+
+        top = []
+        for stat in differences[:limit]:
+            frame = stat.traceback[0]
+            top.append(
+                {
+                    "size_diff": stat.size_diff,
+                    "size": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                    "location": f"{frame.filename}:{frame.lineno}",
+                    "line": linecache.getline(frame.filename, frame.lineno).strip(),
+                    "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback],
+                }
+            )
+        return {
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "started_at": self.started_at,
+            "top": top,
+        }
+
+
+memory_tracer = MemoryTracer()
@@ -0,0 +1,152 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from storeapi.config import config
+from storeapi.metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# Login and registration rate limits, sliding window counters per client address and email
+# address, shared between workers with RATE_LIMIT_REDIS_URL
+
+
+class RateLimitUnavailable(RuntimeError):
+    """Raised when shared counters are configured but their client library is missing."""
+
+
+def import_redis():
+    # redis is only needed for counters shared between workers
+    try:
+        import redis.asyncio as redis
+    except ImportError as ex:
+        raise RateLimitUnavailable(
+            "Shared rate limit counters require the redis package"
+        ) from ex
+    return redis
+
+
+def window_estimate(
+    current: int, previous: int, elapsed: float, window: float
+) -> float:
+    """The attempts in the window ending now, elapsed seconds into the current fixed window."""
+    return previous * (1 - elapsed / window) + current
+
+
+class LocalCounters:
+    """Sliding window counters for one worker, in an LRU of at most max_keys."""
+
+    def __init__(self, max_keys: int = 100000) -> None:
+        self.max_keys = max_keys
+        # key -> [fixed window index, attempts in it, attempts in the window before]
+        self._counters: "OrderedDict[str, List[int]]" = OrderedDict()
+
+    def hit(self, key: str, window: float, now: float) -> Tuple[int, int]:
+        """Count an attempt, returns the attempts in the current and the previous window."""
+        index = int(now // window)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = [index, 0, 0]
+        elif counter[0] != index:
+            previous = counter[1] if counter[0] == index - 1 else 0
+            counter[:] = [index, 0, previous]
+        counter[1] += 1
+        self._counters.move_to_end(key)
+        while len(self._counters) > self.max_keys:
+            self._counters.popitem(last=False)
+        return counter[1], counter[2]
+
+    def clear(self) -> None:
+        self._counters.clear()
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+
+class RedisCounters:
+    """Sliding window counters shared between workers, one Redis key per fixed window."""
+
+    def __init__(self, url: str, prefix: str = "storeapi:ratelimit:") -> None:
+        self._redis = import_redis().from_url(url)
+        self.prefix = prefix
+
+    async def hit(self, key: str, window: float, now: float) -> Tuple[int, int]:
+        index = int(now // window)
+        current_key = f"{self.prefix}{key}:{index}"
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.incr(current_key)
+        pipeline.expire(current_key, math.ceil(window * 2))
+        pipeline.get(f"{self.prefix}{key}:{index - 1}")
+        current, _, previous = await pipeline.execute()
+        return int(current), int(previous or 0)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        window: float = 60,
+        max_keys: int = 100000,
+        backend: Optional[RedisCounters] = None,
+    ) -> None:
+        self.window = window
+        self.local = LocalCounters(max_keys)
+        self.backend = backend
+
+    async def hit(self, key: str, limit: int) -> float:
+        """Count an attempt for key, returns the seconds to wait when it is over limit, else 0."""
+        now = time.time()
+        counts = None
+        if self.backend is not None:
+            try:
+                counts = await self.backend.hit(key, self.window, now)
+            except Exception as ex:
+                logger.warning(f"Shared rate limit counters unavailable: {ex!r}")
+        if counts is None:
+            counts = self.local.hit(key, self.window, now)
+        elapsed = now % self.window
+        if window_estimate(*counts, elapsed, self.window) <= limit:
+            return 0
+        # by then the previous window no longer counts
+        return self.window - elapsed
+
+    def clear(self) -> None:
+        self.local.clear()
+
+
+def client_address(request: Request) -> str:
+    # uvicorn sets the client from X-Forwarded-For when the proxy is in --forwarded-allow-ips
+    return request.client.host if request.client else "unknown"
+
+
+async def limit_attempts(request: Request, action: str, email: str) -> None:
+    """Raise a 429 when the client or the email address made too many attempts at action."""
+    if not config.RATE_LIMIT_ENABLED:
+        return
+    for kind, value, limit in (
+        ("ip", client_address(request), config.RATE_LIMIT_IP_ATTEMPTS),
+        ("email", email.lower(), config.RATE_LIMIT_EMAIL_ATTEMPTS),
+    ):
+        retry_after = await rate_limiter.hit(f"{action}:{kind}:{value}", limit)
+        if retry_after:
+            RATE_LIMITED.inc(action, kind)
+            logger.warning(f"Too many {action} attempts by {kind}")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts, retry later",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+rate_limiter = RateLimiter(
+    window=config.RATE_LIMIT_WINDOW,
+    max_keys=config.RATE_LIMIT_MAX_KEYS,
+    backend=(
+        RedisCounters(config.RATE_LIMIT_REDIS_URL)
+        if config.RATE_LIMIT_REDIS_URL
+        else None
+    ),
+)
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from storeapi.config import config
+from storeapi.database import database, refresh_tokens
+from storeapi.metrics import REFRESH_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Rotating refresh tokens, renewing a login's access token without another bcrypt verify
+# Only their SHA-256 is stored, each can be exchanged once and the reuse of one signs out its family
+
+# expired rows are deleted at most this often per worker, by the next token issued
+PURGE_INTERVAL_SECONDS = 3600
+_next_purge = 0.0
+
+
+class InvalidRefreshToken(Exception):
+    """Raised for a refresh token that is unknown, expired or revoked."""
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def issue_refresh_token(user_id: int, family: Optional[str] = None) -> str:
+    """Store a new refresh token for the user, starting a family unless one is given."""
+    await purge_expired()
+    token = secrets.token_urlsafe(32)
+    await database.execute(
+        refresh_tokens.insert().values(
+            user_id=user_id,
+            token_hash=hash_token(token),
+            family=family or uuid.uuid4().hex,
+            expires_at=datetime.utcnow() + timedelta(days=config.REFRESH_TOKEN_DAYS),
+            revoked=False,
+        )
+    )
+    return token
+
+
+async def rotate_refresh_token(token: str) -> Tuple[int, str]:
+    """Revoke a refresh token, returns its user and the token replacing it."""
+    token_hash = hash_token(token)
+    query = (
+        refresh_tokens.update()
+        .where(
+            refresh_tokens.c.token_hash == token_hash,
+            refresh_tokens.c.revoked == False,
+            refresh_tokens.c.expires_at > datetime.utcnow(),
+        )
+        .values(revoked=True)
+        .returning(refresh_tokens.c.user_id, refresh_tokens.c.family)
+    )
+    # the revoked token and its replacement are stored together or not at all
+    async with database.transaction():
+        row = await database.fetch_one(query)
+        if row is not None:
+            replacement = await issue_refresh_token(row["user_id"], row["family"])
+    if row is None:
+        await reject(token_hash)
+    REFRESH_TOKENS.inc("rotated")
+    return row["user_id"], replacement
+
+
+async def reject(token_hash: str) -> None:
+    query = refresh_tokens.select().where(refresh_tokens.c.token_hash == token_hash)
+    row = await database.fetch_one(query)
+    if row is None:
+        REFRESH_TOKENS.inc("unknown")
+    elif row["revoked"]:
+        REFRESH_TOKENS.inc("reused")
+        logger.warning(
+            f"Refresh token reused, revoking the sessions of user {row['user_id']}"
+        )
+        await revoke_family(row["family"])
+    else:
+        REFRESH_TOKENS.inc("expired")
+    raise InvalidRefreshToken()
+
+
+async def revoke_refresh_token(token: str) -> None:
+    """Revoke the family of a refresh token, signing out the session it belongs to."""
+    query = refresh_tokens.select().where(
+        refresh_tokens.c.token_hash == hash_token(token)
+    )
+    row = await database.fetch_one(query)
+    if row is not None:
+        REFRESH_TOKENS.inc("revoked")
+        await revoke_family(row["family"])
+
+
+# A revoked family has no token left to detect the reuse of, its rows are deleted
+async def revoke_family(family: str) -> None:
+    await database.execute(
+        refresh_tokens.delete().where(refresh_tokens.c.family == family)
+    )
+
+
+# Rotated tokens are kept until they expire, so that their reuse is detected
+async def purge_expired() -> None:
+    global _next_purge
+    if time.monotonic() < _next_purge:
+        return
+    _next_purge = time.monotonic() + PURGE_INTERVAL_SECONDS
+    query = refresh_tokens.delete().where(
+        refresh_tokens.c.expires_at <= datetime.utcnow()
+    )
+    await database.execute(query)
@@ -0,0 +1,422 @@
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from starlette.responses import Response
+
+from storeapi.config import config
+from storeapi.metrics import RESPONSE_CACHE
+from storeapi.serialization import FastJSONResponse, response_format
+
+logger = logging.getLogger(__name__)
+
+# Declarative response cache for anonymous GET routes, see cached(), invalidated by tag
+# With RESPONSE_CACHE_REDIS_URL the entries are shared between workers
+
+CACHEABLE_STATUSES = {200}
+# response headers that are not stored, the length is the body's and cookies are per client
+SKIPPED_HEADERS = {b"content-length", b"set-cookie"}
+
+
+class ResponseCacheUnavailable(RuntimeError):
+    """Raised when a shared cache is configured but its client library is missing."""
+
+
+def import_redis():
+    # redis is only needed for a cache shared between workers
+    try:
+        import redis.asyncio as redis
+    except ImportError as ex:
+        raise ResponseCacheUnavailable(
+            "A shared response cache requires the redis package"
+        ) from ex
+    return redis
+
+
+class CachedResponse:
+    __slots__ = ("status_code", "raw_headers", "body", "expires_at", "tags")
+
+    def __init__(
+        self,
+        status_code: int,
+        raw_headers: List[Tuple[bytes, bytes]],
+        body: bytes,
+        expires_at: float,
+        tags: Tuple[str, ...],
+    ) -> None:
+        self.status_code = status_code
+        self.raw_headers = raw_headers
+        self.body = body
+        self.expires_at = expires_at
+        self.tags = tags
+
+    @classmethod
+    def from_response(cls, response: Response, ttl: float, tags: Tuple[str, ...]):
+        raw_headers = [
+            (name, value)
+            for name, value in response.raw_headers
+            if name not in SKIPPED_HEADERS
+        ]
+        return cls(
+            response.status_code, raw_headers, response.body, time.time() + ttl, tags
+        )
+
+    def cacheable(self, response: Response) -> bool:
+        cache_control = response.headers.get("cache-control", "")
+        return (
+            self.status_code in CACHEABLE_STATUSES
+            and "set-cookie" not in response.headers
+            and "no-store" not in cache_control
+            and "private" not in cache_control
+        )
+
+    def to_response(self) -> Response:
+        response = Response(self.body, status_code=self.status_code)
+        response.raw_headers = [
+            *self.raw_headers,
+            (b"content-length", str(len(self.body)).encode("latin-1")),
+        ]
+        return response
+
+    def dumps(self) -> bytes:
+        meta = {
+            "status_code": self.status_code,
+            "headers": [
+                [name.decode("latin-1"), value.decode("latin-1")]
+                for name, value in self.raw_headers
+            ],
+            "expires_at": self.expires_at,
+            "tags": list(self.tags),
+        }
+        return json.dumps(meta).encode() + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data: bytes):
+        meta, _, body = data.partition(b"\n")
+        meta = json.loads(meta)
+        raw_headers = [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in meta["headers"]
+        ]
+        return cls(
+            meta["status_code"],
+            raw_headers,
+            body,
+            meta["expires_at"],
+            tuple(meta["tags"]),
+        )
+
+
+class RedisBackend:
+    """Responses shared between workers, checked against a generation counter per tag."""
+
+    def __init__(self, url: str, prefix: str = "storeapi:response:") -> None:
+        self._redis = import_redis().from_url(url)
+        self.prefix = prefix
+
+    def _tag_keys(self, tags: Iterable[str]) -> List[str]:
+        return [f"{self.prefix}tag:{tag}" for tag in tags]
+
+    async def get(self, key: str, tags: Tuple[str, ...]) -> Optional[CachedResponse]:
+        # the entry and the current generations of its tags in one round trip
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.get(self.prefix + key)
+        if tags:
+            pipeline.mget(self._tag_keys(tags))
+        data, *generations = await pipeline.execute()
+        if data is None:
+            return None
+        stored, _, rest = data.partition(b"\n")
+        if generations and json.loads(stored) != [
+            int(value or 0) for value in generations[0]
+        ]:
+            return None
+        return CachedResponse.loads(rest)
+
+    async def set(self, key: str, entry: CachedResponse) -> None:
+        generations = (
+            await self._redis.mget(self._tag_keys(entry.tags)) if entry.tags else []
+        )
+        stored = json.dumps([int(value or 0) for value in generations]).encode()
+        ttl = max(int(entry.expires_at - time.time()), 1)
+        await self._redis.set(self.prefix + key, stored + b"\n" + entry.dumps(), ex=ttl)
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        pipeline = self._redis.pipeline(transaction=False)
+        for tag_key in self._tag_keys(tags):
+            pipeline.incr(tag_key)
+        await pipeline.execute()
+
+
+class ResponseCache:
+    """An LRU of rendered responses with tag invalidation and coalesced misses."""
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        backend: Optional[RedisBackend] = None,
+        local_ttl: Optional[float] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.backend = backend
+        self.local_ttl = local_ttl
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        # tag -> keys of the entries carrying it, for invalidation
+        self._by_tag: Dict[str, Set[str]] = {}
+        # key -> the render in progress, awaited by the requests arriving meanwhile
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # bumped by every invalidation, a render that an invalidation overtook is not stored
+        self._generation = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse) -> None:
+        self._drop(key)
+        if self.local_ttl is not None:
+            entry = CachedResponse(
+                entry.status_code,
+                entry.raw_headers,
+                entry.body,
+                min(entry.expires_at, time.time() + self.local_ttl),
+                entry.tags,
+            )
+        self._entries[key] = entry
+        for tag in entry.tags:
+            self._by_tag.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    async def get_or_render(
+        self,
+        key: str,
+        render: Callable[[], Awaitable[Response]],
+        ttl: float,
+        tags: Tuple[str, ...] = (),
+    ) -> Response:
+        entry = self.get(key)
+        if entry is not None:
+            RESPONSE_CACHE.inc("hit")
+            return entry.to_response()
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            RESPONSE_CACHE.inc("coalesced")
+            outcome = await asyncio.shield(inflight)
+            if isinstance(outcome, Exception):
+                raise outcome
+            if outcome is not None:
+                return outcome.to_response()
+            # the response could not be shared, render it for this request too
+            return await render()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        outcome = None
+        try:
+            if self.backend is not None:
+                entry = await self._shared_get(key, tags)
+                if entry is not None:
+                    RESPONSE_CACHE.inc("shared_hit")
+                    self.put(key, entry)
+                    outcome = entry
+                    return entry.to_response()
+
+            RESPONSE_CACHE.inc("miss")
+            generation = self._generation
+            try:
+                response = await render()
+            except Exception as ex:
+                outcome = ex
+                raise
+            if hasattr(response, "body"):
+                entry = CachedResponse.from_response(response, ttl, tags)
+                outcome = entry
+                if entry.cacheable(response) and generation == self._generation:
+                    self.put(key, entry)
+                    if self.backend is not None:
+                        await self._shared_set(key, entry)
+            return response
+        finally:
+            del self._inflight[key]
+            future.set_result(outcome)
+
+    async def invalidate(self, *tags: str) -> int:
+        self._generation += 1
+        keys = set()
+        for tag in tags:
+            keys |= self._by_tag.pop(tag, set())
+        for key in keys:
+            self._drop(key)
+        if self.backend is not None:
+            try:
+                await self.backend.invalidate(tags)
+            except Exception as ex:
+                logger.warning(
+                    f"Unable to invalidate shared responses tagged {tags}: {ex!r}"
+                )
+        if keys:
+            logger.debug(f"Dropped {len(keys)} cached responses tagged {tags}")
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_tag.clear()
+
+    async def _shared_get(
+        self, key: str, tags: Tuple[str, ...]
+    ) -> Optional[CachedResponse]:
+        # the shared cache is an optimisation, when it is down the response is rendered
+        try:
+            return await self.backend.get(key, tags)
+        except Exception as ex:
+            logger.warning(f"Shared response cache lookup failed: {ex!r}")
+            return None
+
+    async def _shared_set(self, key: str, entry: CachedResponse) -> None:
+        try:
+            await self.backend.set(key, entry)
+        except Exception as ex:
+            logger.warning(f"Shared response cache store failed: {ex!r}")
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def cache_key(
+    name: str,
+    request: Request,
+    vary_query: Optional[Tuple[str, ...]],
+    vary_headers: Tuple[str, ...],
+) -> str:
+    query = sorted(
+        (param, value)
+        for param, value in request.query_params.multi_items()
+        if vary_query is None or param in vary_query
+    )
+    headers = [request.headers.get(header, "") for header in vary_headers]
+    return json.dumps(
+        [name, request.url.path, response_format.get(), query, headers],
+        separators=(",", ":"),
+    )
+
+
+def cached(
+    ttl: float,
+    vary_query: Optional[Iterable[str]] = None,
+    vary_headers: Iterable[str] = (),
+    tags: Iterable[str] = (),
+    response_model: Any = None,
+):
+    """Cache the responses of an anonymous GET route for ttl seconds."""
+    vary_query = tuple(vary_query) if vary_query is not None else None
+    vary_headers = tuple(vary_headers)
+    tags = tuple(tags)
+    adapter = TypeAdapter(response_model) if response_model is not None else None
+
+    def decorator(endpoint: Callable) -> Callable:
+        name = f"{endpoint.__module__}.{endpoint.__qualname__}"
+        signature = inspect.signature(endpoint)
+        request_parameter = next(
+            (
+                parameter.name
+                for parameter in signature.parameters.values()
+                if parameter.annotation is Request
+            ),
+            None,
+        )
+        if request_parameter is None:
+            # FastAPI passes the request to the parameter added to the signature
+            request_parameter = "cached_request"
+            signature = signature.replace(
+                parameters=[
+                    *signature.parameters.values(),
+                    inspect.Parameter(
+                        request_parameter,
+                        inspect.Parameter.KEYWORD_ONLY,
+                        annotation=Request,
+                    ),
+                ]
+            )
+            pass_request = False
+        else:
+            pass_request = True
+
+        async def render(kwargs: dict) -> Response:
+            if inspect.iscoroutinefunction(endpoint):
+                content = await endpoint(**kwargs)
+            else:
+                content = await run_in_threadpool(endpoint, **kwargs)
+            if isinstance(content, Response):
+                response = content
+            elif adapter is not None:
+                model = adapter.validate_python(content, from_attributes=True)
+                response = Response(
+                    adapter.dump_json(model), media_type="application/json"
+                )
+            else:
+                response = FastJSONResponse(jsonable_encoder(content))
+            for header in vary_headers:
+                response.headers.add_vary_header(header)
+            return response
+
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            if pass_request:
+                request: Request = kwargs[request_parameter]
+            else:
+                request = kwargs.pop(request_parameter)
+            if (
+                not config.RESPONSE_CACHE_ENABLED
+                or request.method not in ("GET", "HEAD")
+                or "authorization" in request.headers
+            ):
+                RESPONSE_CACHE.inc("bypass")
+                return await render(kwargs)
+            key = cache_key(name, request, vary_query, vary_headers)
+            return await response_cache.get_or_render(
+                key, lambda: render(kwargs), ttl, tags
+            )
+
+        wrapper.__signature__ = signature
+        return wrapper
+
+    return decorator
+
+
+response_cache = (
+    ResponseCache(
+        max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+        backend=RedisBackend(config.RESPONSE_CACHE_REDIS_URL),
+        local_ttl=config.RESPONSE_CACHE_LOCAL_TTL,
+    )
+    if config.RESPONSE_CACHE_REDIS_URL
+    else ResponseCache(max_entries=config.RESPONSE_CACHE_MAX_ENTRIES)
+)
@@ -0,0 +1,146 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Optional
+
+import sqlalchemy
+from fastapi import APIRouter, Depends, HTTPException
+
+from storeapi.database import ROLLUP_GRANULARITIES, database, payment_rollups
+from storeapi.models.analytics import DonationAnalytics
+from storeapi.security import has_role
+from storeapi.serialization import NegotiatedRoute
+
+router = APIRouter(route_class=NegotiatedRoute)
+
+logger = logging.getLogger(__name__)
+
+
+class Granularity(str, Enum):
+    hour = "hour"
+    day = "day"
+
+
+def to_naive_utc(ts: datetime) -> datetime:
+    # rollup buckets are stored as naive UTC timestamps
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def ceil_bucket(ts: datetime, granularity: str) -> datetime:
+    floored = ROLLUP_GRANULARITIES[granularity](ts)
+    if floored == ts:
+        return ts
+    return floored + (
+        timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    )
+
+
+def split_range(start: datetime, end: datetime):
+    """Split an hour-aligned range into the fewest rollup buckets that cover it."""
+    first_day = ceil_bucket(start, "day")
+    last_day = ROLLUP_GRANULARITIES["day"](end)
+    if first_day >= last_day:
+        return [("hour", start, end)]
+
+    spans = [("day", first_day, last_day)]
+    if start < first_day:
+        spans.append(("hour", start, first_day))
+    if last_day < end:
+        spans.append(("hour", last_day, end))
+    return spans
+
+
+def average(total_amount: float, payment_count: int) -> float:
+    return total_amount / payment_count if payment_count else 0.0
+
+
+# Donation totals per campaign per hour or day, served entirely from the payment_rollups buckets
+# start is rounded down and end rounded up to whole hours, buckets are returned whole
+@router.get(
+    "/admin/analytics",
+    response_model=DonationAnalytics,
+    dependencies=[Depends(has_role("admin"))],
+)
+async def get_donation_analytics(
+    start: datetime,
+    end: datetime,
+    granularity: Granularity = Granularity.day,
+    campaign_id: Optional[int] = None,
+) -> DonationAnalytics:
+    logger.info(f"Getting {granularity.value} donation analytics from {start} to {end}")
+
+    start = ROLLUP_GRANULARITIES["hour"](to_naive_utc(start))
+    end = ceil_bucket(to_naive_utc(end), "hour")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    campaign_filter = sqlalchemy.true()
+    if campaign_id is not None:
+        campaign_filter = payment_rollups.c.campaign_id == campaign_id
+
+    # the series at the requested granularity
+    query = (
+        payment_rollups.select()
+        .where(
+            payment_rollups.c.granularity == granularity.value,
+            payment_rollups.c.bucket_start
+            >= ROLLUP_GRANULARITIES[granularity.value](start),
+            payment_rollups.c.bucket_start < end,
+            campaign_filter,
+        )
+        .order_by(payment_rollups.c.campaign_id, payment_rollups.c.bucket_start)
+    )
+    logger.debug(query)
+    buckets = [
+        {
+            "campaign_id": row["campaign_id"],
+            "bucket_start": row["bucket_start"],
+            "total_amount": row["total_amount"],
+            "payment_count": row["payment_count"],
+            "average_amount": average(row["total_amount"], row["payment_count"]),
+        }
+        for row in await database.fetch_all(query)
+    ]
+
+    # the exact totals over the range, merged from the covering day and hour buckets
+    covering_buckets = sqlalchemy.or_(
+        *[
+            sqlalchemy.and_(
+                payment_rollups.c.granularity == span_granularity,
+                payment_rollups.c.bucket_start >= span_start,
+                payment_rollups.c.bucket_start < span_end,
+            )
+            for span_granularity, span_start, span_end in split_range(start, end)
+        ]
+    )
+    query = (
+        sqlalchemy.select(
+            payment_rollups.c.campaign_id,
+            sqlalchemy.func.sum(payment_rollups.c.total_amount).label("total_amount"),
+            sqlalchemy.func.sum(payment_rollups.c.payment_count).label("payment_count"),
+        )
+        .where(covering_buckets, campaign_filter)
+        .group_by(payment_rollups.c.campaign_id)
+        .order_by(payment_rollups.c.campaign_id)
+    )
+    logger.debug(query)
+    totals = [
+        {
+            "campaign_id": row["campaign_id"],
+            "total_amount": row["total_amount"],
+            "payment_count": row["payment_count"],
+            "average_amount": average(row["total_amount"], row["payment_count"]),
+        }
+        for row in await database.fetch_all(query)
+    ]
+
+    return {
+        "granularity": granularity.value,
+        "start": start,
+        "end": end,
+        "campaign_id": campaign_id,
+        "buckets": buckets,
+        "totals": totals,
+    }
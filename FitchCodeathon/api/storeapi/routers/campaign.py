@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import List, Annotated
 
+from storeapi.campaign_cache import fragment_cache
 from storeapi.database import database, campaign_table
 import logging
 import sqlalchemy
@@ -12,8 +13,10 @@ from storeapi.security import (
 )
 
 from storeapi.models.campaign import Campaign, CampaignIn
+from storeapi.response_cache import cached, response_cache
+from storeapi.serialization import NegotiatedRoute, trusted_response
 
-router = APIRouter()
+router = APIRouter(route_class=NegotiatedRoute)
 
 logger = logging.getLogger(__name__)
 
@@ -74,11 +77,13 @@ async def create_campaign(campaign: CampaignIn) -> Campaign:
             detail=f"Campaign needs to be a Draft",
         )
 
+    data["version"] = 1
     query = campaign_table.insert().values(data)
     logger.debug(query)
     campaign_id = await database.execute(query)
+    await response_cache.invalidate("campaigns")
     created_campaign = {**data, "id": campaign_id}
-    return created_campaign
+    return trusted_response(Campaign, created_campaign, status_code=201)
 
 
 class CampaignState(str, Enum):
@@ -110,7 +115,7 @@ async def get_campaigns(
 
     logger.debug(query)
     campaigns = await database.fetch_all(query)
-    return campaigns
+    return trusted_response(List[Campaign], campaigns)
 
 
 @router.get(
@@ -125,7 +130,7 @@ async def get_campaign(campaign_id: int) -> Campaign:
         raise HTTPException(
             status_code=404, detail=f"Campaign with Id {campaign_id} not found"
         )
-    return campaign
+    return trusted_response(Campaign, campaign)
 
 
 @router.patch(
@@ -188,7 +193,7 @@ async def update_campaign(campaign_id: int, campaign: CampaignIn) -> Campaign:
                     campaign_table.c.isDraft == True,
                 )
             )
-            .values(data)
+            .values({**data, "version": campaign_table.c.version + 1})
         )
 
     if existing_campaign.isPublished:
@@ -200,11 +205,20 @@ async def update_campaign(campaign_id: int, campaign: CampaignIn) -> Campaign:
                     campaign_table.c.isPublished == True,
                 )
             )
-            .values({"isPublished": data["isPublished"], "isEnded": data["isEnded"]})
+            .values(
+                {
+                    "isPublished": data["isPublished"],
+                    "isEnded": data["isEnded"],
+                    "version": campaign_table.c.version + 1,
+                }
+            )
         )
 
     logger.debug(query)
     await database.execute(query)
+    # the rendered pages of the campaign are out of date
+    fragment_cache.invalidate(campaign_id)
+    await response_cache.invalidate("campaigns")
     updated_campaign = await get_campaign(campaign_id)  # {**data, "id": campaign_id}
     return updated_campaign
 
@@ -229,9 +243,18 @@ async def delete_campaign(campaign_id: int) -> None:
     query = campaign_table.delete().where(campaign_table.c.id == campaign_id)
     logger.debug(query)
     await database.execute(query)
+    fragment_cache.invalidate(campaign_id)
+    await response_cache.invalidate("campaigns")
+
+
+# The public campaign listing is cached for PUBLIC_CACHE_SECONDS, see response_cache.py
+PUBLIC_CACHE_SECONDS = 30
 
 
 @router.get("/public/campaign", response_model=List[Campaign])
+@cached(
+    ttl=PUBLIC_CACHE_SECONDS, vary_query=(), tags=("campaigns",), response_model=List[Campaign]
+)
 async def get_published_campaigns() -> List[Campaign]:
     logger.info("Getting published campaigns")
     campaigns = await get_campaigns(CampaignState.published)
@@ -239,6 +262,7 @@ async def get_published_campaigns() -> List[Campaign]:
 
 
 @router.get("/public/campaign/{campaign_id}", response_model=Campaign)
+@cached(ttl=PUBLIC_CACHE_SECONDS, vary_query=(), tags=("campaigns",), response_model=Campaign)
 async def get_published_campaign(campaign_id: int) -> Campaign:
     logger.info(f"Getting campaign with id {campaign_id}")
     campaign = await find_campaign_id(campaign_id=campaign_id)
@@ -252,4 +276,4 @@ async def get_published_campaign(campaign_id: int) -> Campaign:
         raise HTTPException(
             status_code=400, detail=f"Campaign with Id {campaign_id} is not published"
         )
-    return campaign
+    return trusted_response(Campaign, campaign)
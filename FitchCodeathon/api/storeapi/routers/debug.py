@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from storeapi.db_instrumentation import slow_query_log
+from storeapi.loop_monitor import loop_monitor
+from storeapi.profiling import (
+    MAX_PROFILE_SECONDS,
+    MAX_TRACEMALLOC_FRAMES,
+    MAX_TRACEMALLOC_SECONDS,
+    ProfilerBusy,
+    TracerNotRunning,
+    memory_tracer,
+    sample_stacks,
+)
+from storeapi.security import has_role
+from storeapi.serialization import NegotiatedRoute
+
+# Admin-only diagnostics that are safe to run against a live worker
+router = APIRouter(
+    prefix="/admin/debug",
+    dependencies=[Depends(has_role("admin"))],
+    route_class=NegotiatedRoute,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Sample the stacks of every thread for the given number of seconds and return them in the
+# collapsed-stack format, e.g. to render with flamegraph.pl or speedscope
+@router.get("/profile", response_class=PlainTextResponse)
+async def cpu_profile(
+    seconds: float = Query(default=10, gt=0, le=MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(default=10, ge=1, le=1000),
+):
+    logger.info(f"Profiling for {seconds} seconds every {interval_ms} ms")
+    try:
+        sampler = await sample_stacks(seconds, interval_ms / 1000)
+    except ProfilerBusy as ex:
+        raise HTTPException(status_code=409, detail=str(ex))
+    return PlainTextResponse(
+        sampler.collapsed(),
+        headers={
+            "Content-Disposition": 'attachment; filename="profile.collapsed"',
+            "X-Profile-Samples": str(sampler.samples),
+        },
+    )
+
+
+# Start tracing allocations, stopped automatically after max_seconds
+@router.post("/tracemalloc/start")
+async def start_tracemalloc(
+    frames: int = Query(default=10, ge=1, le=MAX_TRACEMALLOC_FRAMES),
+    max_seconds: float = Query(default=300, gt=0, le=MAX_TRACEMALLOC_SECONDS),
+):
+    logger.info(
+        f"Starting tracemalloc with {frames} frames for up to {max_seconds} seconds"
+    )
+    try:
+        memory_tracer.start(frames, max_seconds)
+    except ProfilerBusy as ex:
+        raise HTTPException(status_code=409, detail=str(ex))
+    return {"message": "tracemalloc started", "max_seconds": max_seconds}
+
+
+# The allocations that grew the most since the previous snapshot (or since start)
+@router.get("/tracemalloc/snapshot")
+async def tracemalloc_snapshot(limit: int = Query(default=25, ge=1, le=200)):
+    if not memory_tracer.running:
+        raise HTTPException(status_code=400, detail="tracemalloc is not running")
+    # walking every traced allocation is slow, keep it off the event loop
+    try:
+        return await asyncio.to_thread(memory_tracer.snapshot_diff, limit)
+    except TracerNotRunning as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+
+
+@router.post("/tracemalloc/stop")
+async def stop_tracemalloc():
+    if not memory_tracer.running:
+        raise HTTPException(status_code=400, detail="tracemalloc is not running")
+    # waits for a snapshot in progress to finish
+    await asyncio.to_thread(memory_tracer.stop)
+    return {"message": "tracemalloc stopped"}
+
+
+# The most recent calls that blocked the event loop, see loop_monitor.py
+@router.get("/blocked-calls")
+async def blocked_calls():
+    return list(loop_monitor.blocked_calls)
+
+
+# The latest statements slower than SLOW_QUERY_MS and the plans captured for repeated offenders
+@router.get("/slow-queries")
+async def slow_queries():
+    return {
+        "threshold_ms": slow_query_log.threshold * 1000,
+        "recent": list(slow_query_log.recent),
+        "explains": list(slow_query_log.explains),
+    }
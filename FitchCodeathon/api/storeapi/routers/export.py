@@ -0,0 +1,43 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+
+from storeapi.export import ExportFormat, ExportRun, ExportTable, ExportUnavailable
+from storeapi.security import has_role
+from storeapi.serialization import NegotiatedRoute
+
+router = APIRouter(route_class=NegotiatedRoute)
+
+logger = logging.getLogger(__name__)
+
+
+# Stream a finance export of payments or refund requests as gzipped CSV or Parquet, since_last
+# exports the rows changed since the previous one and moves the watermark once it completes
+@router.get(
+    "/admin/export/{table_name}",
+    response_class=StreamingResponse,
+    dependencies=[Depends(has_role("admin"))],
+)
+async def export_table(
+    table_name: ExportTable,
+    format: ExportFormat = ExportFormat.csv,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    since_last: bool = False,
+):
+    logger.info(f"Exporting {table_name.value} as {format.value}")
+    try:
+        export = ExportRun(
+            table_name, format, start=start, end=end, since_last=since_last
+        )
+    except ExportUnavailable as ex:
+        raise HTTPException(status_code=501, detail=str(ex))
+
+    return StreamingResponse(
+        export.chunks(),
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export.filename}"'},
+    )
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+from enum import Enum
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+
+from storeapi.assets import FRONTEND_DIR
+from storeapi.config import config
+from storeapi.images import (
+    ORIGINAL_MEDIA_TYPES,
+    RASTER_EXTENSIONS,
+    VARIANT_FORMATS,
+    DiskLRUCache,
+    ImagesUnavailable,
+    negotiate_format,
+    resize,
+    snap_width,
+    supported_formats,
+)
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DIR = os.path.realpath(os.path.join(FRONTEND_DIR, "assets", "img"))
+
+image_cache = DiskLRUCache(
+    config.IMAGE_CACHE_DIR, config.IMAGE_CACHE_MAX_MB * 1024 * 1024
+)
+
+
+class ImageFormat(str, Enum):
+    avif = "avif"
+    webp = "webp"
+    original = "original"
+
+
+def render_variant(image_path: str, width: int, image_format: Optional[str]) -> str:
+    """Return the cached variant of an image, resizing it first on a miss. Runs in a thread."""
+    full_path = os.path.realpath(os.path.join(IMAGE_DIR, image_path))
+    extension = os.path.splitext(full_path)[1].lower()
+    outside = os.path.commonpath([full_path, IMAGE_DIR]) != IMAGE_DIR
+    if outside or extension not in RASTER_EXTENSIONS:
+        raise FileNotFoundError(image_path)
+
+    # the modification time is part of the key so an edited image is never served stale
+    key = DiskLRUCache.key(
+        image_path, os.stat(full_path).st_mtime_ns, width, image_format
+    )
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached
+    with open(full_path, "rb") as file:
+        content = file.read()
+    logger.debug(f"Resizing {image_path} to {width} px as {image_format or extension}")
+    return image_cache.put(key, resize(content, width, image_format))
+
+
+# Serve an image from assets/img resized to the requested width, in the best format the browser
+# accepts unless one is requested. Widths are rounded up to one of images.WIDTHS
+@router.get("/images/{image_path:path}")
+async def resized_image(
+    image_path: str,
+    request: Request,
+    w: int = Query(ge=1, le=4096),
+    format: Optional[ImageFormat] = None,
+):
+    try:
+        available = supported_formats()
+    except ImagesUnavailable as ex:
+        raise HTTPException(status_code=501, detail=str(ex))
+
+    headers = {"Cache-Control": "public, max-age=86400"}
+    if format is None:
+        image_format = negotiate_format(request.headers.get("accept", ""), available)
+        headers["Vary"] = "Accept"
+    elif format == ImageFormat.original:
+        image_format = None
+    elif format.value in available:
+        image_format = format.value
+    else:
+        raise HTTPException(status_code=400, detail=f"{format.value} is not supported")
+
+    try:
+        path = await asyncio.to_thread(
+            render_variant, image_path, snap_width(w), image_format
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    if image_format is None:
+        media_type = ORIGINAL_MEDIA_TYPES[os.path.splitext(image_path)[1].lower()]
+    else:
+        media_type = VARIANT_FORMATS[image_format][1]
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -0,0 +1,109 @@
+import logging
+from typing import List, Optional
+
+import sqlalchemy
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import HTMLResponse
+
+from storeapi.assets import REVALIDATE_CACHE_CONTROL
+from storeapi.campaign_cache import fragment_cache
+from storeapi.database import campaign_table, database, payment_rollups
+from storeapi.response_cache import cached
+from storeapi.templating import render
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# Server-rendered campaign pages, built from cached fragments (see campaign_cache.py) and
+# cached whole for PAGE_CACHE_SECONDS (see response_cache.py)
+
+HTML_HEADERS = {"Cache-Control": REVALIDATE_CACHE_CONTROL}
+PAGE_CACHE_SECONDS = 30
+# the home page shows the first few campaigns, /campaigns lists them all
+HOME_CAMPAIGNS = 3
+
+
+# Published campaigns with the donations raised, summed from the daily rollups
+def published_campaigns_query():
+    totals = (
+        sqlalchemy.select(
+            payment_rollups.c.campaign_id,
+            sqlalchemy.func.sum(payment_rollups.c.total_amount).label("raised"),
+            sqlalchemy.func.sum(payment_rollups.c.payment_count).label("donations"),
+        )
+        .where(payment_rollups.c.granularity == "day")
+        .group_by(payment_rollups.c.campaign_id)
+        .subquery()
+    )
+    return (
+        sqlalchemy.select(
+            campaign_table.c.id,
+            campaign_table.c.name,
+            campaign_table.c.template,
+            campaign_table.c.version,
+            sqlalchemy.func.coalesce(totals.c.raised, 0).label("raised"),
+            sqlalchemy.func.coalesce(totals.c.donations, 0).label("donations"),
+        )
+        .select_from(
+            campaign_table.outerjoin(
+                totals, totals.c.campaign_id == campaign_table.c.id
+            )
+        )
+        .where(campaign_table.c.isPublished == True)
+        .order_by(campaign_table.c.id)
+    )
+
+
+def fragment_key(kind: str, campaign) -> tuple:
+    return (kind, campaign.id, campaign.version, campaign.raised, campaign.donations)
+
+
+def render_card(campaign) -> str:
+    return fragment_cache.get_or_render(
+        fragment_key("card", campaign),
+        lambda: render("_campaign_card.html", campaign=campaign),
+    )
+
+
+# The donor's home page, where the login redirects to
+@router.get("/home", response_class=HTMLResponse, include_in_schema=False)
+@cached(ttl=PAGE_CACHE_SECONDS, vary_query=(), tags=("campaigns", "donations"))
+async def home_page():
+    logger.info("Rendering the home page")
+    campaigns = await database.fetch_all(
+        published_campaigns_query().limit(HOME_CAMPAIGNS)
+    )
+    cards: List[str] = [render_card(campaign) for campaign in campaigns]
+    return HTMLResponse(render("index.html", cards=cards), headers=HTML_HEADERS)
+
+
+@router.get("/campaigns", response_class=HTMLResponse, include_in_schema=False)
+@cached(ttl=PAGE_CACHE_SECONDS, vary_query=(), tags=("campaigns", "donations"))
+async def campaigns_page():
+    logger.info("Rendering the campaigns page")
+    campaigns = await database.fetch_all(published_campaigns_query())
+    cards: List[str] = [render_card(campaign) for campaign in campaigns]
+    return HTMLResponse(render("campaigns.html", cards=cards), headers=HTML_HEADERS)
+
+
+@router.get(
+    "/campaigns/{campaign_id}", response_class=HTMLResponse, include_in_schema=False
+)
+@cached(ttl=PAGE_CACHE_SECONDS, vary_query=(), tags=("campaigns", "donations"))
+async def campaign_page(campaign_id: int):
+    logger.info(f"Rendering the page of campaign {campaign_id}")
+    query = published_campaigns_query().where(campaign_table.c.id == campaign_id)
+    campaign: Optional[object] = await database.fetch_one(query)
+    if not campaign:
+        raise HTTPException(
+            status_code=404, detail=f"Campaign with Id {campaign_id} not found"
+        )
+    details = fragment_cache.get_or_render(
+        fragment_key("details", campaign),
+        lambda: render("_campaign_details.html", campaign=campaign),
+    )
+    return HTMLResponse(
+        render("campaign_detail.html", campaign=campaign, details=details),
+        headers=HTML_HEADERS,
+    )
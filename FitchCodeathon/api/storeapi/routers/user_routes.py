@@ -1,20 +1,39 @@
-from fastapi import APIRouter, HTTPException, Depends
-from storeapi.database import database, users,refund_requests, store_payment, payments
-from storeapi.paypal_integration.paypal import process_paypal_refund
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from enum import Enum
+import sqlalchemy
+from storeapi.database import database, users,refund_requests, store_payment, settle_payment, payments, SETTLED_PAYMENT_STATUSES
+from storeapi.pagination import decode_cursor, encode_cursor, iterate_keyset, keyset_condition, keyset_order
 from storeapi.security import (
     verify_password, 
     create_access_token, 
     get_password_hash,
-    has_role
+    has_role,
+    valid_user_token,
 )
-from storeapi.models.user import UserIn, User, UserLogin
-from storeapi.models.payment import Payment, RefundRequest
-from storeapi.paypal_integration.paypal import fetch_paypal_token, create_paypal_payment  # PayPal Integration
+from storeapi.models.user import RefreshTokenIn, UserIn, User, UserLogin
+from storeapi.models.payment import Payment, PaymentExecution, PaymentRecord, RefundRequest, RefundPage
+from storeapi.rate_limit import limit_attempts
+from storeapi.refresh_tokens import (
+    InvalidRefreshToken,
+    issue_refresh_token,
+    revoke_refresh_token,
+    rotate_refresh_token,
+)
+from storeapi.response_cache import response_cache
+from storeapi.serialization import NegotiatedRoute, trusted_response
 import logging
 
-router = APIRouter()
+router = APIRouter(route_class=NegotiatedRoute)
 logger = logging.getLogger(__name__)
 
+# The PayPal client (and requests) is imported by the payment routes when they first need it
+# rather than with the app, see benchmarks/imports.py
+def paypal_client():
+    from storeapi.paypal_integration import paypal
+    return paypal
+
 async def find_user_by_email(email: str) -> User:
     query = users.select().where(users.c.email == email)
     user = await database.fetch_one(query)
@@ -25,10 +44,16 @@ async def find_user_by_id(user_id: int) -> User:
     user = await database.fetch_one(query)
     return user
 
+# The user the /user/login access token was issued to
+async def find_current_user(token_data: dict = Depends(valid_user_token)):
+    return await find_user_by_email(token_data["sub"])
+
 # User Registration
 @router.post("/user/register", response_model=User, status_code=201)
-async def create_user(user: UserIn) -> User:
+async def create_user(user: UserIn, request: Request) -> User:
     logger.info("Registering new user")
+    # rejects bursts before they cost a lookup and a bcrypt hash
+    await limit_attempts(request, "register", user.email)
     
     # Check if the email is already registered
     existing_user = await find_user_by_email(user.email)
@@ -37,7 +62,6 @@ async def create_user(user: UserIn) -> User:
 
     # Hash the password
     hashed_password = get_password_hash(user.password)
-    print(user.name, user.password, user.email)
     
     # Prepare the data to insert into the database
     user_data = {
@@ -51,46 +75,73 @@ async def create_user(user: UserIn) -> User:
     user_id = await database.execute(query)
 
     # Return the user information without the password (response_model is User)
-    return {"id": user_id, "name": user.name, "email": user.email}
+    return trusted_response(
+        User, {"id": user_id, "name": user.name, "email": user.email}, status_code=201
+    )
 
 
 # User Login
 @router.post("/user/login")
-async def login_user(user: UserLogin):
+async def login_user(user: UserLogin, request: Request):
     logger.info(f"User login attempt for email {user.email}")
+    # rejects bursts before they cost a lookup and a bcrypt verify
+    await limit_attempts(request, "login", user.email)
     
     # Find user by email
     db_user = await find_user_by_email(user.email)
     if not db_user or not verify_password(user.password, db_user['hashed_password']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    # Create the access token
+    # Create the access token, and the refresh token that renews it without the password
     access_token = create_access_token(data={"sub": db_user['email']})
+    refresh_token = await issue_refresh_token(db_user['id'])
     
-    # Return the access token
-    return {"access_token": access_token, "token_type": "bearer"}
+    # Return the tokens
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+# Exchange a refresh token for a new access token and a new refresh token, see refresh_tokens.py
+@router.post("/user/refresh")
+async def refresh_access_token(body: RefreshTokenIn):
+    try:
+        user_id, refresh_token = await rotate_refresh_token(body.refresh_token)
+    except InvalidRefreshToken:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    db_user = await find_user_by_id(user_id)
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    access_token = create_access_token(data={"sub": db_user['email']})
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+# Sign out the session the refresh token belongs to
+@router.post("/user/logout", status_code=204)
+async def logout_user(body: RefreshTokenIn):
+    await revoke_refresh_token(body.refresh_token)
 
 
 # PayPal Payment Route
 @router.post("/user/payment", response_model=Payment)
-async def process_payment(payment: Payment, user: User = Depends(find_user_by_email)):
+async def process_payment(payment: Payment, user: dict = Depends(find_current_user)):
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     logger.info(f"Processing payment for amount: {payment.amount}")
 
-    print(user.id, payment.payment_method, payment.amount, status)
-    
     # Fetch PayPal token
-    paypal_token = fetch_paypal_token()
+    paypal_token = paypal_client().fetch_paypal_token()
 
     if not paypal_token:
         raise HTTPException(status_code=500, detail="Unable to process payment with PayPal")
     
     # Create the payment with PayPal
-    payment_response = create_paypal_payment(paypal_token, payment)
+    payment_response = paypal_client().create_paypal_payment(paypal_token, payment)
     
-    # Store the payment status for the user
-    status = payment_response.get("status", "failed")
-    logger.info(user.id, payment.payment_method, payment.amount, status)
-    await store_payment(user_id=user.id, amount=payment.amount, status=status, payment_method=payment.payment_method)
+    # Store the payment status for the user, a v1 payment is "created" until the payer has
+    # approved it and it is executed (see execute_payment)
+    status = payment_response.get("state", "failed")
+    logger.info(f"Payment for user {user['id']} via {payment.payment_method} of {payment.amount}: {status}")
+    await store_payment(user_id=user['id'], amount=payment.amount, status=status, payment_method=payment.payment_method, campaign_id=payment.campaign_id, paypal_payment_id=payment_response.get("id"))
     
     # Return the payment response
     return {
@@ -98,11 +149,102 @@ async def process_payment(payment: Payment, user: User = Depends(find_user_by_em
         "payment_method": payment.payment_method,
         "amount": payment.amount,
         "status": status,
+        "transaction_id": payment_response.get("id"),
         "redirect_url": payment_response.get("links", [{}])[1].get("href")  # URL to redirect the user to PayPal for payment
     }
 
+# PayPal Payment Execution
+# PayPal sends the payer back with the payment id and their payer id once they have approved the
+# payment, executing it settles the payment and adds it to the donation rollups
+@router.post("/user/payment/execute")
+async def execute_payment(execution: PaymentExecution, user: dict = Depends(find_current_user)):
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    query = payments.select().where(
+        payments.c.paypal_payment_id == execution.paypal_payment_id,
+        payments.c.user_id == user["id"],
+    )
+    payment = await database.fetch_one(query)
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment not found or does not belong to this user")
+
+    # an executed payment cannot be executed again
+    if payment["status"] in SETTLED_PAYMENT_STATUSES:
+        return {"id": payment["id"], "status": payment["status"]}
+
+    paypal_token = paypal_client().fetch_paypal_token()
+    if not paypal_token:
+        raise HTTPException(status_code=500, detail="Unable to process payment with PayPal")
+
+    payment_response = paypal_client().execute_paypal_payment(paypal_token, execution.paypal_payment_id, execution.payer_id)
+    status = payment_response.get("state", "failed")
+    logger.info(f"Executed PayPal payment {payment['id']}: {status}")
+    await settle_payment(payment["id"], status)
+    # the campaign pages show the donation totals
+    await response_cache.invalidate("donations")
+
+    return {"id": payment["id"], "status": status}
+
+# Serialise the caller's payments into a {"items": [...], "next_cursor": ...} document one row at a
+# time, so memory use stays flat however many payments the donor has made
+async def stream_payment_history(user_id: int, limit: Optional[int], cursor: Optional[str]):
+    query = payments.select().where(payments.c.user_id == user_id)
+    yield b'{"items":['
+
+    # read one row past the limit to know whether another page follows, the extra row is the
+    # last one the iterator produces so the loop runs to completion and the cursor closes cleanly
+    count = 0
+    last = None
+    has_more = False
+    async for row in iterate_keyset(
+        query,
+        payments.c.created_at,
+        payments.c.id,
+        cursor=cursor,
+        max_rows=limit + 1 if limit else None,
+        descending=True,
+    ):
+        if limit and count == limit:
+            has_more = True
+            continue
+        if count:
+            yield b","
+        yield PaymentRecord.model_validate(row).model_dump_json().encode()
+        count += 1
+        last = row
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    yield b'],"next_cursor":' + (f'"{next_cursor}"' if next_cursor else "null").encode() + b"}"
+
+
+# Donor payment history, newest first
+# without a limit every payment is streamed, with one the response is a page and next_cursor
+# continues from its last row
+@router.get("/user/payments", response_class=StreamingResponse)
+async def get_payment_history(
+    user: dict = Depends(find_current_user),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    # validate the cursor up front, once streaming has started an error can no longer be returned
+    if cursor:
+        decode_cursor(cursor)
+    logger.info(f"Streaming payment history for user {user['id']}")
+
+    return StreamingResponse(
+        stream_payment_history(user["id"], limit, cursor),
+        media_type="application/json",
+    )
+
+
 @router.post("/donor/request-refund", status_code=201)
-async def request_refund(refund: RefundRequest, user: dict = Depends(find_user_by_email)):
+async def request_refund(refund: RefundRequest, user: dict = Depends(find_current_user)):
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     logger.info(f"User {user['email']} is requesting a refund for payment ID {refund.payment_id}")
 
     # Check if the payment exists and belongs to the user
@@ -149,7 +291,7 @@ async def manage_refund(refund_id: int, decision: str):
     if decision == "approve":
         # Call PayPal refund API to process the refund
         try:
-            paypal_response = process_paypal_refund(refund_request['payment_id'], refund_request['amount'])
+            paypal_response = paypal_client().process_paypal_refund(refund_request['payment_id'], refund_request['amount'])
             logger.info(f"PayPal refund processed: {paypal_response}")
 
             # Update refund request status
@@ -173,4 +315,95 @@ async def manage_refund(refund_id: int, decision: str):
         return {"message": "Refund request has been rejected."}
 
     else:
-        raise HTTPException(status_code=400, detail="Invalid decision. Choose 'approve' or 'reject'.")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail="Invalid decision. Choose 'approve' or 'reject'.")
+
+
+class RefundStatus(str, Enum):
+    pending = "pending"
+    approved = "approved"
+    rejected = "rejected"
+    all = "all"
+
+
+# Admin refund queue, keyset-paginated on (created_at, id) oldest first
+# the payment and the donor are joined in so the admin UI can render a page from a single query
+@router.get(
+    "/admin/refunds",
+    response_model=RefundPage,
+    dependencies=[Depends(has_role("admin"))],
+)
+async def list_refunds(
+    status: RefundStatus = RefundStatus.pending,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = None,
+) -> RefundPage:
+    logger.info(f"Listing {status.value} refunds")
+
+    query = sqlalchemy.select(
+        refund_requests.c.id,
+        refund_requests.c.amount,
+        refund_requests.c.status,
+        refund_requests.c.admin_approved,
+        refund_requests.c.created_at,
+        payments.c.id.label("payment_id"),
+        payments.c.amount.label("payment_amount"),
+        payments.c.status.label("payment_status"),
+        payments.c.payment_method,
+        payments.c.created_at.label("payment_created_at"),
+        users.c.id.label("user_id"),
+        users.c.username,
+        users.c.email,
+    ).select_from(
+        refund_requests.join(payments, payments.c.id == refund_requests.c.payment_id).join(
+            users, users.c.id == refund_requests.c.user_id
+        )
+    )
+
+    if status != RefundStatus.all:
+        # the status is inlined rather than bound so that Postgres can match the predicate of the
+        # partial pending index even when it falls back to a generic prepared statement plan
+        query = query.where(
+            refund_requests.c.status == sqlalchemy.literal_column(f"'{status.value}'")
+        )
+
+    if cursor:
+        query = query.where(
+            keyset_condition(refund_requests.c.created_at, refund_requests.c.id, cursor)
+        )
+
+    # fetch one extra row to find out whether there is another page without a COUNT(*)
+    query = query.order_by(
+        *keyset_order(refund_requests.c.created_at, refund_requests.c.id)
+    ).limit(limit + 1)
+    logger.debug(query)
+    rows = await database.fetch_all(query)
+
+    items = [
+        {
+            "id": row["id"],
+            "amount": row["amount"],
+            "status": row["status"],
+            "admin_approved": bool(row["admin_approved"]),
+            "created_at": row["created_at"],
+            "payment": {
+                "id": row["payment_id"],
+                "amount": row["payment_amount"],
+                "status": row["payment_status"],
+                "payment_method": row["payment_method"],
+                "created_at": row["payment_created_at"],
+            },
+            "user": {
+                "id": row["user_id"],
+                "name": row["username"],
+                "email": row["email"],
+            },
+        }
+        for row in rows[:limit]
+    ]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+
+    return {"items": items, "next_cursor": next_cursor}
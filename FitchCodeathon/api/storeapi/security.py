@@ -1,12 +1,15 @@
 import logging
-from typing import Annotated
+import time
+from typing import Annotated, Optional
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2AuthorizationCodeBearer
 from jose import jwt, jwk, ExpiredSignatureError, JWTError
-import requests
 from storeapi.config import config
+from storeapi.metrics import JWKS_CACHE, JWKS_FETCH_DURATION, JWKS_FETCHES
+from storeapi.shared_document import SharedDocument
+from storeapi.tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -30,11 +33,13 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Function to hash a password before storing it in the database
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    with span("bcrypt.hash"):
+        return pwd_context.hash(password)
 
 # Function to verify a plain password against a hashed password
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    with span("bcrypt.verify"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 # Function to create a JWT access token
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -42,9 +47,9 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)  # Default expiration time
+        expire = datetime.utcnow() + timedelta(minutes=config.ACCESS_TOKEN_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=config.ALGORITHM)
     return encoded_jwt
 
 # Exception for invalid credentials
@@ -65,28 +70,110 @@ def has_role(role_name: str):
         logger.info(f"Role {role_name} validated successfully")
     return check_role
 
-# Validating JWT Access Token
-async def valid_access_token(access_token: Annotated[str, Depends(oauth_2_scheme)]):
-    url = KC_CERTS_URL
+# The JWKs (JSON Web Key Set) rarely change, so they are cached for JWKS_CACHE_SECONDS
+# rather than fetched from Keycloak on every authenticated request
+# When Keycloak rotates its keys, tokens signed by the new key arrive before the cache expires,
+# so a token whose key is missing or does not verify refreshes the cache once, see signing_key
+_jwks_cache = {"jwks": None, "fetched_at": 0.0}
+
+
+class JWKSUnavailable(RuntimeError):
+    """Raised when the JWKS cannot be fetched from Keycloak."""
+
+
+def import_requests():
+    # requests (with urllib3 and certifi) only fetches the JWKS, once per worker at warm-up, so
+    # it is not imported with the app, see benchmarks/imports.py
+    import requests
+    return requests
+
+# Under the pre-fork server (serve.py) the workers also share the keys through jwks_store: a
+# worker whose cached keys expired takes the ones another worker fetched, and while one worker
+# fetches them the others keep using the previous keys rather than fetching them too
+jwks_store: Optional[SharedDocument] = None
+# how long a worker's claim to fetch the keys stops the others from fetching them
+JWKS_FETCH_CLAIM_SECONDS = 10
+
+
+def get_jwks(refresh: bool = False) -> dict:
+    now = time.monotonic()
+    # a refresh still reuses keys fetched moments ago
+    max_age = config.JWKS_MIN_REFRESH_SECONDS if refresh else config.JWKS_CACHE_SECONDS
+    if _jwks_cache["jwks"] is not None and now - _jwks_cache["fetched_at"] < max_age:
+        JWKS_CACHE.inc("hit")
+        return _jwks_cache["jwks"]
+
+    if jwks_store is not None:
+        jwks, age = jwks_store.read()
+        if jwks is not None and age < max_age:
+            JWKS_CACHE.inc("shared_hit")
+            _jwks_cache["jwks"] = jwks
+            _jwks_cache["fetched_at"] = now - age
+            return jwks
+        if jwks is not None and not jwks_store.claim(JWKS_FETCH_CLAIM_SECONDS):
+            JWKS_CACHE.inc("stale")
+            return jwks
+
+    JWKS_CACHE.inc("miss")
+    requests = import_requests()
     headers = {"User-agent": "custom-user-agent"}
+    start = time.perf_counter()
+    try:
+        # Fetch the JWKs from the Keycloak server
+        with span("auth.jwks_fetch"):
+            response = requests.get(KC_CERTS_URL, headers=headers)
+            response.raise_for_status()
+            jwks = response.json()
+    except requests.RequestException as ex:
+        JWKS_FETCHES.inc("error")
+        if jwks_store is not None:
+            jwks_store.release()
+        raise JWKSUnavailable(f"Unable to fetch the JWKS: {ex}") from ex
+    finally:
+        JWKS_FETCH_DURATION.observe(time.perf_counter() - start)
+    JWKS_FETCHES.inc("success")
+
+    _jwks_cache["jwks"] = jwks
+    _jwks_cache["fetched_at"] = now
+    if jwks_store is not None:
+        jwks_store.write(jwks)
+    return jwks
+
 
+# Function to pick the key a token was signed with, by the kid in its header
+# a token without a kid can only be matched to a set holding a single key
+def find_signing_key(jwks: dict, kid):
+    keys = jwks.get("keys", [])
+    if kid is None:
+        return keys[0] if len(keys) == 1 else None
+    return next((key for key in keys if key.get("kid") == kid), None)
+
+
+def decode_access_token(access_token: str, jwks: dict) -> dict:
+    kid = jwt.get_unverified_header(access_token).get("kid")
+    key = find_signing_key(jwks, kid)
+    if key is None:
+        raise JWTError(f"Unknown signing key {kid}")
+    return jwt.decode(
+        access_token,
+        jwk.construct(key),
+        algorithms=["RS256"],
+        audience=KC_CLIENT_ID,
+        options={"verify_exp": True},
+    )
+
+
+# Validating JWT Access Token
+async def valid_access_token(access_token: Annotated[str, Depends(oauth_2_scheme)]):
     try:
-        # Fetch the JWKs (JSON Web Key Set) from the Keycloak server
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        jwks = response.json()
-
-        # Extract signing key from the fetched JWKs
-        signing_key = jwk.construct(jwks["keys"][0])
-
-        # Decode and validate JWT access token
-        data = jwt.decode(
-            access_token,
-            signing_key,
-            algorithms=["RS256"],
-            audience=KC_CLIENT_ID,
-            options={"verify_exp": True},
-        )
+        with span("auth.validate_token"):
+            try:
+                data = decode_access_token(access_token, get_jwks())
+            except ExpiredSignatureError:
+                raise
+            except JWTError:
+                # the keys may have been rotated since they were cached, fetch them again once
+                data = decode_access_token(access_token, get_jwks(refresh=True))
         logger.info("Access token validated successfully")
         return data
 
@@ -96,6 +183,20 @@ async def valid_access_token(access_token: Annotated[str, Depends(oauth_2_scheme
     except JWTError as ex:
         logger.error(f"Token validation failed: {str(ex)}")
         raise create_credentials_exception("Invalid token") from ex
-    except requests.RequestException as ex:
+    except JWKSUnavailable as ex:
         logger.error(f"Failed to fetch JWKs: {str(ex)}")
         raise HTTPException(status_code=500, detail="Failed to validate token")
+
+
+# Validating the access tokens issued by /user/login, the user they were issued to is in sub
+async def valid_user_token(access_token: Annotated[str, Depends(oauth_2_scheme)]):
+    try:
+        data = jwt.decode(access_token, SECRET_KEY, algorithms=[config.ALGORITHM])
+    except ExpiredSignatureError as ex:
+        raise create_credentials_exception("Token has expired") from ex
+    except JWTError as ex:
+        logger.error(f"User token validation failed: {str(ex)}")
+        raise create_credentials_exception("Invalid token") from ex
+    if not data.get("sub"):
+        raise create_credentials_exception("Token does not identify a user")
+    return data
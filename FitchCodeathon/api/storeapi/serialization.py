@@ -0,0 +1,300 @@
+import contextvars
+import datetime
+import decimal
+import enum
+import functools
+import json
+import logging
+import types
+import typing
+from collections.abc import Mapping
+from typing import Any, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from sqlalchemy.engine import Row
+
+from storeapi.config import config
+
+logger = logging.getLogger(__name__)
+
+# Fast-path response serialization, trusted_response() encodes rows with orjson without validating
+# them, and NegotiatedRoute answers and reads application/msgpack, see benchmarks/
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def import_orjson():
+    # orjson is optional, responses fall back to the json module without it
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def import_msgpack():
+    # msgpack is optional, without it every response is JSON and msgpack bodies are refused
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+_orjson = import_orjson()
+_msgpack = import_msgpack()
+
+# the format the current request asked for, read by trusted_response
+response_format: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "response_format", default="json"
+)
+
+
+def _default(value: Any) -> Any:
+    # the types orjson encodes natively and the json module does not
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if _orjson is not None:
+        return _orjson.dumps(content, default=_default, option=_orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content,
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def loads(body: bytes) -> Any:
+    if _orjson is not None:
+        return _orjson.loads(body)
+    return json.loads(body)
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSONResponse rendered with orjson when it is installed."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class MsgPackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return _msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+def media_range_quality(accept: str, media_types: Tuple[str, ...]) -> float:
+    """The highest q the Accept header gives to any of the media types."""
+    quality = 0.0
+    for media_range in accept.split(","):
+        media_type, *params = media_range.split(";")
+        if media_type.strip().lower() not in media_types:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality = max(quality, q)
+    return quality
+
+
+def wants_msgpack(accept: str) -> bool:
+    # JSON stays the default, msgpack has to be asked for and preferred to JSON
+    if _msgpack is None or "msgpack" not in accept:
+        return False
+    msgpack_q = media_range_quality(accept, MSGPACK_MEDIA_TYPES)
+    json_q = media_range_quality(accept, ("application/json",))
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+
+class MsgPackRequest(Request):
+    """A request whose msgpack body is presented to FastAPI as already decoded JSON."""
+
+    def __init__(self, request: Request) -> None:
+        scope = dict(request.scope)
+        # FastAPI only parses the bodies it takes for JSON
+        scope["headers"] = [
+            (name, b"application/json" if name == b"content-type" else value)
+            for name, value in request.scope["headers"]
+        ]
+        super().__init__(scope, request.receive)
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            try:
+                self._json = _msgpack.unpackb(await self.body(), raw=False)
+            except (ValueError, _msgpack.UnpackException) as ex:
+                raise HTTPException(
+                    status_code=400, detail="Invalid msgpack body"
+                ) from ex
+        return self._json
+
+
+def is_msgpack_body(request: Request) -> bool:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    return content_type in MSGPACK_MEDIA_TYPES
+
+
+def is_negotiable(response: Response) -> bool:
+    """A successful JSON response with its body at hand, which can be sent as msgpack instead."""
+    return (
+        response.status_code < 400
+        and hasattr(response, "body")
+        and response.headers.get("content-type", "").startswith("application/json")
+    )
+
+
+def to_msgpack(response: Response) -> Response:
+    headers = {
+        name: value
+        for name, value in response.headers.items()
+        if name not in ("content-length", "content-type")
+    }
+    return MsgPackResponse(
+        loads(response.body),
+        status_code=response.status_code,
+        headers=headers,
+        background=response.background,
+    )
+
+
+class NegotiatedRoute(APIRoute):
+    """An APIRoute serving its response model as JSON or msgpack, depending on Accept."""
+
+    def get_route_handler(self) -> Callable:
+        json_handler = super().get_route_handler()
+
+        async def handler(request: Request) -> Response:
+            if is_msgpack_body(request):
+                if _msgpack is None:
+                    raise HTTPException(
+                        status_code=415, detail="msgpack is not supported"
+                    )
+                request = MsgPackRequest(request)
+            if not wants_msgpack(request.headers.get("accept", "")):
+                response = await json_handler(request)
+            else:
+                token = response_format.set("msgpack")
+                try:
+                    response = await json_handler(request)
+                finally:
+                    response_format.reset(token)
+                if is_negotiable(response):
+                    response = to_msgpack(response)
+            if _msgpack is not None and (
+                isinstance(response, MsgPackResponse) or is_negotiable(response)
+            ):
+                response.headers.add_vary_header("Accept")
+            return response
+
+        return handler
+
+
+def _field_encoder(annotation: Any) -> Optional[Callable[[Any], Any]]:
+    """How to encode a value of the given type, None when it is used as it is."""
+    origin = typing.get_origin(annotation)
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return lambda value: None if value is None else encode(annotation, value)
+    if origin in (list, typing.List):
+        (item,) = typing.get_args(annotation) or (Any,)
+        if isinstance(item, type) and issubclass(item, BaseModel):
+            return lambda values: None if values is None else encode(List[item], values)
+        return None
+    if origin is typing.Union or isinstance(annotation, types.UnionType):
+        # Optional[Model], the only union among our response models
+        members = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(members) == 1:
+            return _field_encoder(members[0])
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def compile_encoder(model: type, columns: Optional[Tuple[str, ...]] = None) -> Callable:
+    """Generate the function turning a row into the model's dict."""
+    namespace: dict = {}
+    items = []
+    for index, (name, field) in enumerate(model.model_fields.items()):
+        key = field.serialization_alias or field.alias or name
+        if columns is not None and name in columns:
+            value = f"column_{columns.index(name)}"
+        elif columns is None and field.is_required():
+            value = f"row[{name!r}]"
+        elif field.is_required():
+            raise KeyError(
+                f"{model.__name__}.{name} is not one of the columns {columns}"
+            )
+        else:
+            namespace[f"default_{index}"] = field.get_default(call_default_factory=True)
+            value = f"default_{index}"
+            if columns is None:
+                value = f"row.get({name!r}, {value})"
+        encode_field = _field_encoder(field.annotation)
+        if encode_field is not None:
+            namespace[f"encode_{index}"] = encode_field
+            value = f"encode_{index}({value})"
+        items.append(f"        {key!r}: {value},")
+
+    lines = ["def encode(row):"]
+    if columns is not None:
+        unpacked = ", ".join(f"column_{position}" for position in range(len(columns)))
+        lines.append(f"    ({unpacked},) = row")
+    source = "\n".join([*lines, "    return {", *items, "    }"])
+    exec(compile(source, f"<encoder {model.__name__}>", "exec"), namespace)
+    return namespace["encode"]
+
+
+def row_encoder(model: type, sample: Any) -> Callable[[Any], dict]:
+    """The encoder for rows of the same kind as sample: Records, Rows, dicts or models."""
+    if isinstance(sample, Row):
+        return compile_encoder(model, tuple(sample._fields))
+    # a Record of databases wraps a SQLAlchemy Row
+    mapping = getattr(sample, "_mapping", None)
+    if isinstance(mapping, Row):
+        encode_row = compile_encoder(model, tuple(mapping._fields))
+        return lambda row: encode_row(row._mapping)
+    encode_dict = compile_encoder(model)
+    if isinstance(sample, BaseModel):
+        return lambda row: encode_dict(row.__dict__)
+    if isinstance(mapping, Mapping):
+        return lambda row: encode_dict(row._mapping)
+    return encode_dict
+
+
+def encode(response_model: Any, content: Any) -> Any:
+    """The JSON-ready content of a Model or List[Model] response."""
+    if typing.get_origin(response_model) in (list, typing.List):
+        (model,) = typing.get_args(response_model)
+        if not content:
+            return []
+        encode_row = row_encoder(model, content[0])
+        return [encode_row(row) for row in content]
+    return row_encoder(response_model, content)(content)
+
+
+def trusted_response(response_model: Any, content: Any, status_code: int = 200) -> Any:
+    """Encode rows straight to a response when TRUSTED_RESPONSES is set, skipping validation."""
+    if not config.TRUSTED_RESPONSES:
+        return content
+    response_class = (
+        MsgPackResponse if response_format.get() == "msgpack" else FastJSONResponse
+    )
+    return response_class(encode(response_model, content), status_code=status_code)
@@ -0,0 +1,296 @@
+import argparse
+import importlib.util
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+import uvicorn
+from uvicorn.server import STARTUP_FAILURE
+
+from storeapi import security
+from storeapi.config import config
+from storeapi.shared_document import SharedDocument
+
+logger = logging.getLogger(__name__)
+
+# Pre-fork production server, `python -m storeapi.serve` imports the app once and forks
+# SERVER_WORKERS uvicorn workers on one socket, SIGHUP restarts them one at a time
+
+# how often the master reaps and checks on its workers
+TICK_SECONDS = 1.0
+# modules the app imports on first use, imported by the master for the workers to share
+PRELOADED_MODULES = ("requests", "httpx")
+
+
+def available_cores() -> int:
+    # the cores this process may run on, which in a container can be fewer than the host's
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def worker_rss(pid: int) -> Optional[int]:
+    """The resident memory of a process in bytes, None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class WorkerServer(uvicorn.Server):
+    """A uvicorn server reporting on a pipe once it accepts connections."""
+
+    def __init__(self, uvicorn_config: uvicorn.Config, ready_fd: int) -> None:
+        super().__init__(uvicorn_config)
+        self.ready_fd = ready_fd
+        self.master_pid = os.getppid()
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        await super().startup(sockets=sockets)
+        try:
+            os.write(self.ready_fd, b"1")
+        except OSError:
+            # the master does not wait for workers that replace an exited one
+            pass
+        os.close(self.ready_fd)
+
+    async def on_tick(self, counter: int) -> bool:
+        if os.getppid() != self.master_pid:
+            logger.warning("The master exited, stopping")
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+
+class Arbiter:
+    """The master process, keeping SERVER_WORKERS workers running."""
+
+    def __init__(
+        self,
+        uvicorn_config: uvicorn.Config,
+        sock: socket.socket,
+        workers: int,
+        max_rss_mb: int = 0,
+        graceful_timeout: float = 30,
+        startup_timeout: float = 60,
+    ) -> None:
+        self.uvicorn_config = uvicorn_config
+        self.sock = sock
+        self.worker_count = workers
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.graceful_timeout = graceful_timeout
+        self.startup_timeout = startup_timeout
+        # pid -> the time the worker was started
+        self.workers: Dict[int, float] = {}
+        # the workers asked to stop, which no longer count towards worker_count
+        self.retiring: Set[int] = set()
+        self._signals: List[int] = []
+        # workers whose lifespan startup failed, when any of the first ones does the master exits
+        self.failed_starts = 0
+
+    def run(self) -> int:
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._on_signal)
+        logger.info(
+            f"Starting {self.worker_count} workers on {self.uvicorn_config.loop} loop "
+            f"and {self.uvicorn_config.http} HTTP"
+        )
+        booting = [self.spawn() for _ in range(self.worker_count)]
+        for pid, ready_fd in booting:
+            self.wait_ready(pid, ready_fd)
+        self.reap()
+        if self.failed_starts:
+            logger.error("A worker failed to start, shutting down")
+            self.stop()
+            return 1
+
+        while True:
+            self.reap()
+            while self._signals:
+                sig = self._signals.pop(0)
+                if sig == signal.SIGHUP:
+                    self.restart()
+                else:
+                    self.stop()
+                    return 0
+            self.check_memory()
+            while len(self.workers) - len(self.retiring) < self.worker_count:
+                _, ready_fd = self.spawn()
+                os.close(ready_fd)
+            time.sleep(TICK_SECONDS)
+
+    def _on_signal(self, sig: int, frame) -> None:
+        self._signals.append(sig)
+
+    def spawn(self):
+        """Fork a worker, returns its pid and the pipe it reports being ready on."""
+        ready_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_fd)
+            code = 0
+            try:
+                run_worker(self.uvicorn_config, self.sock, write_fd)
+            except SystemExit as ex:
+                code = ex.code if isinstance(ex.code, int) else 1
+            except BaseException:
+                logger.exception("Worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        self.workers[pid] = time.monotonic()
+        logger.info(f"Booted worker {pid}")
+        return pid, ready_fd
+
+    def wait_ready(self, pid: int, ready_fd: int) -> bool:
+        try:
+            readable, _, _ = select.select([ready_fd], [], [], self.startup_timeout)
+            ready = bool(readable) and os.read(ready_fd, 1) == b"1"
+        finally:
+            os.close(ready_fd)
+        if not ready:
+            logger.warning(f"Worker {pid} did not start within {self.startup_timeout}s")
+        return ready
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.workers.pop(pid, None) is None:
+                continue
+            self.retiring.discard(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if code == STARTUP_FAILURE:
+                self.failed_starts += 1
+            logger.info(f"Worker {pid} exited with {code}")
+
+    def restart(self) -> None:
+        """Replace the workers one at a time, each once its replacement accepts connections."""
+        logger.info("Restarting workers")
+        for pid in list(self.workers):
+            if pid in self.retiring:
+                continue
+            new_pid, ready_fd = self.spawn()
+            if not self.wait_ready(new_pid, ready_fd):
+                logger.error("Restart aborted, the old workers keep running")
+                self.retire(new_pid)
+                return
+            self.retire(pid)
+            self.reap()
+
+    def check_memory(self) -> None:
+        if not self.max_rss:
+            return
+        for pid in list(self.workers):
+            rss = worker_rss(pid)
+            if pid not in self.retiring and rss is not None and rss > self.max_rss:
+                logger.info(f"Recycling worker {pid} using {rss // (1024 * 1024)} MB")
+                self.retire(pid)
+
+    def retire(self, pid: int) -> None:
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def stop(self) -> None:
+        """Stop the workers gracefully, killing those still running after graceful_timeout."""
+        for pid in list(self.workers):
+            self.retire(pid)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            logger.warning(f"Killing worker {pid}")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+            del self.workers[pid]
+
+
+def run_worker(
+    uvicorn_config: uvicorn.Config, sock: socket.socket, ready_fd: int
+) -> None:
+    # uvicorn installs its own handlers, shutting down gracefully on SIGTERM and SIGINT
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    WorkerServer(uvicorn_config, ready_fd).run(sockets=[sock])
+
+
+def configure_master_logging() -> None:
+    # the workers configure the app's logging in the lifespan, the master only reports on them
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter("%(asctime)s [%(process)d] %(levelname)s %(message)s")
+    )
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve the API from pre-forked workers"
+    )
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS)
+    parser.add_argument("--max-requests", type=int, default=config.SERVER_MAX_REQUESTS)
+    parser.add_argument("--max-rss-mb", type=int, default=config.SERVER_MAX_RSS_MB)
+    args = parser.parse_args(argv)
+    configure_master_logging()
+
+    # preload the app, the workers inherit it
+    from storeapi.database import ensure_tables
+    from storeapi.main import app
+
+    # once, the forked workers then skip it in the lifespan
+    ensure_tables()
+    # the app imports these lazily, every worker's warm-up needs them
+    for module in PRELOADED_MODULES:
+        importlib.import_module(module)
+    security.jwks_store = SharedDocument()
+
+    uvicorn_config = uvicorn.Config(
+        app,
+        host=args.host,
+        port=args.port,
+        loop="uvloop" if available("uvloop") else "asyncio",
+        http="httptools" if available("httptools") else "h11",
+        limit_max_requests=args.max_requests or None,
+        limit_max_requests_jitter=config.SERVER_MAX_REQUESTS_JITTER,
+        timeout_graceful_shutdown=config.SERVER_GRACEFUL_TIMEOUT,
+    )
+    sock = uvicorn_config.bind_socket()
+    arbiter = Arbiter(
+        uvicorn_config,
+        sock,
+        workers=args.workers or available_cores(),
+        max_rss_mb=args.max_rss_mb,
+        graceful_timeout=config.SERVER_GRACEFUL_TIMEOUT,
+        startup_timeout=config.SERVER_STARTUP_TIMEOUT,
+    )
+    sys.exit(arbiter.run())
+
+
+if __name__ == "__main__":
+    main()
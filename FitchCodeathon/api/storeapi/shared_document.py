@@ -0,0 +1,59 @@
+import json
+import logging
+import mmap
+import multiprocessing
+import struct
+import time
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A JSON document shared by the workers of the pre-fork server in an anonymous shared mapping,
+# a worker finding it missing or too old claims the update so that only one fetches it
+
+# written_at, claimed_at, length of the document
+HEADER = struct.Struct("<ddI")
+
+
+class SharedDocument:
+    def __init__(self, max_bytes: int = 64 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._buffer = mmap.mmap(-1, HEADER.size + max_bytes)
+        self._lock = multiprocessing.Lock()
+
+    def read(self) -> Tuple[Optional[Any], float]:
+        """The document and its age in seconds, (None, inf) before it is first written."""
+        with self._lock:
+            written_at, _, length = HEADER.unpack_from(self._buffer, 0)
+            data = self._buffer[HEADER.size : HEADER.size + length]
+        if not length:
+            return None, float("inf")
+        return json.loads(data), max(time.time() - written_at, 0.0)
+
+    def write(self, document: Any) -> bool:
+        data = json.dumps(document, separators=(",", ":")).encode()
+        if len(data) > self.max_bytes:
+            logger.warning(
+                f"Shared document of {len(data)} bytes exceeds {self.max_bytes} bytes"
+            )
+            return False
+        with self._lock:
+            self._buffer[HEADER.size : HEADER.size + len(data)] = data
+            HEADER.pack_into(self._buffer, 0, time.time(), 0.0, len(data))
+        return True
+
+    def claim(self, timeout: float) -> bool:
+        """Claim the next update, False while another worker claimed it less than timeout ago."""
+        with self._lock:
+            written_at, claimed_at, length = HEADER.unpack_from(self._buffer, 0)
+            now = time.time()
+            if now - claimed_at < timeout:
+                return False
+            HEADER.pack_into(self._buffer, 0, written_at, now, length)
+        return True
+
+    def release(self) -> None:
+        """Give up a claim without writing, e.g. when the update failed."""
+        with self._lock:
+            written_at, _, length = HEADER.unpack_from(self._buffer, 0)
+            HEADER.pack_into(self._buffer, 0, written_at, 0.0, length)
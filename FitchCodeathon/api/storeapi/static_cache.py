@@ -0,0 +1,357 @@
+import asyncio
+import logging
+import mimetypes
+import os
+import posixpath
+import stat
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+
+from storeapi.assets import (
+    BUILD_DIR,
+    COMPRESSIBLE_EXTENSIONS,
+    ENCODINGS,
+    FRONTEND_DIR,
+    HASHED_NAME,
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    load_manifest,
+)
+from storeapi.config import config
+from storeapi.metrics import STATIC_CACHE
+
+logger = logging.getLogger(__name__)
+
+# In-memory static file serving, small files and their precompressed variants are served from an
+# LRU bounded by STATIC_CACHE_MAX_MB, larger ones are streamed by FileResponse
+
+PRELOAD_EXTENSIONS = {".html", ".css", ".js", ".woff2", ".svg", ".json"}
+# what an entry costs besides its bodies: the stat results, headers and bookkeeping
+ENTRY_BYTES = 1024
+
+
+class CachedFile:
+    __slots__ = (
+        "key",
+        "full_path",
+        "stat_result",
+        "media_type",
+        "headers",
+        "etag",
+        "bodies",
+        "variants",
+        "size",
+    )
+
+    def __init__(
+        self,
+        key: str,
+        full_path: str,
+        stat_result: os.stat_result,
+        variants: Dict[str, Tuple[str, os.stat_result]],
+        bodies: Optional[Dict[str, bytes]],
+    ) -> None:
+        self.key = key
+        self.full_path = full_path
+        self.stat_result = stat_result
+        # content coding -> (path, stat) of the precompressed variants
+        self.variants = variants
+        # content coding ("identity" for the file itself) -> bytes, None for large files
+        self.bodies = bodies
+        self.size = ENTRY_BYTES + (
+            sum(len(body) for body in bodies.values()) if bodies else 0
+        )
+        self.media_type = (
+            mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        )
+        self.etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+        cacheable = HASHED_NAME.search(os.path.basename(full_path))
+        self.headers = {
+            "etag": self.etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "cache-control": (
+                IMMUTABLE_CACHE_CONTROL if cacheable else REVALIDATE_CACHE_CONTROL
+            ),
+            "accept-ranges": "bytes",
+        }
+        if os.path.splitext(full_path)[1] in COMPRESSIBLE_EXTENSIONS:
+            self.headers["vary"] = "Accept-Encoding"
+
+    def changed(self) -> bool:
+        try:
+            current = os.stat(self.full_path)
+        except OSError:
+            return True
+        return (current.st_mtime_ns, current.st_size) != (
+            self.stat_result.st_mtime_ns,
+            self.stat_result.st_size,
+        )
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """The (start, end inclusive) of a single byte range, None when it is not satisfiable."""
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        raise ValueError(header)
+    first, _, last = ranges.strip().partition("-")
+    if not first:
+        # the last N bytes
+        length = int(last)
+        if length <= 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def accepted_encodings(headers: Headers) -> set:
+    accepted = set()
+    for coding in headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    # each representation has its own tag, the same bytes are not sent in another coding
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def not_modified(entry: CachedFile, request_headers: Headers) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        own_tags = {entry.etag} | {
+            encoded_etag(entry.etag, coding) for coding, _ in ENCODINGS
+        }
+        return bool(tags & own_tags) or "*" in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    return (
+        if_modified_since is not None
+        and if_modified_since == entry.headers["last-modified"]
+    )
+
+
+class CachedStaticFiles:
+    """ASGI app serving a directory from memory, a drop-in replacement for StaticFiles."""
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_file_bytes: int = 512 * 1024,
+    ) -> None:
+        self.directory = os.path.realpath(directory)
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._size = 0
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        assert scope["type"] == "http"
+        path = scope["path"][len(scope.get("root_path", "")) :].lstrip("/")
+        response = await self.get_response(path, scope)
+        await response(scope, receive, send)
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405, headers={"Allow": "GET, HEAD"})
+
+        # "a//b", "./a/b" and "c/../a/b" are all "a/b", without a system call
+        path = posixpath.normpath("/" + path).lstrip("/")
+        entry = self._entries.get(path)
+        if entry is not None:
+            self._entries.move_to_end(path)
+            STATIC_CACHE.inc("hit")
+        else:
+            STATIC_CACHE.inc("miss")
+            entry = await anyio.to_thread.run_sync(self.load, path)
+            if entry is None:
+                raise HTTPException(status_code=404)
+            self._store(entry)
+        return self.respond(entry, Headers(scope=scope))
+
+    def load(self, path: str) -> Optional[CachedFile]:
+        """Stat and, when it is small enough, read a file and its variants. Runs in a thread."""
+        full_path = os.path.realpath(os.path.join(self.directory, path))
+        if os.path.commonpath([full_path, self.directory]) != self.directory:
+            return None
+        key = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        try:
+            stat_result = os.stat(full_path)
+        except (OSError, ValueError):
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                variants[encoding] = (full_path + suffix, os.stat(full_path + suffix))
+            except OSError:
+                continue
+
+        bodies = None
+        if stat_result.st_size <= self.max_file_bytes:
+            bodies = {}
+            with open(full_path, "rb") as file:
+                bodies["identity"] = file.read()
+            for encoding, (variant_path, _) in variants.items():
+                with open(variant_path, "rb") as file:
+                    bodies[encoding] = file.read()
+        return CachedFile(key, full_path, stat_result, variants, bodies)
+
+    def _store(self, entry: CachedFile) -> None:
+        previous = self._entries.pop(entry.key, None)
+        if previous is not None:
+            self._size -= previous.size
+        self._entries[entry.key] = entry
+        self._size += entry.size
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+
+    def respond(self, entry: CachedFile, request_headers: Headers) -> Response:
+        headers = dict(entry.headers)
+        if not_modified(entry, request_headers):
+            return Response(status_code=304, headers=headers)
+
+        range_header = request_headers.get("range")
+        if range_header and request_headers.get("if-range", entry.etag) != entry.etag:
+            # the client's copy is stale, send the whole file instead
+            range_header = None
+
+        if entry.bodies is None:
+            return self._file_response(entry, request_headers, headers, range_header)
+
+        if range_header:
+            # ranges are always of the uncompressed file
+            body = entry.bodies["identity"]
+            try:
+                byte_range = parse_range(range_header, len(body))
+            except ValueError:
+                byte_range = (0, len(body) - 1)
+            if byte_range is None:
+                headers["content-range"] = f"bytes */{len(body)}"
+                return Response(status_code=416, headers=headers)
+            start, end = byte_range
+            if (start, end) != (0, len(body) - 1):
+                headers["content-range"] = f"bytes {start}-{end}/{len(body)}"
+                return Response(
+                    body[start : end + 1],
+                    status_code=206,
+                    headers=headers,
+                    media_type=entry.media_type,
+                )
+            return Response(body, headers=headers, media_type=entry.media_type)
+
+        accepted = accepted_encodings(request_headers)
+        for encoding, _ in ENCODINGS:
+            if encoding in accepted and encoding in entry.bodies:
+                headers["content-encoding"] = encoding
+                headers["etag"] = encoded_etag(entry.etag, encoding)
+                return Response(
+                    entry.bodies[encoding], headers=headers, media_type=entry.media_type
+                )
+        return Response(
+            entry.bodies["identity"], headers=headers, media_type=entry.media_type
+        )
+
+    def _file_response(
+        self,
+        entry: CachedFile,
+        request_headers: Headers,
+        headers: dict,
+        range_header: Optional[str],
+    ) -> Response:
+        path, stat_result = entry.full_path, entry.stat_result
+        if not range_header:
+            accepted = accepted_encodings(request_headers)
+            for encoding, _ in ENCODINGS:
+                if encoding in accepted and encoding in entry.variants:
+                    path, stat_result = entry.variants[encoding]
+                    headers["content-encoding"] = encoding
+                    headers["etag"] = encoded_etag(entry.etag, encoding)
+                    break
+        # FileResponse handles the Range header itself
+        response = FileResponse(
+            path, stat_result=stat_result, media_type=entry.media_type
+        )
+        response.headers.update(headers)
+        return response
+
+    async def preload(self) -> int:
+        """Load the small text and font assets into the cache."""
+        loaded = await anyio.to_thread.run_sync(self._read_preloaded)
+        for entry in loaded:
+            self._store(entry)
+        logger.info(f"Preloaded {len(loaded)} static files ({self._size} bytes)")
+        return len(loaded)
+
+    def _read_preloaded(self) -> List[CachedFile]:
+        loaded: List[CachedFile] = []
+        total = 0
+        for directory, _, filenames in os.walk(self.directory):
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1] not in PRELOAD_EXTENSIONS:
+                    continue
+                full_path = os.path.join(directory, filename)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                entry = self.load(path)
+                if entry is None or entry.bodies is None:
+                    continue
+                if total + entry.size > self.max_bytes:
+                    return loaded
+                total += entry.size
+                loaded.append(entry)
+        return loaded
+
+    def start_watching(self, interval: float) -> None:
+        self._watcher = asyncio.get_running_loop().create_task(self._watch(interval))
+
+    async def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            entries = list(self._entries.items())
+            changed = await anyio.to_thread.run_sync(
+                lambda: [path for path, entry in entries if entry.changed()]
+            )
+            for path in changed:
+                entry = self._entries.pop(path, None)
+                if entry is not None:
+                    self._size -= entry.size
+                    logger.info(f"Static file {path} changed, dropped from the cache")
+
+
+def frontend_static_files() -> CachedStaticFiles:
+    """The app serving /static: the build when there is one, the plain sources otherwise."""
+    directory = BUILD_DIR if load_manifest() is not None else FRONTEND_DIR
+    return CachedStaticFiles(
+        directory,
+        max_bytes=config.STATIC_CACHE_MAX_MB * 1024 * 1024,
+        max_file_bytes=config.STATIC_CACHE_MAX_FILE_KB * 1024,
+    )
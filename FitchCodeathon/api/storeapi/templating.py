@@ -0,0 +1,48 @@
+import logging
+import os
+from typing import Dict, Optional
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from storeapi.assets import BASE_DIR, load_manifest
+
+logger = logging.getLogger(__name__)
+
+# Server-side rendering of the campaign pages, the templates are compiled once at startup and
+# static() maps asset references to the fingerprinted names of the build
+
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+
+_manifest: Optional[Dict[str, str]] = load_manifest()
+
+
+def static(path: str) -> str:
+    if _manifest is not None:
+        path = _manifest.get(path, path)
+    return f"/static/{path}"
+
+
+environment = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+    # keep every template compiled, the default of 400 would evict under many templates
+    cache_size=-1,
+)
+environment.globals["static"] = static
+environment.filters["pounds"] = lambda amount: f"£{amount:,.0f}"
+
+
+def precompile() -> int:
+    """Compile every template up front, so the first request does not pay for it."""
+    names = environment.list_templates(extensions=["html"])
+    for name in names:
+        environment.get_template(name)
+    logger.info(f"Compiled {len(names)} page templates")
+    return len(names)
+
+
+def render(name: str, **context) -> str:
+    return environment.get_template(name).render(**context)
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from asgi_correlation_id.context import correlation_id
+
+from storeapi.config import config
+from storeapi.metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+# Lightweight request tracing, a root span per request with the correlation id as trace id
+# Traces are kept by TRACE_SAMPLE_RATE or when slower than TRACE_SLOW_MS, see TraceExporter
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: dict) -> None:
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = self.start_ns
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    __slots__ = ("trace_id", "correlation_id", "spans")
+
+    def __init__(self, request_correlation_id: Optional[str]) -> None:
+        self.correlation_id = request_correlation_id
+        self.trace_id = trace_id_for(request_correlation_id)
+        self.spans: List[Span] = []
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def trace_id_for(request_correlation_id: Optional[str]) -> str:
+    # OTLP trace ids are 32 hex characters, which is what a uuid4 correlation id already is
+    candidate = (request_correlation_id or "").replace("-", "").lower()
+    if len(candidate) == 32 and all(c in "0123456789abcdef" for c in candidate):
+        return candidate
+    return uuid.uuid4().hex
+
+
+# activate=False keeps the span from parenting the spans opened inside it, which leaves held open
+# across the yields of an async generator need
+@contextmanager
+def span(name: str, activate: bool = True, **attributes):
+    """Record a span for the enclosed block, a no-op outside of a traced request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current) if activate else None
+    try:
+        yield current
+    except BaseException as ex:
+        current.error = repr(ex)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        if token is not None:
+            _current_span.reset(token)
+        trace.spans.append(current)
+
+
+def attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace) -> dict:
+    """Convert a trace into an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for recorded in trace.spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": recorded.span_id,
+            "name": recorded.name,
+            "kind": (
+                2 if recorded.parent_id is None else 1
+            ),  # SERVER for the root, INTERNAL below
+            "startTimeUnixNano": str(recorded.start_ns),
+            "endTimeUnixNano": str(recorded.end_ns),
+            "attributes": [
+                {"key": key, "value": attribute_value(value)}
+                for key, value in recorded.attributes.items()
+            ],
+            "status": (
+                {"code": 2, "message": recorded.error}
+                if recorded.error
+                else {"code": 1}
+            ),
+        }
+        if recorded.parent_id:
+            otlp_span["parentSpanId"] = recorded.parent_id
+        spans.append(otlp_span)
+
+    resource_attributes = [
+        {"key": "service.name", "value": {"stringValue": "storeapi"}}
+    ]
+    if trace.correlation_id:
+        resource_attributes.append(
+            {"key": "correlation_id", "value": {"stringValue": trace.correlation_id}}
+        )
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": resource_attributes},
+                "scopeSpans": [{"scope": {"name": "storeapi.tracing"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+class TraceExporter:
+    """Appends traces to an OTLP/JSON lines file from a background thread."""
+
+    def __init__(self, path: str, max_queued: int = 1000) -> None:
+        self.path = path
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self.dropped = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="trace-exporter", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            trace = self.queue.get()
+            if trace is None:
+                return
+            try:
+                with open(self.path, "a") as file:
+                    file.write(json.dumps(to_otlp(trace)) + "\n")
+                    # write whatever else is already waiting while the file is open
+                    while not self.queue.empty():
+                        trace = self.queue.get_nowait()
+                        if trace is None:
+                            return
+                        file.write(json.dumps(to_otlp(trace)) + "\n")
+            except OSError as ex:
+                logger.warning(f"Unable to export traces to {self.path}: {ex}")
+
+    def stop(self) -> None:
+        """Write out the queued traces and stop the background thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout=5)
+
+
+exporter = TraceExporter(config.TRACE_EXPORT_PATH)
+
+
+def finish_trace(trace: Trace, root: Span) -> None:
+    slow = root.duration_ms >= config.TRACE_SLOW_MS
+    if slow:
+        # name the stage that took longest so a slow request can be explained from the log alone
+        stages = [recorded for recorded in trace.spans if recorded is not root]
+        slowest = max(stages, key=lambda recorded: recorded.duration_ms, default=None)
+        breakdown = (
+            f", slowest stage {slowest.name} took {slowest.duration_ms:.1f} ms"
+            if slowest
+            else ""
+        )
+        logger.warning(
+            f"Slow request {root.name} took {root.duration_ms:.1f} ms{breakdown}"
+        )
+
+    if slow or random.random() < config.TRACE_SAMPLE_RATE:
+        exporter.export(trace)
+
+
+# must run inside CorrelationIdMiddleware, the correlation id is the trace id
+class TracingMiddleware:
+    """Pure ASGI middleware opening the root span of each request."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not config.TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        trace = Trace(correlation_id.get())
+        trace_token = _current_trace.set(trace)
+        root = Span(scope["method"], None, {"http.method": scope["method"]})
+        span_token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            root.end_ns = time.time_ns()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+
+            template = route_template(scope)
+            root.name = f"{scope['method']} {template}"
+            root.attributes["http.route"] = template
+            root.attributes["http.status_code"] = status_code
+            trace.spans.append(root)
+            finish_trace(trace, root)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from fastapi.concurrency import run_in_threadpool
+
+from storeapi.config import config
+from storeapi.database import campaign_table, database, users
+from storeapi.routers.pages import published_campaigns_query
+from storeapi.security import get_jwks
+
+logger = logging.getLogger(__name__)
+
+# Warm start, the lifespan opens the database connections, fetches the JWKS and requests
+# WARMUP_PATHS before serving, GET /ready answers 503 until then
+
+
+def hot_statements() -> List:
+    """The statements of the busiest routes, with parameters matching no row."""
+    return [
+        published_campaigns_query(),
+        campaign_table.select().where(campaign_table.c.isPublished == True),
+        campaign_table.select().where(campaign_table.c.id == 0),
+        users.select().where(users.c.email == ""),
+    ]
+
+
+async def run_hot_statements() -> None:
+    for query in hot_statements():
+        await database.fetch_all(query)
+
+
+async def warm_connections() -> None:
+    # each task checks out its own connection
+    await asyncio.gather(
+        *(run_hot_statements() for _ in range(config.WARMUP_DB_CONNECTIONS))
+    )
+
+
+async def prefetch_jwks() -> None:
+    await run_in_threadpool(get_jwks)
+
+
+async def request_paths(app) -> None:
+    # httpx, which pulls in rich for its command line, is only needed here
+    from httpx import ASGITransport, AsyncClient
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://warmup"
+    ) as client:
+        for path in config.WARMUP_PATHS:
+            response = await client.get(path)
+            if response.status_code != 200:
+                logger.warning(
+                    f"Warm-up request to {path} answered {response.status_code}"
+                )
+
+
+class Readiness:
+    def __init__(self) -> None:
+        self.ready = False
+        # step -> how long it took in seconds
+        self.steps: Dict[str, float] = {}
+
+    async def run_step(self, name: str, step: Callable[[], Awaitable[None]]) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), timeout=config.WARMUP_STEP_TIMEOUT)
+        except Exception as ex:
+            logger.warning(f"Warm-up step {name} failed: {ex!r}")
+        self.steps[name] = time.perf_counter() - start
+
+    async def warm_up(self, app) -> None:
+        if config.WARMUP_ENABLED:
+            start = time.perf_counter()
+            await self.run_step("database", warm_connections)
+            await self.run_step("jwks", prefetch_jwks)
+            await self.run_step("requests", lambda: request_paths(app))
+            elapsed = time.perf_counter() - start
+            steps = ", ".join(
+                f"{name} {seconds * 1000:.0f} ms"
+                for name, seconds in self.steps.items()
+            )
+            logger.info(f"Warm-up completed in {elapsed * 1000:.0f} ms ({steps})")
+        self.ready = True
+
+
+readiness = Readiness()